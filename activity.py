@@ -0,0 +1,219 @@
+"""群聊的实时活跃度统计
+
+每个群在内存中保存最近 window 分钟的环形缓冲区，每个槽位对应一分钟：该分钟的消息总数和 {发送人 ID: 消息数}。
+消息到达时只更新当前分钟的槽位；查询最近 N 分钟的发言排名或消息速率时合并对应的槽位，不访问数据库。
+超过 window 分钟没有消息的群被移除，群的数量超过 max_groups 时淘汰最久没有消息的群，内存占用有上限。
+
+统计只包含插件启动之后收到的消息。时间均为毫秒时间戳，now 参数用于测试。
+
+本模块不依赖 AstrBot。
+"""
+import heapq
+import re
+import time
+from collections import OrderedDict
+
+MINUTE_MS = 60 * 1000
+
+MINUTES_PATTERN = re.compile(r'^(?:最近|近)?\s*(\d+)\s*(分钟|分|小时|时)$')
+
+
+def parse_minutes(text, max_minutes):
+    """解析触发词后面的时间窗口（如 "30分钟"、"1小时"），返回分钟数，没有可识别的时间窗口时返回 None
+
+    超过 max_minutes 时抛出 ValueError，错误信息可以直接回复给用户。
+    """
+    match = MINUTES_PATTERN.match((text or '').strip())
+    if match is None:
+        return None
+    minutes = int(match.group(1)) * (60 if match.group(2) in ('小时', '时') else 1)
+    if minutes <= 0:
+        raise ValueError("时间窗口必须大于 0")
+    if minutes > max_minutes:
+        raise ValueError(f"最多统计最近 {max_minutes} 分钟")
+    return minutes
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class GroupWindow:
+    """一个群最近 size 分钟的每分钟消息数，以及每分钟各发送人的消息数"""
+
+    __slots__ = ('minutes', 'totals', 'senders', 'running', 'names', 'pruned_round', 'last_minute', 'alerted_minute')
+
+    def __init__(self, size, minute):
+        # 各槽位当前对应的分钟（毫秒时间戳 // 60000），-1 表示空槽
+        self.minutes = [-1] * size
+        self.totals = [0] * size
+        self.senders = [None] * size
+        # 全部槽位合计的 {发送人 ID: 消息数}，槽位被复用时减去旧的计数；查询较长的时间段时从合计中减去段外的槽位
+        self.running = {}
+        # 发送人 ID -> 最近使用的昵称，只保留窗口内发过言的人
+        self.names = {}
+        self.pruned_round = minute // size
+        self.last_minute = minute
+        self.alerted_minute = None
+
+    def add(self, minute, sender_id, name):
+        size = len(self.minutes)
+        i = minute % size
+        if self.minutes[i] != minute:
+            if self.senders[i]:
+                self.subtract(self.running, self.senders[i])
+            if minute // size != self.pruned_round:
+                # 每转一圈清理一次已经移出窗口的发送人昵称
+                self.pruned_round = minute // size
+                self.names = {sender: self.names[sender] for sender in self.running if sender in self.names}
+            self.minutes[i] = minute
+            self.totals[i] = 0
+            self.senders[i] = {}
+        self.totals[i] += 1
+        counts = self.senders[i]
+        counts[sender_id] = counts.get(sender_id, 0) + 1
+        self.running[sender_id] = self.running.get(sender_id, 0) + 1
+        self.names[sender_id] = name or sender_id
+        if minute > self.last_minute:
+            self.last_minute = minute
+
+    def slots(self, first, last):
+        """分钟在 [first, last] 内的槽位下标"""
+        return [i for i, minute in enumerate(self.minutes) if first <= minute <= last]
+
+    def count(self, first, last):
+        return sum(self.totals[i] for i in self.slots(first, last))
+
+    @staticmethod
+    def subtract(totals, counts):
+        for sender_id, count in counts.items():
+            left = totals[sender_id] - count
+            if left:
+                totals[sender_id] = left
+            else:
+                del totals[sender_id]
+
+    def sender_counts(self, first, last):
+        """分钟在 [first, last] 内的 {发送人 ID: 消息数}，合并段内或段外槽位中较少的一边"""
+        inside = self.slots(first, last)
+        used = [i for i, minute in enumerate(self.minutes) if minute >= 0]
+        if len(inside) * 2 <= len(used):
+            totals = {}
+            for i in inside:
+                for sender_id, count in self.senders[i].items():
+                    totals[sender_id] = totals.get(sender_id, 0) + count
+            return totals
+        totals = dict(self.running)
+        inside = set(inside)
+        for i in used:
+            if i not in inside:
+                self.subtract(totals, self.senders[i])
+        return totals
+
+
+class ActivityTracker:
+    """按群保存最近 window_minutes 分钟的消息计数，并据此检测消息量的突增
+
+    消息突增：最近 spike_minutes 分钟的平均速率达到窗口内此前各分钟平均速率的 spike_ratio 倍，
+    且最近 spike_minutes 分钟至少有 spike_min_messages 条消息（避免冷清的群偶尔几条消息就被判为突增）。
+    插件启动不足半个窗口时没有可靠的基准，不做判断；之后被移除的冷清群重新出现时，此前没有消息的分钟计为 0。
+    """
+
+    def __init__(self, window_minutes=60, max_groups=1000, spike_minutes=5, spike_ratio=3.0, spike_min_messages=30):
+        self.window_minutes = window_minutes
+        self.max_groups = max_groups
+        self.spike_minutes = min(spike_minutes, window_minutes - 1)
+        self.spike_ratio = spike_ratio
+        self.spike_min_messages = spike_min_messages
+        # 群 ID -> GroupWindow，按最近一条消息的时间排列，最久没有消息的群在最前
+        self.groups = OrderedDict()
+        self.swept_minute = None
+        self.evicted = 0
+        # 收到第一条消息的分钟，此前没有统计，不能计入基准
+        self.started_minute = None
+
+    def record(self, group_id, sender_id, name=None, timestamp=None, now=None):
+        """记录一条消息，timestamp 为消息时间（毫秒），早于窗口的消息被忽略，晚于当前时间的按当前时间计"""
+        now = now_ms() if now is None else now
+        current = now // MINUTE_MS
+        if self.started_minute is None:
+            self.started_minute = current
+        minute = current if timestamp is None else min(timestamp // MINUTE_MS, current)
+        if minute <= current - self.window_minutes:
+            return
+        window = self.groups.get(group_id)
+        if window is None:
+            window = self.groups[group_id] = GroupWindow(self.window_minutes, current)
+            while len(self.groups) > self.max_groups:
+                self.groups.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.groups.move_to_end(group_id)
+        window.add(minute, sender_id, name)
+        if self.swept_minute != current:
+            self.sweep(current)
+
+    def sweep(self, current):
+        """移除整个窗口内都没有消息的群；groups 按最近消息排列，从最前面开始检查"""
+        self.swept_minute = current
+        while self.groups:
+            group_id, window = next(iter(self.groups.items()))
+            if window.last_minute > current - self.window_minutes:
+                break
+            del self.groups[group_id]
+            self.evicted += 1
+
+    def top_senders(self, group_id, minutes, limit=10, now=None):
+        """最近 minutes 分钟（含当前分钟）的 (消息数, 发言人数, [(昵称, 消息数), ...])，按消息数降序"""
+        window = self.groups.get(group_id)
+        if window is None:
+            return 0, 0, []
+        current = (now_ms() if now is None else now) // MINUTE_MS
+        totals = window.sender_counts(current - minutes + 1, current)
+        ranked = heapq.nlargest(limit, totals.items(), key=lambda item: item[1])
+        return sum(totals.values()), len(totals), [(window.names.get(sender, sender), count) for sender, count in ranked]
+
+    def spike(self, group_id, now=None):
+        """消息突增的判断依据，群不在统计中时返回 None
+
+        返回 {'recent': 最近 spike_minutes 分钟的消息数, 'recent_rate': 其每分钟消息数,
+              'baseline_rate': 此前每分钟的平均消息数, 'baseline_minutes': 基准的分钟数,
+              'ratio': 两者之比（基准为 0 时为 None）, 'ready': 基准是否足够, 'spiking': 是否突增}
+        """
+        window = self.groups.get(group_id)
+        if window is None:
+            return None
+        current = (now_ms() if now is None else now) // MINUTE_MS
+        split = current - self.spike_minutes
+        recent = window.count(split + 1, current)
+        # 基准从开始统计的那一分钟或窗口起点算起，没有消息的分钟计为 0
+        baseline_first = max(self.started_minute, current - self.window_minutes + 1)
+        baseline_minutes = max(split - baseline_first + 1, 0)
+        baseline = window.count(baseline_first, split)
+        recent_rate = recent / self.spike_minutes
+        baseline_rate = baseline / baseline_minutes if baseline_minutes else 0.0
+        ready = baseline_minutes >= self.window_minutes // 2
+        spiking = ready and recent >= self.spike_min_messages and recent_rate >= self.spike_ratio * baseline_rate
+        return {
+            'recent': recent,
+            'recent_rate': recent_rate,
+            'baseline_rate': baseline_rate,
+            'baseline_minutes': baseline_minutes,
+            'ratio': recent_rate / baseline_rate if baseline_rate else None,
+            'ready': ready,
+            'spiking': spiking,
+        }
+
+    def check_alert(self, group_id, now=None):
+        """群正处于消息突增且距上次提醒已超过一个窗口时返回 spike() 的结果并记录提醒时间，否则返回 None"""
+        window = self.groups.get(group_id)
+        if window is None:
+            return None
+        current = (now_ms() if now is None else now) // MINUTE_MS
+        if window.alerted_minute is not None and current - window.alerted_minute < self.window_minutes:
+            return None
+        info = self.spike(group_id, now)
+        if info is None or not info['spiking']:
+            return None
+        window.alerted_minute = current
+        return info
@@ -0,0 +1,698 @@
+"""聊天记录插件的离线基准测试
+
+使用 stubs/ 中的 AstrBot 替身加载 main.py，不需要运行机器人：
+
+    python benchmarks/bench.py                      # 完整测试：每天 1 万、10 万、100 万条消息
+    python benchmarks/bench.py --quick              # 快速测试：每天 1 万条
+    python benchmarks/bench.py --sizes 50000 -o result.json
+
+测试项目：
+- ingest: SqliteChatStorePlugin.on_message 的写入吞吐量和单次调用延迟（直接写入 / 批量写入模式）
+- spool:  数据库被其他连接锁住时消息写入暂存文件的延迟，以及解锁后回放到数据库的速度
+- query:  /sqlchat_query 各查询模式的延迟
+- activity: 最近一小时的消息计入内存活跃度统计的耗时，以及 "最近活跃"、"群聊热度" 在最活跃的群中的查询延迟
+- charts: 群聊排名、热力图、词云、趋势从触发到返回图片的延迟（未命中 / 命中缓存）和峰值内存
+- range:  同样的图表统计最近 --range-days 天（如 "群聊排名 30天"）时的延迟和峰值内存
+- startup: 在新进程中导入插件模块的耗时和常驻内存，以及后台预热的耗时和预热后的常驻内存
+- compress: 混入 --long-share 比例长消息的数据集在关闭 / 开启消息压缩时的文件大小、已有记录的压缩迁移耗时，
+            以及导出全部记录、扫描最近几天的记录和按群查询的延迟
+
+结果以 JSON 格式写入 --output（默认 benchmarks/results/<时间>.json），可用 compare.py 比较两次运行。
+"""
+import argparse
+import asyncio
+import atexit
+import gc
+import importlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import warnings
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, 'stubs'))
+
+from astrbot.api.event import AstrMessageEvent  # noqa: E402
+from astrbot.api.message_components import Image  # noqa: E402
+from traffic import TrafficGenerator  # noqa: E402
+
+
+def plugin_path():
+    """AstrBot 以包的形式加载插件（main.py 使用相对导入），这里同样将插件目录作为包 chat_plugin 导入
+
+    绘图和跨群统计的子进程（forkserver / spawn）按模块名重新导入 chat_plugin.charts 等模块，
+    因此在临时目录中建立指向插件目录的符号链接 chat_plugin，返回该临时目录（子进程继承 sys.path）；
+    无法建立符号链接时（如未开启开发者模式的 Windows）返回 None。
+    """
+    link_dir = tempfile.mkdtemp(prefix='chat_plugin_')
+    # rmtree 只删除符号链接本身，不会进入插件目录
+    atexit.register(shutil.rmtree, link_dir, True)
+    try:
+        os.symlink(REPO_DIR, os.path.join(link_dir, 'chat_plugin'), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        return None
+    return link_dir
+
+
+def load_plugin(path):
+    """导入插件；path 为 None 时只在本进程中注册包，子进程无法导入插件模块（需要 --render-workers 0）"""
+    if path is not None:
+        sys.path.insert(0, path)
+    else:
+        package = types.ModuleType('chat_plugin')
+        package.__path__ = [REPO_DIR]
+        sys.modules['chat_plugin'] = package
+    return importlib.import_module('chat_plugin.main')
+
+
+PLUGIN_PATH = plugin_path()
+plugin = load_plugin(PLUGIN_PATH)
+storage = plugin.storage
+# 运行环境可能没有中文字体，缺字形的警告与性能无关
+warnings.filterwarnings('ignore', message='Glyph .* missing from font')
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def percentile(values, q):
+    """已排序列表的百分位数（线性插值）"""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(seconds):
+    """将一组耗时（秒）汇总为毫秒统计"""
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) if values else None,
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': values[-1] if values else None,
+    }
+
+
+def fresh_db(workdir, name):
+    path = os.path.join(workdir, name)
+    for suffix in ('', '-wal', '-shm', '.spool'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.rmtree(storage.partition_dir(path), ignore_errors=True)
+    return path
+
+
+async def open_store(db_path, **options):
+    """按 initialize() 的流程打开存储插件，但不读写插件目录下的配置文件"""
+    store = plugin.SqliteChatStorePlugin(None)
+    store.db_path = db_path
+    store.enabled = True
+    # 基准测试期间不让后台的分词和归档任务干扰计时
+    store.term_index_interval = 86400
+    store.maintenance_interval = 86400
+    for key, value in options.items():
+        setattr(store, key, value)
+    await store.open_storage()
+    return store
+
+
+def open_stats(db_path, render_workers, renderer='fast'):
+    """按 initialize() 的流程创建统计插件"""
+    stats = plugin.ChatStatsPlugin(None)
+    stats.db_path = db_path
+    stats.render_workers = render_workers
+    stats.chart_renderer = renderer
+    stats.render_semaphore = asyncio.Semaphore(stats.render_concurrency)
+    stats.render_cache = plugin.RenderCache(stats.cache_max_mb * 1024 * 1024, stats.cache_ttl)
+    stats.chat_storage = storage.acquire(db_path)
+    return stats
+
+
+async def bench_ingest(workdir, count, write_behind, seed):
+    """on_message 的写入吞吐量；批量写入模式的计时包含最后一批写入完成"""
+    db_path = fresh_db(workdir, 'ingest.db')
+    # 不启用暂存文件，队列满时 on_message 等待，计时包含全部消息的写入
+    store = await open_store(db_path, write_behind=write_behind, spool_enabled=False)
+    events = [AstrMessageEvent(m.message_str, m) for m in TrafficGenerator(seed=seed).messages(count)]
+
+    latencies = []
+    start = time.perf_counter()
+    for event in events:
+        t = time.perf_counter()
+        await store.on_message(event)
+        latencies.append(time.perf_counter() - t)
+    await store.stop_writer()
+    elapsed = time.perf_counter() - start
+
+    rows = await store.chat_storage.read(storage.count_records)
+    await store.terminate()
+    return {
+        'rows': rows,
+        'elapsed_s': elapsed,
+        'messages_per_s': count / elapsed,
+        'on_message': summarize(latencies),
+    }
+
+
+async def bench_spool(workdir, count, seed):
+    """数据库被其他连接锁住时消息写入暂存文件的延迟，以及解锁后回放到数据库的速度"""
+    db_path = fresh_db(workdir, 'spool.db')
+    store = await open_store(db_path, spool_replay_interval=86400)
+    events = [AstrMessageEvent(m.message_str, m) for m in TrafficGenerator(seed=seed).messages(count)]
+    # 缩短写连接的锁等待，只测量写入暂存文件的部分
+    await store.chat_storage.write(lambda conn: conn.execute("PRAGMA busy_timeout=10"))
+    blocker = sqlite3.connect(db_path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")
+    try:
+        latencies = []
+        for event in events:
+            t = time.perf_counter()
+            await store.on_message(event)
+            latencies.append(time.perf_counter() - t)
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    spool_bytes = store.spool.size
+
+    start = time.perf_counter()
+    await store.replay_spool()
+    replay_s = time.perf_counter() - start
+    rows = await store.chat_storage.read(storage.count_records)
+    await store.terminate()
+    return {
+        'rows': rows,
+        'spool_bytes': spool_bytes,
+        'on_message': summarize(latencies),
+        'replay_s': replay_s,
+        'replay_messages_per_s': count / replay_s,
+    }
+
+
+def bench_activity(count, seed, repeat):
+    """count 条消息均匀分布在最近一小时内，计入实时活跃度统计后查询最活跃的群"""
+    tracker = plugin.activity.ActivityTracker()
+    generator = TrafficGenerator(seed=seed)
+    now = int(time.time() * 1000)
+    messages = [
+        (message.group_id, message.sender.user_id, message.sender.nickname, now - 3600 * 1000 + i * 3600 * 1000 // count)
+        for i, message in enumerate(generator.messages(count))
+    ]
+    start = time.perf_counter()
+    for group_id, sender_id, name, timestamp in messages:
+        tracker.record(group_id, sender_id, name, timestamp)
+    record_s = time.perf_counter() - start
+
+    group_id = generator.groups[0]
+    metrics = {
+        'groups': len(tracker.groups),
+        'record_us': record_s / count * 1e6,
+        'busiest_group_messages': tracker.top_senders(group_id, 60)[0],
+    }
+    queries = {
+        'recent_10min': lambda: tracker.top_senders(group_id, 10),
+        'recent_60min': lambda: tracker.top_senders(group_id, 60),
+        'spike': lambda: tracker.spike(group_id),
+    }
+    for name, query in queries.items():
+        latencies = []
+        for _ in range(repeat * 100):
+            t = time.perf_counter()
+            query()
+            latencies.append(time.perf_counter() - t)
+        metrics[name] = summarize(latencies)
+    return metrics
+
+
+async def build_dataset(db_path, rows, seed, fts, days=1, long_share=0.0):
+    """生成截至今天的 days 天、每天 rows 条消息并批量写入，然后建立词频索引，返回 (存储插件, 生成器, 指标)"""
+    store = await open_store(db_path, fts_enabled=fts)
+    generator = TrafficGenerator(seed=seed, long_share=long_share)
+    today = datetime.now().date()
+
+    start = time.perf_counter()
+    batch = []
+    for offset in range(days - 1, -1, -1):
+        for message in generator.messages(rows, today - timedelta(days=offset)):
+            batch.append(store.build_record(AstrMessageEvent(message.message_str, message)))
+            if len(batch) >= 20000:
+                await store.insert_records(batch)
+                batch = []
+    await store.insert_records(batch)
+    load_s = time.perf_counter() - start
+    rows *= days
+
+    start = time.perf_counter()
+    while True:
+        end, max_id = await store.chat_storage.write(storage.index_terms, 20000)
+        if end >= max_id:
+            break
+    terms_s = time.perf_counter() - start
+
+    metrics = {
+        'load_s': load_s,
+        'load_rows_per_s': rows / load_s,
+        'term_index_s': terms_s,
+        'term_index_rows_per_s': rows / terms_s if terms_s else None,
+        'db_bytes': os.path.getsize(db_path),
+    }
+    return store, generator, metrics
+
+
+async def collect(generator):
+    """消费插件处理函数产出的全部结果"""
+    return [result async for result in generator]
+
+
+async def bench_queries(store, generator, repeat, fts):
+    """/sqlchat_query 各模式的延迟"""
+    group_id = generator.groups[0]
+    sender_id = generator.members[group_id][0][0]
+    commands = {
+        'sender': f"/sqlchat_query sender {sender_id} 10",
+        'group': f"/sqlchat_query group {group_id} 10",
+        'all': "/sqlchat_query all",
+    }
+    if fts:
+        commands['text'] = "/sqlchat_query text 火锅 10"
+
+    message = next(TrafficGenerator(seed=0).messages(1))
+    results = {}
+    for mode, command in commands.items():
+        latencies = []
+        ok = True
+        for _ in range(repeat):
+            t = time.perf_counter()
+            replies = await collect(store.query(AstrMessageEvent(command, message)))
+            latencies.append(time.perf_counter() - t)
+            text = replies[0].chain[0] if replies and replies[0].chain else ''
+            ok = ok and isinstance(text, str) and '失败' not in text and '未找到' not in text
+        results[mode] = {'ok': ok, **summarize(latencies)}
+    return results
+
+
+async def run_trigger(stats, trigger, message):
+    """发送触发词（可以带时间范围），返回图片字节（没有生成图片时返回 None）"""
+    replies = await collect(stats.on_message(AstrMessageEvent(trigger, message)))
+    for reply in replies:
+        for component in reply.chain:
+            if isinstance(component, Image):
+                return component.data
+    return None
+
+
+async def bench_charts(stats, generator, repeat, period=''):
+    """各图表从触发到返回的延迟和峰值内存，period 为触发词后面的时间范围"""
+    message = next(TrafficGenerator(seed=0).messages(1))
+    message.group_id = generator.groups[0]
+    results = {}
+    for trigger in stats.triggers:
+        text = f"{trigger} {period}".strip()
+        # 预热：启动绘图进程、导入 wordcloud 等一次性开销不计入
+        image = await run_trigger(stats, text, message)
+
+        uncached = []
+        for _ in range(repeat):
+            stats.render_cache.clear()
+            t = time.perf_counter()
+            await run_trigger(stats, text, message)
+            uncached.append(time.perf_counter() - t)
+
+        cached = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            await run_trigger(stats, text, message)
+            cached.append(time.perf_counter() - t)
+
+        # 峰值内存单独测量，tracemalloc 会拖慢执行，不与延迟一起统计
+        stats.render_cache.clear()
+        gc.collect()
+        tracemalloc.start()
+        await run_trigger(stats, text, message)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[trigger] = {
+            'ok': image is not None,
+            'image_bytes': len(image) if image else 0,
+            'uncached': summarize(uncached),
+            'cached': summarize(cached),
+            'peak_memory_mb': peak / 1024 / 1024,
+        }
+    return results
+
+
+async def bench_global_report(stats, days, repeat):
+    """/sqlchat_report 的跨群统计（进程池并行查询聚合表）和生成图片、CSV 的总耗时"""
+    period = stats.today_range(days)
+    scan, total = [], []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        report = await stats.scan_all_groups(*period)
+        scan.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        await stats.build_global_report(period)
+        total.append(time.perf_counter() - t)
+    return {
+        'workers': stats.global_report_workers or os.cpu_count(),
+        'groups': len(report.hours),
+        'messages': report.messages,
+        'scan': summarize(scan),
+        'total': summarize(total),
+    }
+
+
+def vacuum(conn):
+    """整理数据库文件并截断 WAL，使文件大小只反映实际数据"""
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def scan_records(conn, since_ms=None):
+    """逐批读取（并解压）记录，返回读取的消息正文总字符数"""
+    return sum(len(row[4]) for rows in storage.iter_records(conn, since_ms=since_ms) for row in rows)
+
+
+async def bench_compression(workdir, rows, days, seed, long_share, repeat):
+    """同一数据集在关闭 / 开启消息压缩时的文件大小和读取延迟；开启时按升级已有数据库的流程在后台迁移"""
+    results = {}
+    for mode in ('off', 'on'):
+        db_path = fresh_db(workdir, f'compress_{mode}.db')
+        store, generator, metrics = await build_dataset(db_path, rows, seed, False, days, long_share)
+        try:
+            if mode == 'on':
+                start = time.perf_counter()
+                store.compress_messages = True
+                await store.create_tables()
+                await store.run_backfills()
+                metrics['migrate_s'] = time.perf_counter() - start
+            await store.chat_storage.write(vacuum)
+            metrics['db_bytes'] = os.path.getsize(db_path)
+
+            chars = await store.chat_storage.read(scan_records)
+            export = []
+            for _ in range(repeat):
+                t = time.perf_counter()
+                await store.chat_storage.read(scan_records)
+                export.append(time.perf_counter() - t)
+            recent = []
+            for _ in range(repeat):
+                t = time.perf_counter()
+                await store.chat_storage.read(scan_records, storage.days_ago_ms(2))
+                recent.append(time.perf_counter() - t)
+            query = []
+            message = next(TrafficGenerator(seed=0).messages(1))
+            command = AstrMessageEvent(f"/sqlchat_query group {generator.groups[0]} 200", message)
+            for _ in range(repeat):
+                t = time.perf_counter()
+                await collect(store.query(command))
+                query.append(time.perf_counter() - t)
+            metrics.update({
+                'message_chars': chars,
+                'export_all': summarize(export),
+                'scan_recent_days': summarize(recent),
+                'query_group_200': summarize(query),
+            })
+        finally:
+            await store.terminate()
+        results[mode] = metrics
+    return results
+
+
+# 在新的 Python 进程中冷启动插件：参数为 stubs 目录、插件目录和绘图进程数，结果以 JSON 输出到最后一行
+STARTUP_PROBE = r'''
+import asyncio, importlib, json, sys, time, types
+sys.path.insert(0, sys.argv[1])
+import astrbot.api.event  # noqa: F401  AstrBot 自身的导入不计入
+
+start = time.perf_counter()
+if sys.argv[4]:
+    sys.path.insert(0, sys.argv[4])
+else:
+    package = types.ModuleType('chat_plugin')
+    package.__path__ = [sys.argv[2]]
+    sys.modules['chat_plugin'] = package
+plugin = importlib.import_module('chat_plugin.main')
+import_s = time.perf_counter() - start
+import_rss = plugin.metrics.process_rss_bytes() or 0
+heavy = sorted(name for name in ('matplotlib', 'pandas', 'numpy', 'jieba', 'wordcloud') if name in sys.modules)
+
+stats = plugin.ChatStatsPlugin(None)
+stats.render_workers = int(sys.argv[3])
+
+
+async def warm_up():
+    start = time.perf_counter()
+    await stats.run_warm_up()
+    elapsed = time.perf_counter() - start
+    workers = stats.render_workers_rss()
+    if stats.render_pool is not None:
+        stats.render_pool.shutdown()
+    return elapsed, workers[1] if workers else 0
+
+
+warm_up_s, workers_rss = asyncio.run(warm_up())
+print(json.dumps({
+    'import_s': import_s,
+    'import_rss_mb': import_rss / 1024 / 1024,
+    'heavy_modules_after_import': heavy,
+    'warm_up_s': warm_up_s,
+    'warm_up_rss_mb': (plugin.metrics.process_rss_bytes() or 0) / 1024 / 1024,
+    'warm_up_workers_rss_mb': workers_rss / 1024 / 1024,
+}))
+'''
+
+
+def bench_startup(render_workers, runs=3):
+    """在新进程中导入插件并预热，重复 runs 次，返回各次的结果和导入耗时的统计"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [
+                sys.executable, '-c', STARTUP_PROBE,
+                os.path.join(BENCH_DIR, 'stubs'), REPO_DIR, str(render_workers), PLUGIN_PATH or '',
+            ],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import': summarize([sample['import_s'] for sample in samples]),
+        'import_rss_mb': min(sample['import_rss_mb'] for sample in samples),
+        'heavy_modules_after_import': samples[0]['heavy_modules_after_import'],
+        'warm_up': summarize([sample['warm_up_s'] for sample in samples]),
+        'warm_up_rss_mb': min(sample['warm_up_rss_mb'] for sample in samples),
+        'warm_up_workers_rss_mb': min(sample['warm_up_workers_rss_mb'] for sample in samples),
+    }
+
+
+def git_revision():
+    """当前提交和是否有未提交的修改，不在 git 仓库中时返回 None"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_mb():
+    """进程的最大常驻内存（MB），ru_maxrss 在 macOS 上以字节为单位，在 Linux 上以 KB 为单位"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def environment():
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+async def run(args, workdir):
+    results = []
+
+    log("[startup] 冷启动导入插件并预热")
+    metrics = bench_startup(args.render_workers)
+    log(f"  导入 p50 {metrics['import']['p50_ms']:.0f} ms，内存 {metrics['import_rss_mb']:.0f} MB；"
+        f"预热 p50 {metrics['warm_up']['p50_ms']:.0f} ms，内存 {metrics['warm_up_rss_mb']:.0f} MB，"
+        f"绘图进程 {metrics['warm_up_workers_rss_mb']:.0f} MB")
+    results.append({'benchmark': 'startup', 'params': {'render_workers': args.render_workers}, 'metrics': metrics})
+
+    for write_behind in (False, True):
+        mode = 'write_behind' if write_behind else 'direct'
+        log(f"[ingest] {mode}: {args.ingest} 条消息")
+        metrics = await bench_ingest(workdir, args.ingest, write_behind, args.seed)
+        log(f"  {metrics['messages_per_s']:.0f} 条/秒，p99 {metrics['on_message']['p99_ms']:.3f} ms")
+        results.append({'benchmark': 'ingest', 'params': {'mode': mode, 'messages': args.ingest}, 'metrics': metrics})
+
+    spool_count = max(args.ingest // 5, 1)
+    log(f"[spool] 数据库锁定时写入 {spool_count} 条消息")
+    metrics = await bench_spool(workdir, spool_count, args.seed)
+    log(f"  暂存 p99 {metrics['on_message']['p99_ms']:.2f} ms，回放 {metrics['replay_messages_per_s']:.0f} 条/秒，"
+        f"回放后记录数 {metrics['rows']}")
+    results.append({'benchmark': 'spool', 'params': {'messages': spool_count}, 'metrics': metrics})
+
+    log(f"[activity] 最近一小时 {args.ingest} 条消息")
+    metrics = bench_activity(args.ingest, args.seed, args.repeat)
+    log(f"  计入 {metrics['record_us']:.2f} µs/条；最近 10 分钟 p50 {metrics['recent_10min']['p50_ms'] * 1000:.1f} µs，"
+        f"最近 60 分钟 p50 {metrics['recent_60min']['p50_ms'] * 1000:.1f} µs，热度 p50 {metrics['spike']['p50_ms'] * 1000:.1f} µs")
+    results.append({'benchmark': 'activity', 'params': {'messages': args.ingest}, 'metrics': metrics})
+
+    for rows in args.sizes:
+        log(f"[dataset] 生成当天 {rows} 条消息")
+        db_path = fresh_db(workdir, f'day_{rows}.db')
+        store, generator, metrics = await build_dataset(db_path, rows, args.seed, not args.no_fts)
+        log(f"  写入 {metrics['load_rows_per_s']:.0f} 条/秒，分词 {metrics['term_index_rows_per_s']:.0f} 条/秒")
+        results.append({'benchmark': 'dataset', 'params': {'rows_per_day': rows}, 'metrics': metrics})
+
+        log(f"[query] {rows} 条/天")
+        for mode, metrics in (await bench_queries(store, generator, args.repeat, not args.no_fts)).items():
+            log(f"  {mode}: p50 {metrics['p50_ms']:.2f} ms")
+            results.append({'benchmark': 'query', 'params': {'rows_per_day': rows, 'mode': mode}, 'metrics': metrics})
+
+        log(f"[charts] {rows} 条/天")
+        stats = open_stats(db_path, args.render_workers, args.renderer)
+        try:
+            for trigger, metrics in (await bench_charts(stats, generator, args.repeat)).items():
+                log(f"  {trigger}: 未命中缓存 p50 {metrics['uncached']['p50_ms']:.1f} ms，"
+                    f"命中缓存 p50 {metrics['cached']['p50_ms']:.2f} ms，峰值内存 {metrics['peak_memory_mb']:.1f} MB")
+                results.append({
+                    'benchmark': 'charts',
+                    'params': {'rows_per_day': rows, 'chart': trigger, 'render_workers': args.render_workers},
+                    'metrics': metrics,
+                })
+        finally:
+            await stats.terminate()
+            await store.terminate()
+
+    if args.range_days > 1:
+        days, rows = args.range_days, args.range_rows
+        log(f"[dataset] 生成最近 {days} 天、每天 {rows} 条消息")
+        db_path = fresh_db(workdir, f'range_{days}.db')
+        store, generator, metrics = await build_dataset(db_path, rows, args.seed, False, days)
+        log(f"  写入 {metrics['load_rows_per_s']:.0f} 条/秒，分词 {metrics['term_index_rows_per_s']:.0f} 条/秒")
+        results.append({'benchmark': 'dataset', 'params': {'rows_per_day': rows, 'days': days}, 'metrics': metrics})
+
+        log(f"[range] 最近 {days} 天")
+        stats = open_stats(db_path, args.render_workers, args.renderer)
+        try:
+            for trigger, metrics in (await bench_charts(stats, generator, args.repeat, f"{days}天")).items():
+                log(f"  {trigger}: 未命中缓存 p50 {metrics['uncached']['p50_ms']:.1f} ms，"
+                    f"命中缓存 p50 {metrics['cached']['p50_ms']:.2f} ms，峰值内存 {metrics['peak_memory_mb']:.1f} MB")
+                results.append({
+                    'benchmark': 'range',
+                    'params': {'rows_per_day': rows, 'days': days, 'chart': trigger, 'render_workers': args.render_workers},
+                    'metrics': metrics,
+                })
+
+            log(f"[global_report] 全部群最近 {days} 天")
+            metrics = await bench_global_report(stats, days, args.repeat)
+            log(f"  {metrics['workers']} 个进程统计 {metrics['groups']} 个群：p50 {metrics['scan']['p50_ms']:.0f} ms，"
+                f"含图片和 CSV p50 {metrics['total']['p50_ms']:.0f} ms")
+            results.append({'benchmark': 'global_report', 'params': {'rows_per_day': rows, 'days': days}, 'metrics': metrics})
+        finally:
+            await stats.terminate()
+            await store.terminate()
+
+    if args.compress_rows > 0:
+        days, rows = args.compress_days, args.compress_rows
+        log(f"[compress] 最近 {days} 天、每天 {rows} 条消息，长消息占 {args.long_share:.0%}")
+        for mode, metrics in (await bench_compression(workdir, rows, days, args.seed, args.long_share, args.repeat)).items():
+            log(f"  {mode}: 文件 {metrics['db_bytes'] / 1024 / 1024:.1f} MB，导出全部 p50 {metrics['export_all']['p50_ms']:.1f} ms，"
+                f"最近 2 天 p50 {metrics['scan_recent_days']['p50_ms']:.1f} ms"
+                + (f"，迁移 {metrics['migrate_s']:.1f} 秒" if 'migrate_s' in metrics else ''))
+            results.append({
+                'benchmark': 'compress',
+                'params': {'rows_per_day': rows, 'days': days, 'long_share': args.long_share, 'mode': mode},
+                'metrics': metrics,
+            })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聊天记录插件离线基准测试")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="每天的消息数，逗号分隔")
+    parser.add_argument('--ingest', type=int, default=20000, help="写入吞吐量测试的消息数")
+    parser.add_argument('--repeat', type=int, default=10, help="每个查询/图表的重复次数")
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help="绘图进程数，默认 0 表示在本进程中绘图，峰值内存才包含绘图部分")
+    parser.add_argument('--renderer', choices=('fast', 'matplotlib'), default='fast',
+                        help="排名和热力图的绘图后端（统计插件的 chart_renderer）")
+    parser.add_argument('--range-days', type=int, default=30, help="多日统计测试的天数，0 表示跳过")
+    parser.add_argument('--range-rows', type=int, default=20000, help="多日统计测试中每天的消息数")
+    parser.add_argument('--compress-days', type=int, default=7, help="消息压缩测试的天数")
+    parser.add_argument('--compress-rows', type=int, default=20000, help="消息压缩测试中每天的消息数，0 表示跳过")
+    parser.add_argument('--long-share', type=float, default=0.05, help="消息压缩测试中长消息（文章卡片、日志）的比例")
+    parser.add_argument('--no-fts', action='store_true', help="不建立全文索引（跳过 text 查询）")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    parser.add_argument('--quick', action='store_true',
+                        help="快速测试：--sizes 10000 --ingest 5000 --repeat 3 --range-days 7 --range-rows 2000 --compress-rows 2000")
+    parser.add_argument('--workdir', help="数据库目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('-o', '--output', help="结果文件路径，- 表示标准输出")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes, args.ingest, args.repeat = '10000', 5000, 3
+        args.range_days, args.range_rows = 7, 2000
+        args.compress_rows = 2000
+    args.sizes = [int(size) for size in str(args.sizes).split(',') if size.strip()]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='chat_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = asyncio.run(run(args, workdir))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'environment': environment(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')},
+        'max_rss_mb': max_rss_mb(),
+        'results': results,
+    }
+    output = args.output or os.path.join(BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output == '-':
+        print(text)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        log(f"结果已写入 {output}")
+
+
+if __name__ == '__main__':
+    main()
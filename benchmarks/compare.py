@@ -0,0 +1,66 @@
+"""比较两次基准测试的结果
+
+    python benchmarks/compare.py benchmarks/results/旧.json benchmarks/results/新.json
+
+按 (测试项目, 参数) 对齐两次运行的结果，逐项列出数值指标及变化比例。
+"""
+import argparse
+import json
+
+
+def flatten(metrics, prefix=''):
+    """将嵌套的指标展开为 {'uncached.p50_ms': 值}，只保留数值"""
+    flat = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def index_results(report):
+    """{(测试项目, 参数): 展开后的指标}"""
+    indexed = {}
+    for result in report['results']:
+        params = ', '.join(f"{key}={value}" for key, value in sorted(result['params'].items()))
+        indexed[(result['benchmark'], params)] = flatten(result['metrics'])
+    return indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较两次基准测试的结果")
+    parser.add_argument('baseline', help="作为基准的结果文件")
+    parser.add_argument('current', help="要比较的结果文件")
+    parser.add_argument('--metric', action='append', help="只显示名称包含该文本的指标，可重复指定")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    for label, report in (('基准', baseline), ('当前', current)):
+        git = report['environment'].get('git') or {}
+        print(f"{label}: {report['environment']['time']} {git.get('commit', '')[:10]}{' (有未提交修改)' if git.get('dirty') else ''}")
+
+    old_results = index_results(baseline)
+    new_results = index_results(current)
+    for key, new_metrics in new_results.items():
+        old_metrics = old_results.get(key)
+        if old_metrics is None:
+            continue
+        print(f"\n[{key[0]}] {key[1]}")
+        for name, new_value in new_metrics.items():
+            if args.metric and not any(text in name for text in args.metric):
+                continue
+            old_value = old_metrics.get(name)
+            if old_value is None:
+                continue
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else ''
+            print(f"  {name:<28} {old_value:>14.3f} {new_value:>14.3f} {change:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""基准测试使用的 AstrBot 替身，只实现插件用到的接口"""
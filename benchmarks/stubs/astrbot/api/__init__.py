@@ -0,0 +1,4 @@
+"""astrbot.api 的替身：提供 logger"""
+import logging
+
+logger = logging.getLogger("astrbot")
@@ -0,0 +1,67 @@
+"""astrbot.api.event 的替身：消息事件、结果构造器和装饰器"""
+
+
+class MessageEventResult:
+    """消息结果，chain 中依次保存文本和消息组件"""
+
+    def __init__(self):
+        self.chain = []
+
+    def add_plain(self, text):
+        self.chain.append(text)
+        return self
+
+    def add_component(self, component):
+        self.chain.append(component)
+        return self
+
+    def build(self):
+        return self
+
+
+class AstrMessageEvent:
+    """消息事件，message_obj 为 astrbot.api.platform.AstrBotMessage"""
+
+    def __init__(self, message_str, message_obj, platform_name="gewechat", admin=True):
+        self.message_str = message_str
+        self.message_obj = message_obj
+        self.platform_name = platform_name
+        self.admin = admin
+
+    def get_platform_name(self):
+        return self.platform_name
+
+    def is_admin(self):
+        return self.admin
+
+    @staticmethod
+    def plain_result(text):
+        return MessageEventResult().add_plain(text)
+
+    @staticmethod
+    def result_builder():
+        return MessageEventResult()
+
+
+class EventMessageType:
+    ALL = "all"
+
+
+class _Filter:
+    """装饰器只返回原函数，基准测试直接调用处理函数"""
+    EventMessageType = EventMessageType
+
+    @staticmethod
+    def command(name, *args, **kwargs):
+        return lambda func: func
+
+    @staticmethod
+    def event_message_type(message_type, *args, **kwargs):
+        return lambda func: func
+
+    @staticmethod
+    def permission_type(permission_type, *args, **kwargs):
+        return lambda func: func
+
+
+filter = _Filter()
@@ -0,0 +1,13 @@
+"""astrbot.api.message_components 的替身：图片和文件组件"""
+
+
+class Image:
+    def __init__(self, data):
+        self.data = data
+
+
+class File:
+    def __init__(self, name="", file="", url=""):
+        self.name = name
+        self.file = file
+        self.url = url
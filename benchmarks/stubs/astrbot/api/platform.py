@@ -0,0 +1,16 @@
+"""astrbot.api.platform 的替身：平台消息对象"""
+
+
+class MessageMember:
+    def __init__(self, user_id, nickname=None):
+        self.user_id = user_id
+        self.nickname = nickname
+
+
+class AstrBotMessage:
+    def __init__(self, group_id, sender, message_str, timestamp, message_id):
+        self.group_id = group_id
+        self.sender = sender
+        self.message_str = message_str
+        self.timestamp = timestamp
+        self.message_id = message_id
@@ -0,0 +1,14 @@
+"""astrbot.api.star 的替身：插件基类和注册装饰器"""
+
+
+class Context:
+    pass
+
+
+class Star:
+    def __init__(self, context):
+        self.context = context
+
+
+def register(name, author, desc, version, *args, **kwargs):
+    return lambda cls: cls
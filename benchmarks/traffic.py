@@ -0,0 +1,139 @@
+"""模拟 gewechat 群聊流量的消息生成器
+
+群的活跃度和群内成员的发言量都服从长尾（Zipf）分布，发言时间按一天内的作息起伏分布，
+消息内容由常用中文词语随机组合，并混入表情、链接、图片占位等 gewechat 常见内容；
+long_share 大于 0 时，按该比例混入转发的文章卡片（XML）和粘贴的日志等长消息。
+相同的 seed 生成相同的数据，便于多次运行之间比较。
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from astrbot.api.platform import AstrBotMessage, MessageMember
+
+# 各小时的相对活跃度：凌晨最低，午间和晚间两个高峰
+HOUR_WEIGHTS = [
+    2, 1, 1, 1, 1, 2, 4, 8, 12, 14, 15, 16,
+    18, 14, 12, 13, 14, 14, 15, 18, 22, 24, 18, 8,
+]
+
+WORDS = """
+今天 明天 周末 上班 下班 加班 开会 老板 同事 项目 需求 上线 测试 代码 服务器 数据库 接口 文档
+吃饭 午饭 晚饭 外卖 火锅 烧烤 奶茶 咖啡 水果 超市 快递 地铁 打车 堵车 天气 下雨 降温 出太阳
+电影 综艺 游戏 比赛 球赛 足球 篮球 跑步 健身 旅游 机票 酒店 攻略 北京 上海 广州 深圳 杭州 成都
+孩子 学校 作业 考试 放假 老师 家长 生日 聚会 礼物 红包 转账 群主 通知 报名 投票 链接 视频 照片
+价格 优惠 打折 下单 退款 客服 手机 电脑 耳机 充电 系统 更新 软件 问题 方案 时间 地点 安排 确认
+""".split()
+
+FILLERS = ["我觉得", "有没有人", "大家", "刚才", "其实", "听说", "谁知道", "求推荐", "提醒一下", "顺便问下"]
+ENDINGS = ["", "", "", "吗", "吧", "啊", "呢", "哈哈", "哈哈哈", "！", "？", "。", "～"]
+SPECIAL = [
+    "[图片]", "[语音]", "[视频]", "[动画表情]", "[微笑]", "[捂脸]", "[旺柴]", "[强]", "[OK]",
+    "https://mp.weixin.qq.com/s/{token}", "https://b23.tv/{token}",
+]
+
+# gewechat 转发文章卡片的 XML 结构
+ARTICLE_CARD = (
+    '<?xml version="1.0"?>\n<msg>\n\t<appmsg appid="" sdkver="0">\n\t\t<title>{title}</title>\n'
+    '\t\t<des>{des}</des>\n\t\t<action>view</action>\n\t\t<type>5</type>\n\t\t<showtype>0</showtype>\n'
+    '\t\t<url>https://mp.weixin.qq.com/s?__biz={biz}&amp;mid={mid}&amp;idx=1&amp;sn={sn}&amp;chksm={sn}#rd</url>\n'
+    '\t\t<thumburl>https://mmbiz.qpic.cn/mmbiz_jpg/{sn}/640?wx_fmt=jpeg</thumburl>\n'
+    '\t\t<appattach>\n\t\t\t<totallen>0</totallen>\n\t\t\t<attachid />\n\t\t\t<fileext />\n\t\t</appattach>\n'
+    '\t\t<sourceusername>gh_{biz}</sourceusername>\n\t\t<sourcedisplayname>{source}</sourcedisplayname>\n'
+    '\t</appmsg>\n\t<fromusername>{sender}</fromusername>\n\t<scene>0</scene>\n'
+    '\t<appinfo>\n\t\t<version>1</version>\n\t\t<appname></appname>\n\t</appinfo>\n</msg>'
+)
+LOG_LEVELS = ["INFO", "INFO", "INFO", "WARN", "ERROR"]
+
+
+def zipf_weights(n, s=1.1):
+    """长尾分布的权重：排名第 k 的对象权重为 1 / k^s"""
+    return [1.0 / (k ** s) for k in range(1, n + 1)]
+
+
+class TrafficGenerator:
+    """按天生成模拟消息"""
+
+    def __init__(self, groups=20, members=(20, 400), seed=42, long_share=0.0):
+        self.rng = random.Random(seed)
+        self.long_share = long_share
+        self.groups = [f"{self.rng.randrange(10 ** 10, 10 ** 11)}@chatroom" for _ in range(groups)]
+        self.group_weights = zipf_weights(groups)
+        # 每个群的成员及其累积发言权重（预先累加，避免每条消息重新计算）
+        self.members = {}
+        for group_id in self.groups:
+            size = self.rng.randint(*members)
+            ids = [f"wxid_{self.rng.randrange(10 ** 6):06d}" for _ in range(size)]
+            self.members[group_id] = (ids, list(itertools.accumulate(zipf_weights(size, 0.9))))
+        self.nicknames = {}
+        self.message_id = 0
+
+    def nickname(self, sender_id):
+        if sender_id not in self.nicknames:
+            self.nicknames[sender_id] = self.rng.choice(["小", "老", "阿", ""]) + self.rng.choice(WORDS)
+        return self.nicknames[sender_id]
+
+    def long_text(self, sender_id):
+        """一条长消息：转发的文章卡片或粘贴的日志"""
+        rng = self.rng
+        def words(n):
+            return "".join(rng.choice(WORDS) for _ in range(n))
+
+        if rng.random() < 0.7:
+            return ARTICLE_CARD.format(
+                title=words(rng.randint(3, 8)), des=words(rng.randint(8, 30)), source=words(2),
+                biz=f"MzA{rng.getrandbits(40):010x}", mid=rng.getrandbits(32), sn=f"{rng.getrandbits(128):032x}",
+                sender=sender_id,
+            )
+        lines = []
+        for _ in range(rng.randint(5, 30)):
+            lines.append(
+                f"2024-05-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+                f" {rng.choice(LOG_LEVELS)} [worker-{rng.randint(1, 8)}] GET /api/v1/{rng.choice(WORDS[:20])}/"
+                f"{rng.randint(1, 99999)} status={rng.choice((200, 200, 200, 404, 500))} cost={rng.randint(1, 3000)}ms"
+            )
+        return "\n".join(lines)
+
+    def text(self, sender_id=''):
+        """一条消息的文本：以词语组合为主，偶尔为表情、链接或占位文本（以及 long_share 比例的长消息）"""
+        rng = self.rng
+        if self.long_share and rng.random() < self.long_share:
+            return self.long_text(sender_id)
+        roll = rng.random()
+        if roll < 0.08:
+            return rng.choice(SPECIAL).format(token=f"{rng.getrandbits(40):010x}")
+        parts = []
+        if rng.random() < 0.3:
+            parts.append(rng.choice(FILLERS))
+        parts.extend(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+        text = "".join(parts) + rng.choice(ENDINGS)
+        if roll > 0.95:
+            text += rng.choice(SPECIAL[4:9])
+        return text
+
+    def timestamps(self, count, day):
+        """某天（date）内 count 个按作息分布、升序排列的毫秒时间戳"""
+        start = datetime(day.year, day.month, day.day)
+        hours = self.rng.choices(range(24), weights=HOUR_WEIGHTS, k=count)
+        stamps = []
+        for hour in hours:
+            moment = start + timedelta(hours=hour, seconds=self.rng.random() * 3600)
+            stamps.append(int(moment.timestamp() * 1000))
+        stamps.sort()
+        return stamps
+
+    def messages(self, count, day=None):
+        """生成某天（默认今天）的 count 条消息，产出 AstrBotMessage"""
+        day = day or datetime.now().date()
+        group_ids = self.rng.choices(self.groups, weights=self.group_weights, k=count)
+        for group_id, timestamp in zip(group_ids, self.timestamps(count, day)):
+            ids, cum_weights = self.members[group_id]
+            sender_id = self.rng.choices(ids, cum_weights=cum_weights)[0]
+            self.message_id += 1
+            yield AstrBotMessage(
+                group_id=group_id,
+                sender=MessageMember(sender_id, self.nickname(sender_id)),
+                message_str=self.text(sender_id),
+                timestamp=timestamp,
+                message_id=str(self.message_id),
+            )
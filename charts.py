@@ -0,0 +1,201 @@
+"""群聊统计图表的绘制函数
+
+这些函数只接收普通的 Python 数据并返回 PNG 字节，不访问数据库、不依赖 AstrBot，
+可以在进程池中执行。每次调用创建独立的 Figure 对象，不使用 pyplot 的全局状态。
+matplotlib 和 wordcloud 在第一次绘图（或调用 warm_up）时才导入，只加载本模块几乎没有开销。
+"""
+import io
+import os
+import threading
+import time
+
+# 当前线程最近一次 PNG 编码的耗时，供 timed 区分绘制与编码
+_timing = threading.local()
+
+
+def use_agg():
+    """导入 matplotlib 并选择非交互式后端"""
+    import matplotlib
+    matplotlib.use('Agg')  # 非交互式后端，避免需要显示界面（wordcloud 内部会用到 pyplot）
+
+
+def new_figure(figsize):
+    """创建 Figure，第一次调用时导入 matplotlib 并选择非交互式后端"""
+    use_agg()
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize)
+
+
+def figure_to_png(fig):
+    """将 Figure 编码为 PNG 字节"""
+    start = time.perf_counter()
+    img_buf = io.BytesIO()
+    fig.savefig(img_buf, format='png')
+    _timing.encode = time.perf_counter() - start
+    return img_buf.getvalue()
+
+
+def timed(func, *args):
+    """调用绘制函数，返回 (PNG 字节, 绘制耗时, 编码耗时)，可在进程池中执行"""
+    _timing.encode = 0.0
+    start = time.perf_counter()
+    data = func(*args)
+    elapsed = time.perf_counter() - start
+    return data, elapsed - _timing.encode, _timing.encode
+
+
+def render_ranking(names, counts, title='今日群聊排名'):
+    """绘制群聊排名条形图，names 与 counts 按消息数量降序排列"""
+    fig = new_figure((10, 6))
+    ax = fig.add_subplot()
+    positions = range(len(names))
+    ax.bar(positions, counts, color='skyblue')
+    ax.set_xticks(list(positions))
+    ax.set_xticklabels(names, rotation=90)
+    ax.set_title(title)
+    ax.set_xlabel('发送人')
+    ax.set_ylabel('消息数量')
+    fig.tight_layout()
+    return figure_to_png(fig)
+
+
+def render_heatmap(senders, heatmap_data, title='今日群聊热力图', ylabel='发送人'):
+    """绘制 行 × 24 小时 的热力图，heatmap_data 每行对应 senders 中的一项（发送人或星期）"""
+    fig = new_figure((12, 8))
+    ax = fig.add_subplot()
+    im = ax.imshow(heatmap_data, cmap='YlOrRd')
+
+    # 设置标签
+    ax.set_yticks(list(range(len(senders))))
+    ax.set_yticklabels(senders)
+    ax.set_xticks(list(range(24)))
+    ax.set_xticklabels([f"{h}时" for h in range(24)])
+    ax.set_xlabel('时间')
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    # 添加颜色条
+    fig.colorbar(im, ax=ax, label='消息数量')
+
+    fig.tight_layout()
+    return figure_to_png(fig)
+
+
+def render_trend(labels, counts, senders, title='群聊趋势', xlabel='日期'):
+    """绘制消息数（折线）和发言人数（虚线，右侧坐标轴）的变化趋势"""
+    fig = new_figure((12, 6))
+    ax = fig.add_subplot()
+    positions = list(range(len(labels)))
+    ax.plot(positions, counts, color='steelblue', marker='o', markersize=3, label='消息数')
+    ax.set_ylabel('消息数量')
+    ax.set_ylim(bottom=0)
+    other = ax.twinx()
+    other.plot(positions, senders, color='darkorange', linestyle='--', label='发言人数')
+    other.set_ylabel('发言人数')
+    other.set_ylim(bottom=0)
+
+    # 标签较多时间隔显示，最多约 15 个
+    step = max(1, len(labels) // 15)
+    ax.set_xticks(positions[::step])
+    ax.set_xticklabels(labels[::step], rotation=45, ha='right')
+    ax.set_xlabel(xlabel)
+    ax.set_title(title)
+    fig.legend(loc='upper left', bbox_to_anchor=(0, 1), bbox_transform=ax.transAxes)
+    fig.tight_layout()
+    return figure_to_png(fig)
+
+
+def render_global_report(groups, group_counts, senders, sender_counts, hour_shares, title='全部群聊报告'):
+    """跨群报告：消息数最多的群和发送人（横向条形图），以及这些群每小时消息占比的热力图
+
+    groups/group_counts、senders/sender_counts 按消息数降序排列，hour_shares 每行对应 groups 中的一个群。
+    """
+    fig = new_figure((14, 8 + 0.3 * len(groups)))
+    grid = fig.add_gridspec(2, 2, height_ratios=[1, 1])
+    for position, names, counts, label in (
+        (grid[0, 0], groups, group_counts, '群'),
+        (grid[0, 1], senders, sender_counts, '发送人'),
+    ):
+        ax = fig.add_subplot(position)
+        # 横向条形图自下而上排列，倒序后第一名在最上面
+        ax.barh(range(len(names)), counts[::-1], color='skyblue')
+        ax.set_yticks(list(range(len(names))))
+        ax.set_yticklabels(names[::-1])
+        ax.set_xlabel('消息数量')
+        ax.set_title(f"消息数最多的{label}")
+
+    ax = fig.add_subplot(grid[1, :])
+    im = ax.imshow(hour_shares, cmap='YlOrRd', aspect='auto')
+    ax.set_yticks(list(range(len(groups))))
+    ax.set_yticklabels(groups)
+    ax.set_xticks(list(range(24)))
+    ax.set_xticklabels([f"{h}时" for h in range(24)])
+    ax.set_xlabel('时间')
+    ax.set_title('各群每小时消息占比')
+    fig.colorbar(im, ax=ax, label='占该群消息的比例（%）')
+
+    fig.suptitle(title)
+    fig.tight_layout()
+    return figure_to_png(fig)
+
+
+# 常见系统的中文字体位置，未配置 font_path 时依次查找
+CJK_FONT_CANDIDATES = [
+    '/System/Library/Fonts/PingFang.ttc',  # macOS
+    '/System/Library/Fonts/STHeiti Medium.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',  # Debian/Ubuntu fonts-noto-cjk
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',  # Arch/Fedora
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',  # 文泉驿
+    '/usr/share/fonts/wqy-microhei/wqy-microhei.ttc',
+    'C:\\Windows\\Fonts\\msyh.ttc',  # Windows 微软雅黑
+    'C:\\Windows\\Fonts\\simhei.ttf',
+]
+
+
+def find_cjk_font(font_path=''):
+    """返回可用的中文字体路径：优先使用配置的路径，否则查找常见系统字体，找不到时返回 None"""
+    if font_path:
+        return font_path
+    for candidate in CJK_FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def render_wordcloud(frequencies, font_path=None, max_words=100):
+    """根据 {词: 词频} 绘制词云"""
+    from wordcloud import WordCloud
+
+    # 直接使用预先统计好的词频，不再对全文分词
+    wordcloud = WordCloud(
+        font_path=font_path,
+        width=800,
+        height=400,
+        background_color='white',
+        max_words=max_words,
+        contour_width=1,
+        contour_color='steelblue'
+    ).generate_from_frequencies(frequencies)
+
+    # 创建图像
+    fig = new_figure((10, 6))
+    ax = fig.add_subplot()
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+    fig.tight_layout()
+    return figure_to_png(fig)
+
+
+def warm_up():
+    """预先导入 matplotlib 和 wordcloud，加载字体列表并绘制一张小图，返回耗时（秒），可在进程池中执行"""
+    start = time.perf_counter()
+    import wordcloud  # noqa: F401
+    # 第一次导入 font_manager 时读取（或重建）matplotlib 的字体列表缓存
+    from matplotlib import font_manager  # noqa: F401
+    fig = new_figure((2, 1))
+    ax = fig.add_subplot()
+    ax.plot([0, 1], [0, 1])
+    ax.set_title('warm up')
+    figure_to_png(fig)
+    return time.perf_counter() - start
@@ -0,0 +1,327 @@
+"""聊天记录批量导入/导出工具
+
+在插件目录下直接运行，读写插件使用的 SQLite 数据库，不依赖 AstrBot：
+
+    python chat_cli.py import history.jsonl
+    python chat_cli.py export backup.csv --group xxx@chatroom --since 2024-01-01 --until 2024-02-01
+    python chat_cli.py dedup
+    python chat_cli.py compress --min-bytes 256
+
+导入支持 JSONL 和 CSV（首行为列名），分块写入，每块的进度与数据在同一事务中提交，
+中断后重新执行同一命令会从断点继续；与已有记录的 (平台, 群, message_id) 重复的行会被跳过。导出支持 CSV、JSONL 和 Parquet（需要安装 pyarrow），
+逐批读取并写出，内存占用与数据量无关，压缩保存的消息导出时自动解压。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import storage
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = "sqlite_chat_store_config.json"
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def default_db_path():
+    """与插件相同：优先使用配置文件中的 db_path，否则为插件目录下的 chat_records.db"""
+    db_path = os.path.join(PLUGIN_DIR, "chat_records.db")
+    config_path = os.path.join(PLUGIN_DIR, CONFIG_FILE)
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            db_path = json.load(f).get("db_path", db_path)
+    return db_path
+
+
+def detect_format(path, fmt):
+    """未指定格式时根据扩展名判断"""
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if ext in ('json', 'ndjson'):
+        ext = 'jsonl'
+    if ext not in FORMATS:
+        raise SystemExit(f"无法根据扩展名判断文件格式，请使用 --format 指定: {path}")
+    return ext
+
+
+def parse_time(value):
+    """解析时间：毫秒/秒时间戳或 ISO 格式文本，返回本地时间的 datetime"""
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000 if value > 1000000000000 else value)
+    dt = datetime.fromisoformat(str(value).strip())
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+def to_record(row, platform):
+    """将一行导入数据转换为插入记录（字段顺序见 storage.RECORD_FIELDS），缺少必要字段时返回 None"""
+    sender_id = row.get('sender_id')
+    message = row.get('message')
+    # 优先使用导出文件中的毫秒时间戳 ts，其次为 timestamp
+    time_value = row.get('ts') or row.get('timestamp')
+    if not sender_id or message is None or time_value in (None, ''):
+        return None
+    try:
+        msg_time = parse_time(time_value)
+    except (ValueError, TypeError, OverflowError, OSError):
+        return None
+    return (
+        row.get('group_id') or None,
+        str(sender_id),
+        row.get('sender_name') or str(sender_id),
+        str(message),
+        msg_time.isoformat(),
+        storage.to_epoch_ms(msg_time),
+        str(row['message_id']) if row.get('message_id') not in (None, '') else None,
+        row.get('platform') or platform
+    )
+
+
+def read_rows(path, fmt):
+    """逐行读取导入文件，产出字典"""
+    if fmt == 'jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield {}
+    elif fmt == 'csv':
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+    else:
+        raise SystemExit(f"不支持导入 {fmt} 格式")
+
+
+def import_file(args):
+    """分块导入聊天记录，支持断点续传"""
+    fmt = detect_format(args.input, args.format)
+    checkpoint_key = f"import:{os.path.abspath(args.input)}"
+    conn = storage.connect_writer(args.db)
+    has_fts = storage.table_exists(conn.cursor(), 'chat_fts')
+    storage.create_tables(conn, has_fts)
+
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = ?", (checkpoint_key,)).fetchone()
+    done = int(row[0]) if row and not args.restart else 0
+    if done:
+        print(f"从断点继续：跳过已处理的 {done} 行", file=sys.stderr)
+
+    if not args.keep_indexes:
+        # 导入期间不维护二级索引，导入结束后一次性重建，比逐行更新索引快得多
+        storage.drop_record_indexes(conn.cursor())
+        conn.commit()
+
+    processed = imported = skipped = duplicates = 0
+    batch = []
+    start = time.monotonic()
+    try:
+        for row in read_rows(args.input, fmt):
+            processed += 1
+            if processed <= done:
+                continue
+            record = to_record(row, args.platform) if isinstance(row, dict) else None
+            if record is None:
+                skipped += 1
+            else:
+                batch.append(record)
+            if len(batch) >= args.chunk_size:
+                inserted, _ = storage.insert_records(conn, batch, has_fts, checkpoint=(checkpoint_key, str(processed)))
+                imported += inserted
+                duplicates += len(batch) - inserted
+                batch = []
+                elapsed = time.monotonic() - start
+                print(f"已导入 {imported} 条（{imported / max(elapsed, 1e-6):.0f} 条/秒）", file=sys.stderr)
+        inserted, _ = storage.insert_records(conn, batch, has_fts, checkpoint=(checkpoint_key, str(processed)))
+        imported += inserted
+        duplicates += len(batch) - inserted
+    finally:
+        # Ctrl+C 不会触发 insert_records 中的回滚，先丢弃未提交的半块数据，断点与数据保持一致
+        conn.rollback()
+        if not args.keep_indexes:
+            # 中断时同样重建索引；进程被强制结束时，插件下次启动会自动补建
+            print("正在重建索引...", file=sys.stderr)
+            storage.create_record_indexes(conn.cursor())
+            conn.commit()
+        conn.close()
+
+    elapsed = time.monotonic() - start
+    print(f"导入完成：新增 {imported} 条，跳过重复记录 {duplicates} 条、无效行 {skipped} 条，用时 {elapsed:.1f} 秒")
+
+
+def write_csv(batches, out):
+    writer = csv.writer(out)
+    writer.writerow(storage.RECORD_COLUMNS.split(', '))
+    for rows in batches:
+        writer.writerows(rows)
+        yield len(rows)
+
+
+def write_jsonl(batches, out):
+    columns = storage.RECORD_COLUMNS.split(', ')
+    for rows in batches:
+        out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+        yield len(rows)
+
+
+def write_parquet(batches, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("导出 Parquet 需要安装 pyarrow: pip install pyarrow")
+    types = {'id': pa.int64(), 'ts': pa.int64()}
+    columns = storage.RECORD_COLUMNS.split(', ')
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in columns])
+    # 每批写成一个 row group，内存中只保留当前批次
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            data = {column: list(values) for column, values in zip(columns, zip(*rows))}
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            yield len(rows)
+
+
+def parse_bound(value):
+    """解析导出的时间范围：YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS，返回毫秒时间戳"""
+    if not value:
+        return None
+    return storage.to_epoch_ms(parse_time(value))
+
+
+def export_file(args):
+    """按群和时间范围流式导出聊天记录"""
+    fmt = detect_format(args.output, args.format) if args.output != '-' else (args.format or 'jsonl')
+    if not os.path.exists(args.db):
+        raise SystemExit(f"数据库不存在: {args.db}")
+    conn = storage.connect_reader(args.db)
+    batches = storage.iter_records(
+        conn, args.group, parse_bound(args.since), parse_bound(args.until), batch_size=args.chunk_size
+    )
+
+    exported = 0
+    start = time.monotonic()
+    try:
+        if fmt == 'parquet':
+            if args.output == '-':
+                raise SystemExit("Parquet 格式不支持输出到标准输出")
+            progress = write_parquet(batches, args.output)
+            for count in progress:
+                exported += count
+        else:
+            out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+            try:
+                progress = write_csv(batches, out) if fmt == 'csv' else write_jsonl(batches, out)
+                for count in progress:
+                    exported += count
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+    finally:
+        batches.close()
+        conn.close()
+
+    elapsed = time.monotonic() - start
+    print(f"导出完成：共 {exported} 条，用时 {elapsed:.1f} 秒", file=sys.stderr)
+
+
+def dedup(args):
+    """立即执行（或继续）旧数据库的重复记录清理，插件未运行时使用；插件运行时会在后台自动完成"""
+    conn = storage.connect_writer(args.db)
+    try:
+        storage.create_tables(conn, storage.table_exists(conn.cursor(), 'chat_fts'))
+        if 'dedup' not in storage.pending_backfills(conn):
+            print(f"没有待清理的重复记录（已清理 {storage.removed_duplicates(conn)} 条）")
+            return
+        start = time.monotonic()
+        while True:
+            pos, upto = storage.run_backfill_chunk(conn, 'dedup', args.chunk_size)
+            print(f"已检查 {pos}/{upto}", file=sys.stderr)
+            if pos >= upto:
+                break
+        elapsed = time.monotonic() - start
+        print(f"清理完成：共删除重复记录 {storage.removed_duplicates(conn)} 条，用时 {elapsed:.1f} 秒")
+    finally:
+        conn.close()
+
+
+def compress(args):
+    """立即压缩已有的长消息，插件未运行时使用；插件配置了 compress_messages 时会在后台自动完成"""
+    conn = storage.connect_writer(args.db)
+    try:
+        storage.create_tables(conn, storage.table_exists(conn.cursor(), 'chat_fts'))
+        before = os.path.getsize(args.db)
+        storage.configure_compression(conn, args.min_bytes)
+        if args.min_bytes <= 0:
+            print("已停止压缩新消息，已压缩的消息仍可正常读取")
+            return
+        dict_id = storage.train_dictionary(conn, force=args.retrain)
+        if dict_id is not None:
+            print(f"已训练压缩字典 {dict_id}")
+        if args.retrain or 'compress' not in storage.pending_backfills(conn):
+            # 重新检查全部记录：调高阈值或更换字典后没有登记回填
+            storage.schedule_backfill(conn.cursor(), 'compress')
+            conn.commit()
+        start = time.monotonic()
+        while 'compress' in storage.pending_backfills(conn):
+            pos, upto = storage.run_backfill_chunk(conn, 'compress', args.chunk_size)
+            print(f"已检查 {pos}/{upto}", file=sys.stderr)
+        # 原地更新只会在页内留下空隙，插件未运行时直接 VACUUM 整理
+        print("正在整理数据库文件...", file=sys.stderr)
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        elapsed = time.monotonic() - start
+        after = os.path.getsize(args.db)
+        print(f"压缩完成：数据库 {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB，用时 {elapsed:.1f} 秒")
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聊天记录批量导入/导出工具")
+    parser.add_argument('--db', default=None, help="数据库路径，默认与插件配置相同")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="从 JSONL/CSV 文件导入聊天记录")
+    import_parser.add_argument('input', help="导入文件路径")
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'), help="文件格式，默认根据扩展名判断")
+    import_parser.add_argument('--platform', default='gewechat', help="文件中没有 platform 字段时使用的平台名")
+    import_parser.add_argument('--chunk-size', type=int, default=50000, help="每个事务写入的行数")
+    import_parser.add_argument('--keep-indexes', action='store_true', help="导入期间保留索引（插件正在运行时使用）")
+    import_parser.add_argument('--restart', action='store_true', help="忽略断点，从头导入")
+    import_parser.set_defaults(func=import_file)
+
+    export_parser = subparsers.add_parser('export', help="导出聊天记录到 CSV/JSONL/Parquet 文件")
+    export_parser.add_argument('output', help="导出文件路径，- 表示标准输出")
+    export_parser.add_argument('--format', choices=FORMATS, help="文件格式，默认根据扩展名判断")
+    export_parser.add_argument('--group', help="只导出指定群的记录")
+    export_parser.add_argument('--since', help="起始时间（含），如 2024-01-01 或 2024-01-01 08:00:00")
+    export_parser.add_argument('--until', help="结束时间（不含）")
+    export_parser.add_argument('--chunk-size', type=int, default=5000, help="每批读取的行数")
+    export_parser.set_defaults(func=export_file)
+
+    dedup_parser = subparsers.add_parser('dedup', help="清理旧数据库中重复投递的消息")
+    dedup_parser.add_argument('--chunk-size', type=int, default=20000, help="每个事务检查的记录数")
+    dedup_parser.set_defaults(func=dedup)
+
+    compress_parser = subparsers.add_parser('compress', help="压缩已有的长消息（插件启动时以其配置为准）")
+    compress_parser.add_argument('--min-bytes', type=int, default=256, help="压缩阈值（字节），0 表示停止压缩新消息")
+    compress_parser.add_argument('--retrain', action='store_true', help="用最近的长消息重新训练字典")
+    compress_parser.add_argument('--chunk-size', type=int, default=20000, help="每个事务检查的记录数")
+    compress_parser.set_defaults(func=compress)
+
+    args = parser.parse_args(argv)
+    args.db = args.db or default_db_path()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""解析统计图表触发词后面的时间范围
+
+支持的写法（不含触发词本身）：
+    7天 / 30天          最近 N 天（含今天）
+    今天 / 昨天
+    本周 / 上周 / 本月 / 上月
+    2024-05-01          某一天
+    2024-05             某个月
+    2024-05-01~2024-05-31   日期范围，分隔符也可以是 到、至 或空格
+
+本模块不依赖 AstrBot。
+"""
+import re
+from datetime import date, datetime, timedelta
+
+DATE = r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})'
+DAYS_PATTERN = re.compile(r'^(?:最近|近)?\s*(\d+)\s*天$')
+DATE_PATTERN = re.compile(rf'^{DATE}$')
+MONTH_PATTERN = re.compile(r'^(\d{4})[-/.](\d{1,2})$')
+RANGE_PATTERN = re.compile(rf'^{DATE}\s*(?:~|～|到|至|\s)\s*{DATE}$')
+
+
+def month_bounds(year, month):
+    """某个月的第一天和最后一天"""
+    start = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return start, next_month - timedelta(days=1)
+
+
+def parse_range(text, today=None, max_days=366):
+    """解析时间范围，返回 (起始日期, 结束日期)（均含），没有可识别的时间范围时返回 None
+
+    范围超过 max_days 天或日期无效时抛出 ValueError，错误信息可以直接回复给用户。
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    today = today or datetime.now().date()
+
+    match = DAYS_PATTERN.match(text)
+    if match:
+        days = int(match.group(1))
+        if days <= 0:
+            raise ValueError("天数必须大于 0")
+        start, end = today - timedelta(days=days - 1), today
+    elif text == '今天':
+        start = end = today
+    elif text == '昨天':
+        start = end = today - timedelta(days=1)
+    elif text == '本周':
+        start, end = today - timedelta(days=today.weekday()), today
+    elif text == '上周':
+        end = today - timedelta(days=today.weekday() + 1)
+        start = end - timedelta(days=6)
+    elif text == '本月':
+        start, end = today.replace(day=1), today
+    elif text == '上月':
+        end = today.replace(day=1) - timedelta(days=1)
+        start = end.replace(day=1)
+    else:
+        try:
+            match = RANGE_PATTERN.match(text)
+            if match:
+                numbers = [int(value) for value in match.groups()]
+                start, end = date(*numbers[:3]), date(*numbers[3:])
+            elif DATE_PATTERN.match(text):
+                start = end = date(*(int(value) for value in DATE_PATTERN.match(text).groups()))
+            elif MONTH_PATTERN.match(text):
+                start, end = month_bounds(*(int(value) for value in MONTH_PATTERN.match(text).groups()))
+            else:
+                return None
+        except ValueError:
+            raise ValueError(f"无效的日期: {text}")
+
+    if start > end:
+        start, end = end, start
+    if (end - start).days + 1 > max_days:
+        raise ValueError(f"时间范围不能超过 {max_days} 天")
+    return start, end
+
+
+def iter_days(start, end):
+    """依次产出 [start, end] 内的每一天"""
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
@@ -0,0 +1,185 @@
+"""群聊排名和热力图的轻量绘图后端
+
+与 charts 中的同名函数接收相同的数据，区别在于：
+- 每个线程（进程池中即每个进程）按 (图表, 宽度, 字体) 缓存一套预先建好的 Figure 和 Agg 画布，
+  绘图时只更新条形高度、图像数据、刻度和标题等元素，不重新创建图表，也不调用 tight_layout
+- 中文字体只加载一次，所有文字直接使用该字体
+- 输出调色板量化的 PNG（颜色数很少的统计图基本无损）或 JPEG，图片尺寸由 width（像素）决定
+
+本模块不依赖 AstrBot，matplotlib 和 Pillow 在第一次绘图时才导入，可以在进程池中执行。
+"""
+import io
+import threading
+import time
+from functools import lru_cache
+
+try:
+    from . import charts
+except ImportError:
+    # 作为独立模块导入
+    import charts
+
+DPI = 100
+# 调色板量化的颜色数：条形图和热力图的颜色渐变用 64 色已经看不出差别
+PALETTE_COLORS = 64
+JPEG_QUALITY = 85
+# 横轴发送人昵称的最大显示长度，固定的边距下过长的昵称会超出图片
+MAX_LABEL_CHARS = 10
+TITLE_SIZE = 14
+
+# 每个线程各自的模板：(图表, 宽度, 字体) -> 模板对象；Figure 不是线程安全的
+_local = threading.local()
+
+
+@lru_cache(maxsize=4)
+def font_properties(font_path):
+    """字体路径对应的 FontProperties，同一进程中只加载一次；font_path 为空时使用 matplotlib 默认字体"""
+    from matplotlib.font_manager import FontProperties
+    return FontProperties(fname=font_path) if font_path else FontProperties()
+
+
+def template(cls, width, font_path, *args):
+    """返回当前线程中缓存的模板，不存在时创建"""
+    templates = getattr(_local, 'templates', None)
+    if templates is None:
+        templates = _local.templates = {}
+    key = (cls.__name__, width, font_path, *args)
+    instance = templates.get(key)
+    if instance is None:
+        instance = templates[key] = cls(width, font_properties(font_path), *args)
+    return instance
+
+
+def new_canvas(width, aspect):
+    """创建固定像素尺寸的 Figure 和 Agg 画布"""
+    charts.use_agg()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(width / DPI, width * aspect / DPI), dpi=DPI)
+    return fig, FigureCanvasAgg(fig)
+
+
+def encode(canvas, image_format):
+    """绘制画布并编码为调色板 PNG 或 JPEG"""
+    start = time.perf_counter()
+    canvas.draw()
+    from PIL import Image
+    width, height = canvas.get_width_height()
+    image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+    buf = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(buf, format='JPEG', quality=JPEG_QUALITY)
+    else:
+        # Pillow 9.1 之前量化方法是 Image 上的常量
+        method = getattr(Image, 'Quantize', Image).FASTOCTREE
+        image.quantize(PALETTE_COLORS, method=method).save(buf, format='PNG')
+    # 与 charts.figure_to_png 一致，编码耗时包含最终的绘制
+    charts._timing.encode = time.perf_counter() - start
+    return buf.getvalue()
+
+
+def short_label(name):
+    name = str(name)
+    return name if len(name) <= MAX_LABEL_CHARS else name[:MAX_LABEL_CHARS - 1] + '…'
+
+
+def axis_labels(fig, font, box, xlabel, ylabel):
+    """在坐标轴外的固定位置放置轴标题，返回 (横轴标题, 纵轴标题)
+
+    不使用 set_xlabel/set_ylabel：它们每次绘制都要测量全部刻度标签的大小来确定位置。
+    """
+    left, bottom, width, height = box
+    return (
+        fig.text(left + width / 2, 0.01, xlabel, ha='center', va='bottom', fontproperties=font),
+        fig.text(0.01, bottom + height / 2, ylabel, rotation=90, va='center', fontproperties=font),
+    )
+
+
+class RankingTemplate:
+    """排名条形图模板，预先创建 capacity 根条形和昵称标签，多余的隐藏"""
+
+    BOX = (0.08, 0.3, 0.9, 0.62)
+
+    def __init__(self, width, font, capacity):
+        self.fig, self.canvas = new_canvas(width, 0.6)
+        self.ax = self.fig.add_axes(self.BOX)
+        self.bars = self.ax.bar(range(capacity), [0] * capacity, color='skyblue')
+        # 昵称直接画在条形下方，不使用横轴刻度
+        self.ax.set_xticks([])
+        transform = self.ax.get_xaxis_transform()
+        self.labels = [
+            self.ax.text(i, -0.01, '', rotation=90, ha='center', va='top', fontproperties=font, transform=transform)
+            for i in range(capacity)
+        ]
+        self.title = self.ax.set_title('', fontproperties=font, fontsize=TITLE_SIZE)
+        axis_labels(self.fig, font, self.BOX, '发送人', '消息数量')
+
+    def update(self, names, counts, title):
+        n = len(counts)
+        for i, (bar, label) in enumerate(zip(self.bars, self.labels)):
+            visible = i < n
+            bar.set_visible(visible)
+            bar.set_height(counts[i] if visible else 0)
+            label.set_visible(visible)
+            label.set_text(short_label(names[i]) if visible else '')
+        self.ax.set_xlim(-0.5, max(n, 1) - 0.5)
+        self.ax.set_ylim(0, max(max(counts, default=0), 1) * 1.05)
+        self.title.set_text(title)
+
+
+class HeatmapTemplate:
+    """行 × 24 小时热力图模板，更新图像数据、行标签和颜色范围"""
+
+    # 左侧留出 MAX_LABEL_CHARS 个汉字宽的行标签
+    BOX = (0.17, 0.12, 0.73, 0.8)
+
+    def __init__(self, width, font):
+        import numpy as np
+        self.font = font
+        self.fig, self.canvas = new_canvas(width, 0.6)
+        self.ax = self.fig.add_axes(self.BOX)
+        self.image = self.ax.imshow(np.zeros((1, 24)), cmap='YlOrRd', aspect='auto', interpolation='nearest')
+        colorbar = self.fig.colorbar(self.image, cax=self.fig.add_axes((0.92, 0.12, 0.02, 0.8)))
+        colorbar.ax.tick_params(labelsize=8)
+        self.ax.set_xticks(range(24))
+        self.ax.set_xticklabels([str(h) for h in range(24)])
+        self.title = self.ax.set_title('', fontproperties=font, fontsize=TITLE_SIZE)
+        _, self.ylabel = axis_labels(self.fig, font, self.BOX, '时间（时）', '')
+
+    def update(self, rows, data, title, ylabel):
+        import numpy as np
+        values = np.asarray(data, dtype=float).reshape(len(rows), 24)
+        self.image.set_data(values)
+        self.image.set_extent((-0.5, 23.5, len(rows) - 0.5, -0.5))
+        self.image.set_clim(0, max(values.max(initial=0), 1))
+        self.ax.set_yticks(range(len(rows)))
+        self.ax.set_yticklabels([short_label(row) for row in rows], fontproperties=self.font)
+        self.ylabel.set_text(ylabel)
+        self.title.set_text(title)
+
+
+def render_ranking(names, counts, title='今日群聊排名', font_path=None, width=800, image_format='png'):
+    """绘制群聊排名条形图，names 与 counts 按消息数量降序排列"""
+    # 条形数按 2 的幂分档，人数变化时复用同一模板
+    capacity = 16
+    while capacity < len(counts):
+        capacity *= 2
+    chart = template(RankingTemplate, width, font_path, capacity)
+    chart.update(names, counts, title)
+    return encode(chart.canvas, image_format)
+
+
+def render_heatmap(senders, heatmap_data, title='今日群聊热力图', ylabel='发送人', font_path=None, width=800,
+                   image_format='png'):
+    """绘制 行 × 24 小时 的热力图，heatmap_data 每行对应 senders 中的一项（发送人或星期）"""
+    chart = template(HeatmapTemplate, width, font_path)
+    chart.update(senders, heatmap_data, title, ylabel)
+    return encode(chart.canvas, image_format)
+
+
+def warm_up(font_path=None, width=800, image_format='png'):
+    """预先加载字体、Pillow 并建好两个模板，返回耗时（秒），可在进程池中执行"""
+    start = time.perf_counter()
+    render_ranking(['warm up'], [1], 'warm up', font_path, width, image_format)
+    render_heatmap(['warm up'], [[0] * 24], 'warm up', '', font_path, width, image_format)
+    return time.perf_counter() - start
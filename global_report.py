@@ -0,0 +1,111 @@
+"""跨群统计报告：日期范围内消息数最多的群和发送人，以及各群按小时的消息分布
+
+只读取按 群/天/小时/发送人 预聚合的 chat_hourly_stats，不扫描聊天记录。全部群按顺序轮流分成若干块，
+每块由 scan_groups 在进程池中各自打开只读连接查询，只返回按群、按发送人汇总的计数，再由 GlobalReport 合并。
+各块的群互不重叠，发送人的消息数和所在群数直接相加即为精确值。
+
+本模块不依赖 AstrBot，scan_groups 可以在进程池中执行。
+"""
+import csv
+import heapq
+import os
+
+try:
+    from . import storage
+except ImportError:
+    # 作为独立模块导入
+    import storage
+
+
+def split_groups(group_ids, parts):
+    """把群轮流分成最多 parts 块，相邻（创建时间相近）的群分到不同的块"""
+    parts = min(parts, len(group_ids))
+    return [group_ids[i::parts] for i in range(parts)]
+
+
+def scan_groups(db_path, group_ids, start_day, end_day):
+    """查询一块群在 [start_day, end_day] 内的汇总计数，可在进程池中执行
+
+    返回 {'hours': {群 ID: 24 个小时的消息数}, 'group_senders': {群 ID: 发言人数},
+          'senders': {发送人 ID: [消息数, 发言的群数]}}，没有消息的群不返回。
+    """
+    hours = {}
+    group_senders = {}
+    senders = {}
+    conn = storage.connect_reader(db_path)
+    try:
+        for group_id in group_ids:
+            hour_rows = storage.group_hourly_totals(conn, group_id, start_day, end_day)
+            if not hour_rows:
+                continue
+            counts = hours[group_id] = [0] * 24
+            for hour, count in hour_rows:
+                counts[hour] = count
+            sender_rows = storage.group_sender_totals(conn, group_id, start_day, end_day)
+            group_senders[group_id] = len(sender_rows)
+            for sender_id, count in sender_rows:
+                entry = senders.get(sender_id)
+                if entry is None:
+                    senders[sender_id] = [count, 1]
+                else:
+                    entry[0] += count
+                    entry[1] += 1
+    finally:
+        conn.close()
+    return {'hours': hours, 'group_senders': group_senders, 'senders': senders}
+
+
+class GlobalReport:
+    """合并各块 scan_groups 的结果"""
+
+    def __init__(self, parts=()):
+        self.hours = {}
+        self.group_senders = {}
+        self.senders = {}
+        for part in parts:
+            self.merge(part)
+
+    def merge(self, part):
+        self.hours.update(part['hours'])
+        self.group_senders.update(part['group_senders'])
+        for sender_id, (count, groups) in part['senders'].items():
+            entry = self.senders.get(sender_id)
+            if entry is None:
+                self.senders[sender_id] = [count, groups]
+            else:
+                entry[0] += count
+                entry[1] += groups
+
+    @property
+    def messages(self):
+        return sum(sum(hours) for hours in self.hours.values())
+
+    def top_groups(self, limit):
+        """消息数最多的 limit 个群 [(群 ID, 消息数, 发言人数)]"""
+        totals = ((group_id, sum(hours)) for group_id, hours in self.hours.items())
+        ranked = heapq.nlargest(limit, totals, key=lambda item: item[1])
+        return [(group_id, count, self.group_senders.get(group_id, 0)) for group_id, count in ranked]
+
+    def top_senders(self, limit):
+        """消息数最多的 limit 个发送人 [(发送人 ID, 消息数, 发言的群数)]"""
+        ranked = heapq.nlargest(limit, self.senders.items(), key=lambda item: item[1][0])
+        return [(sender_id, count, groups) for sender_id, (count, groups) in ranked]
+
+    def hour_shares(self, group_ids):
+        """各群每小时的消息数占该群消息数的百分比，用于比较消息量相差很大的群的作息"""
+        rows = []
+        for group_id in group_ids:
+            hours = self.hours[group_id]
+            total = sum(hours) or 1
+            rows.append([count * 100 / total for count in hours])
+        return rows
+
+    def write_csv(self, path):
+        """按消息数降序写出每个群的消息数、发言人数、占比和 24 个小时的消息数（UTF-8 BOM，Excel 可直接打开）"""
+        total = self.messages or 1
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['群ID', '消息数', '发言人数', '占比(%)'] + [f"{h}时" for h in range(24)])
+            for group_id, count, senders in self.top_groups(len(self.hours)):
+                writer.writerow([group_id, count, senders, f"{count * 100 / total:.2f}"] + self.hours[group_id])
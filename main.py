@@ -4,30 +4,81 @@ from astrbot.api import logger
 import os
 import json
 import time
-import sqlite3
+import tempfile
+import hashlib
+# 插件模块的导入耗时从这里开始计算；matplotlib、pandas、jieba、wordcloud 都在第一次使用时才导入
+IMPORT_STARTED = time.perf_counter()
+import asyncio
+import multiprocessing
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')  # 非交互式后端，避免需要显示界面
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-import jieba
-from wordcloud import WordCloud
-import io
-from astrbot.api.message_components import Image
-import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from astrbot.api.message_components import Image, File
+from . import storage
+from . import charts
+from . import fast_charts
+from . import metrics
+from . import spool
+from . import date_range
+from . import activity
+from . import global_report
+from .render_cache import RenderCache
 
 @register("astrbot_plugin_sqlite_chat_store", "User", "存储 gewechat 聊天记录到 SQLite 数据库", "1.0.0")
 class SqliteChatStorePlugin(Star):
+    QUEUE_FULL = "批量写入队列已满"
+
     def __init__(self, context: Context):
         super().__init__(context)
-        self.db_conn = None
+        self.chat_storage = None
         self.db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_records.db")
         self.config_file = "sqlite_chat_store_config.json"
         self.enabled = False
+        # 异步批量写入（write-behind）配置
+        self.write_behind = False
+        self.write_batch_size = 500
+        self.write_max_latency_ms = 200
+        self.write_queue_size = 10000
+        # 消息全文索引（FTS5 + jieba 分词）
+        self.fts_enabled = False
+        # 词云词频索引：后台定期为新消息分词的间隔（秒）
+        self.term_index_interval = 10
+        # 只读连接池的大小和单次查询的超时时间（秒）
+        self.read_pool_size = 2
+        self.read_timeout = 30
+        # 分区与数据保留：超过 hot_days 天的记录按月移入归档分区，超过 retention_days 天的数据被删除（0 表示不启用）；
+        # 归档的记录不再有全文索引，默认不归档，以免 /sqlchat_query text 查不到旧消息
+        self.hot_days = 0
+        self.retention_days = 0
+        self.maintenance_interval = 3600
+        # 运行指标：metrics_file 不为空时定期写入 Prometheus 文本文件
+        self.metrics_file = ""
+        self.metrics_interval = 60
+        # 最近写入的消息 ID（LRU），重复投递的消息在写入数据库之前就被丢弃；0 表示只依靠数据库的唯一索引
+        self.dedup_cache_size = 10000
+        self.recent_ids = None
+        # 消息压缩：达到 compress_min_bytes 字节的消息用 zlib 和训练的字典压缩保存，读取时自动解压
+        self.compress_messages = False
+        self.compress_min_bytes = 256
+        # 消息暂存文件：写入数据库失败或批量写入队列已满时，消息暂存到 <db_path>.spool，数据库恢复后每隔 spool_replay_interval 秒回放
+        self.spool_enabled = True
+        self.spool_replay_interval = 5
+        self.spool = None
+        self.spool_replayed = 0
+        self.spool_replay_rate = 0.0
+        self.spool_lock = asyncio.Lock()
+        self.spool_restored = False
+        self.write_queue = None
+        self.writer_task = None
+        self.backfill_task = None
+        self.term_task = None
+        self.maintenance_task = None
+        self.metrics_task = None
+        self.spool_task = None
         
     async def initialize(self):
         """初始化 SQLite 数据库连接和配置"""
+        start = time.perf_counter()
         try:
             # 读取配置文件
             config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.config_file)
@@ -36,117 +87,577 @@ class SqliteChatStorePlugin(Star):
                     config = json.load(f)
                     self.db_path = config.get("db_path", self.db_path)
                     self.enabled = config.get("enabled", False)
+                    self.write_behind = config.get("write_behind", self.write_behind)
+                    self.write_batch_size = config.get("write_batch_size", self.write_batch_size)
+                    self.write_max_latency_ms = config.get("write_max_latency_ms", self.write_max_latency_ms)
+                    self.write_queue_size = config.get("write_queue_size", self.write_queue_size)
+                    self.fts_enabled = config.get("fts_enabled", self.fts_enabled)
+                    self.term_index_interval = config.get("term_index_interval", self.term_index_interval)
+                    self.read_pool_size = config.get("read_pool_size", self.read_pool_size)
+                    self.read_timeout = config.get("read_timeout", self.read_timeout)
+                    self.hot_days = config.get("hot_days", self.hot_days)
+                    self.retention_days = config.get("retention_days", self.retention_days)
+                    self.maintenance_interval = config.get("maintenance_interval", self.maintenance_interval)
+                    self.metrics_file = config.get("metrics_file", self.metrics_file)
+                    self.metrics_interval = config.get("metrics_interval", self.metrics_interval)
+                    self.dedup_cache_size = config.get("dedup_cache_size", self.dedup_cache_size)
+                    self.compress_messages = config.get("compress_messages", self.compress_messages)
+                    self.compress_min_bytes = config.get("compress_min_bytes", self.compress_min_bytes)
+                    self.spool_enabled = config.get("spool_enabled", self.spool_enabled)
+                    self.spool_replay_interval = config.get("spool_replay_interval", self.spool_replay_interval)
             else:
                 # 创建默认配置文件
                 default_config = {
                     "db_path": self.db_path,
-                    "enabled": self.enabled
+                    "enabled": self.enabled,
+                    "write_behind": self.write_behind,
+                    "write_batch_size": self.write_batch_size,
+                    "write_max_latency_ms": self.write_max_latency_ms,
+                    "write_queue_size": self.write_queue_size,
+                    "fts_enabled": self.fts_enabled,
+                    "term_index_interval": self.term_index_interval,
+                    "read_pool_size": self.read_pool_size,
+                    "read_timeout": self.read_timeout,
+                    "hot_days": self.hot_days,
+                    "retention_days": self.retention_days,
+                    "maintenance_interval": self.maintenance_interval,
+                    "metrics_file": self.metrics_file,
+                    "metrics_interval": self.metrics_interval,
+                    "dedup_cache_size": self.dedup_cache_size,
+                    "compress_messages": self.compress_messages,
+                    "compress_min_bytes": self.compress_min_bytes,
+                    "spool_enabled": self.spool_enabled,
+                    "spool_replay_interval": self.spool_replay_interval
                 }
                 with open(config_path, 'w', encoding='utf-8') as f:
                     json.dump(default_config, f, indent=2, ensure_ascii=False)
                 logger.info(f"已创建默认配置文件: {config_path}")
             
+            if self.hot_days > 0 and self.fts_enabled:
+                logger.warning(f"已启用归档（hot_days={self.hot_days}），全文检索只能查到最近 {self.hot_days} 天的消息")
+            
             # 初始化 SQLite 数据库
             if self.enabled:
-                self.db_conn = sqlite3.connect(self.db_path)
-                # 创建表（如果不存在）
-                self.create_tables()
+                await self.open_storage()
                 logger.info(f"SQLite 数据库连接成功: {self.db_path}")
         except Exception as e:
             logger.error(f"初始化 SQLite 数据库连接失败: {str(e)}")
             self.enabled = False
+        metrics.registry.set('sqlchat_startup_seconds', time.perf_counter() - start, phase='store_initialize')
+
+    async def open_storage(self):
+        """打开消息暂存文件，获取共享的数据库服务，创建数据表并启动后台任务"""
+        if self.spool is None and self.spool_enabled:
+            await self.open_spool()
+        if self.chat_storage is None:
+            self.chat_storage = storage.acquire(self.db_path, readers=self.read_pool_size, read_timeout=self.read_timeout)
+        if self.recent_ids is None and self.dedup_cache_size > 0:
+            self.recent_ids = storage.KeyCache(self.dedup_cache_size)
+        # 创建表（如果不存在）
+        await self.create_tables()
+        self.start_background_tasks()
+
+    async def close_storage(self):
+        """写完队列中的消息、停止后台任务，并释放数据库服务"""
+        await self.stop_background_tasks()
+        if self.chat_storage is not None:
+            chat_storage, self.chat_storage = self.chat_storage, None
+            await storage.release(chat_storage)
+        if self.spool is not None:
+            message_spool, self.spool = self.spool, None
+            await asyncio.to_thread(message_spool.close)
 
-    def create_tables(self):
-        """创建 SQLite 数据表（如果不存在）"""
+    async def open_spool(self):
+        """打开消息暂存文件，数据表创建后由后台任务回放其中的消息"""
+        path = self.db_path + ".spool"
         try:
-            cursor = self.db_conn.cursor()
-            
-            # 创建聊天记录表
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                group_id TEXT,
-                sender_id TEXT NOT NULL,
-                sender_name TEXT,
-                message TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                message_id TEXT,
-                platform TEXT NOT NULL
-            )
-            ''')
-            
-            # 创建索引
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_id ON chat_records (group_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sender_id ON chat_records (sender_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON chat_records (timestamp)')
-            
-            self.db_conn.commit()
+            message_spool = spool.MessageSpool(path)
+            pending = await asyncio.to_thread(message_spool.open)
+            self.spool = message_spool
+            self.spool_restored = False
+            if message_spool.discarded:
+                logger.warning(f"消息暂存文件末尾有 {message_spool.discarded} 字节不完整的数据（追加时进程中断），已截掉")
+            if pending:
+                logger.info(f"消息暂存文件中有 {pending} 条消息等待回放: {path}")
+        except Exception as e:
+            logger.error(f"打开消息暂存文件失败: {str(e)}")
+
+    def start_background_tasks(self):
+        """启动批量写入、暂存回放、数据回填、词频索引、归档维护和指标导出等后台任务"""
+        self.start_writer()
+        if self.spool is not None and (self.spool_task is None or self.spool_task.done()):
+            self.spool_task = asyncio.create_task(self.replay_spool_loop())
+        if self.backfill_task is None or self.backfill_task.done():
+            self.backfill_task = asyncio.create_task(self.run_backfills())
+        if self.term_task is None or self.term_task.done():
+            self.term_task = asyncio.create_task(self.index_terms_loop())
+        if self.maintenance_task is None or self.maintenance_task.done():
+            self.maintenance_task = asyncio.create_task(self.maintenance_loop())
+        if self.metrics_file and (self.metrics_task is None or self.metrics_task.done()):
+            self.metrics_task = asyncio.create_task(self.metrics_loop())
+
+    async def stop_background_tasks(self):
+        """写完队列中的消息，并取消其余后台任务"""
+        await self.stop_writer()
+        for task in (self.spool_task, self.backfill_task, self.term_task, self.maintenance_task, self.metrics_task):
+            if task is not None:
+                task.cancel()
+        self.spool_task = None
+        self.backfill_task = None
+        self.term_task = None
+        self.maintenance_task = None
+        self.metrics_task = None
+
+    def start_writer(self):
+        """启动后台批量写入任务（仅在 write_behind 模式下）"""
+        if not self.write_behind or self.writer_task is not None:
+            return
+        # 有界队列：队列满时 on_message 会等待，从而对消息入口形成背压
+        self.write_queue = asyncio.Queue(maxsize=self.write_queue_size)
+        self.writer_task = asyncio.create_task(self.write_loop())
+        logger.info(f"已启用批量写入模式: 批量 {self.write_batch_size} 条 / 最长延迟 {self.write_max_latency_ms} ms")
+
+    async def stop_writer(self):
+        """停止后台写入任务，并将队列中剩余的消息全部写入数据库"""
+        if self.writer_task is None:
+            return
+        # 放入结束标记，写入任务处理完其之前的所有消息后退出
+        await self.write_queue.put(None)
+        try:
+            await self.writer_task
+        except Exception as e:
+            logger.error(f"停止批量写入任务失败: {str(e)}")
+        self.writer_task = None
+        self.write_queue = None
+
+    async def write_loop(self):
+        """后台写入循环：按最大批量和最大延迟合并消息，每批一个事务"""
+        loop = asyncio.get_running_loop()
+        max_latency = self.write_max_latency_ms / 1000
+        stopping = False
+        while not stopping:
+            record = await self.write_queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + max_latency
+            while len(batch) < self.write_batch_size:
+                # 优先取走队列中已有的消息，队列为空时再等待至截止时间
+                if not self.write_queue.empty():
+                    record = self.write_queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        record = await asyncio.wait_for(self.write_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            try:
+                await self.insert_records(batch)
+                logger.debug(f"批量存储消息到 SQLite 成功，共 {len(batch)} 条")
+            except Exception as e:
+                if storage.is_transient_error(e):
+                    if not await self.spool_records(batch, f"批量存储消息到 SQLite 失败: {str(e)}"):
+                        self.drop_records(batch, e)
+                elif len(batch) > 1:
+                    # 个别记录有问题时整批都会失败，逐条重新写入，只丢弃写不进去的记录
+                    await self.insert_each(batch)
+                else:
+                    self.drop_records(batch, e)
+            metrics.registry.set('sqlchat_write_queue_depth', self.write_queue.qsize())
+
+    async def insert_each(self, records):
+        """逐条写入记录；数据库暂时不可用时其余记录写入暂存文件，其他错误只丢弃出错的记录"""
+        for i, record in enumerate(records):
+            try:
+                await self.insert_records([record])
+            except Exception as e:
+                if not storage.is_transient_error(e):
+                    self.drop_records([record], e)
+                    continue
+                rest = records[i:]
+                if not await self.spool_records(rest, f"存储消息到 SQLite 失败: {str(e)}"):
+                    self.drop_records(rest, e)
+                return
+
+    def drop_records(self, records, error):
+        """丢弃无法写入的记录：计入 failed 并从最近写入的 ID 中移除
+
+        只有数据库暂时不可用时才写入暂存文件，其他错误（如数据不符合约束）回放时仍会失败，写入暂存文件只会阻塞之后的回放。
+        """
+        self.forget_records(records)
+        metrics.registry.inc('sqlchat_messages_total', len(records), result='failed')
+        logger.error(f"存储消息到 SQLite 失败，丢弃 {len(records)} 条消息: {str(error)}")
+
+    async def spool_records(self, records, reason):
+        """将未能写入数据库的记录追加到暂存文件，成功时返回 True"""
+        if self.spool is None:
+            return False
+        try:
+            await asyncio.to_thread(self.spool.append, records)
+        except Exception as e:
+            logger.error(f"写入消息暂存文件失败: {str(e)}")
+            return False
+        metrics.registry.inc('sqlchat_messages_total', len(records), result='spooled')
+        metrics.registry.set('sqlchat_spool_depth', self.spool.pending)
+        # 队列已满是持续的状态，只在调试日志中记录
+        log = logger.debug if reason == self.QUEUE_FULL else logger.warning
+        log(f"{reason}，{len(records)} 条消息已写入暂存文件，稍后回放")
+        return True
+
+    async def replay_spool_loop(self):
+        """后台定期将暂存文件中的消息回放到数据库，失败时等到下一轮重试"""
+        while self.chat_storage is not None and self.spool is not None:
+            try:
+                await self.replay_spool()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"回放消息暂存文件失败: {str(e)}")
+            if self.spool is not None:
+                metrics.registry.set('sqlchat_spool_depth', self.spool.pending)
+            await asyncio.sleep(self.spool_replay_interval)
+
+    async def replay_spool(self):
+        """按批回放暂存文件中的消息，每批一个事务，回放进度在同一事务中写入 chat_meta"""
+        async with self.spool_lock:
+            await self._replay_spool()
+
+    async def _replay_spool(self):
+        message_spool = self.spool
+        if not self.spool_restored:
+            # 从数据库中保存的回放进度继续，崩溃前已提交的批次不会被重复写入；
+            # 在写线程中读取，排在之前被取消但仍在执行的回放事务之后
+            checkpoint = await self.chat_storage.write(storage.meta_value, spool.CHECKPOINT_KEY)
+            await asyncio.to_thread(message_spool.restore, checkpoint)
+            self.spool_restored = True
+        start = time.perf_counter()
+        replayed = 0
+        while self.chat_storage is not None and message_spool.pending:
+            if self.write_queue is not None and self.write_queue.qsize() > self.write_queue_size // 2:
+                # 批量写入队列积压时优先写入新消息
+                break
+            records, end = await asyncio.to_thread(message_spool.read_batch, self.write_batch_size)
+            if not records:
+                break
+            checkpoint = (spool.CHECKPOINT_KEY, message_spool.checkpoint_value(end))
+            try:
+                await self.insert_records(records, checkpoint)
+            except Exception as e:
+                if storage.is_transient_error(e):
+                    raise
+                # 个别记录有问题时整批都会失败（如旧版本写入暂存文件的记录）：逐条写入并跳过无法写入的记录，
+                # 避免阻塞之后的回放；中途退出时从上一个进度重新回放，有消息 ID 的记录不会重复
+                failed = 0
+                for record in records:
+                    try:
+                        await self.insert_records([record])
+                    except Exception as record_error:
+                        if storage.is_transient_error(record_error):
+                            raise
+                        failed += 1
+                        logger.error(f"回放暂存文件时跳过无法写入的消息: {str(record_error)}")
+                await self.insert_records([], checkpoint)
+                metrics.registry.inc('sqlchat_messages_total', failed, result='failed')
+            await asyncio.to_thread(message_spool.advance, end, len(records))
+            replayed += len(records)
+            metrics.registry.inc('sqlchat_spool_replayed_total', len(records))
+        if replayed:
+            self.spool_replayed += replayed
+            self.spool_replay_rate = replayed / max(time.perf_counter() - start, 1e-6)
+            logger.info(f"已从暂存文件回放 {replayed} 条消息（{self.spool_replay_rate:.0f} 条/秒），剩余 {message_spool.pending} 条")
+
+    async def create_tables(self):
+        """创建 SQLite 数据表（如果不存在），并迁移旧版本的数据库结构"""
+        try:
+            await self.chat_storage.write(storage.create_tables, self.fts_enabled)
             logger.info("创建数据表和索引成功")
         except Exception as e:
             logger.error(f"创建数据表失败: {str(e)}")
+            return
+        try:
+            min_bytes = self.compress_min_bytes if self.compress_messages else 0
+            if await self.chat_storage.write(storage.configure_compression, min_bytes):
+                logger.info(f"已启用消息压缩（{min_bytes} 字节以上），已有的记录将在后台压缩")
+        except Exception as e:
+            logger.error(f"设置消息压缩失败: {str(e)}")
+
+    async def run_backfills(self):
+        """在写线程中分块执行待完成的回填任务，每块一个事务，块之间穿插新消息的写入"""
+        try:
+            pending = await self.chat_storage.read(storage.pending_backfills)
+            for name, (pos, upto) in pending.items():
+                logger.info(f"开始回填 {name}: {pos}/{upto}")
+                while self.chat_storage is not None:
+                    pos, upto = await self.chat_storage.write(storage.run_backfill_chunk, name)
+                    if pos >= upto:
+                        logger.info(f"回填 {name} 完成")
+                        break
+                    await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"回填数据失败: {str(e)}")
+
+    async def index_terms_loop(self):
+        """后台定期为新消息分词并累加词频：分词在只读连接上进行，写线程只负责累加结果"""
+        while self.chat_storage is not None:
+            try:
+                while self.chat_storage is not None:
+                    start = time.perf_counter()
+                    pos, end, max_id, counts = await self.chat_storage.read(storage.collect_terms)
+                    if end > pos:
+                        metrics.registry.observe('sqlchat_term_index_seconds', time.perf_counter() - start, phase='segment')
+                        with metrics.registry.timer('sqlchat_term_index_seconds', phase='save'):
+                            await self.chat_storage.write(storage.save_terms, pos, end, counts)
+                    if end >= max_id:
+                        break
+            except Exception as e:
+                logger.error(f"更新词频索引失败: {str(e)}")
+            await asyncio.sleep(self.term_index_interval)
+
+    async def maintenance_loop(self):
+        """后台定期执行数据保留、按月归档、分区压缩和空间回收，每块操作之间让出写线程"""
+        while self.chat_storage is not None:
+            try:
+                await self.run_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"数据归档维护失败: {str(e)}")
+            await asyncio.sleep(self.maintenance_interval)
+
+    async def run_maintenance(self):
+        """执行一轮归档维护"""
+        if self.retention_days > 0:
+            deleted = 0
+            while True:
+                count = await self.chat_storage.write(storage.delete_expired_chunk, self.retention_days)
+                if count <= 0:
+                    break
+                deleted += count
+            dropped = await self.chat_storage.write(storage.drop_expired_partitions, self.retention_days)
+            if deleted or dropped:
+                logger.info(f"已删除超过 {self.retention_days} 天的记录 {deleted} 条，归档分区: {', '.join(dropped) or '无'}")
+        if self.hot_days > 0:
+            archived = 0
+            while True:
+                count = await self.chat_storage.write(storage.archive_chunk, self.hot_days)
+                if count <= 0:
+                    break
+                archived += count
+            if archived:
+                logger.info(f"已将 {archived} 条超过 {self.hot_days} 天的记录移入归档分区")
+            compacted = await self.chat_storage.write(storage.compact_partitions, self.hot_days)
+            if compacted:
+                logger.info(f"已压缩归档分区: {', '.join(compacted)}")
+        if self.compress_messages:
+            # 启用压缩时长消息还不够训练字典的，等积累足够的长消息后再训练
+            dict_id = await self.chat_storage.write(storage.train_dictionary)
+            if dict_id is not None:
+                logger.info(f"已训练消息压缩字典 {dict_id}")
+        await self.chat_storage.write(storage.vacuum_main)
+
+    async def metrics_loop(self):
+        """后台定期将运行指标写入 Prometheus 文本文件，供 node_exporter 的 textfile collector 采集"""
+        while self.chat_storage is not None:
+            try:
+                await self.update_storage_metrics()
+                await asyncio.to_thread(metrics.registry.write_prometheus, self.metrics_file)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"写入运行指标失败: {str(e)}")
+            await asyncio.sleep(self.metrics_interval)
+
+    async def update_storage_metrics(self):
+        """更新记录数、数据库文件大小和写入队列长度等瞬时指标"""
+        count = await self.chat_storage.read(storage.count_records)
+        metrics.registry.set('sqlchat_records', count)
+        sizes = await self.chat_storage.read(storage.database_bytes)
+        for name, size in sizes.items():
+            metrics.registry.set('sqlchat_db_bytes', size, file=name)
+        if self.write_queue is not None:
+            metrics.registry.set('sqlchat_write_queue_depth', self.write_queue.qsize())
+        rss = metrics.process_rss_bytes()
+        if rss is not None:
+            metrics.registry.set('sqlchat_process_rss_bytes', rss, stage='current')
+        return count, sizes
 
     # 使用正确的监听器装饰器监听所有消息
     @filter.event_message_type(filter.EventMessageType.ALL)
     async def on_message(self, event: AstrMessageEvent):
         """监听并存储所有 gewechat 消息到 SQLite"""
-        if not self.enabled or self.db_conn is None:
+        if not self.enabled or self.chat_storage is None:
             return
         
         # 检查平台是否为 gewechat
         if event.get_platform_name() != "gewechat":
             return
         
+        record = None
         try:
-            # 获取消息基本信息
-            message_obj = event.message_obj
-            sender = message_obj.sender
+            record = self.build_record(event)
+            if self.is_duplicate(record):
+                # 重连后重复投递的消息
+                metrics.registry.inc('sqlchat_duplicates_total', stage='memory')
+                logger.debug(f"忽略重复的消息，消息ID: {event.message_obj.message_id}")
+                return
             
-            # 准备存储数据
-            timestamp = datetime.fromtimestamp(
-                message_obj.timestamp / 1000 if message_obj.timestamp > 1000000000000 else message_obj.timestamp
-            ).isoformat()
+            if self.write_queue is not None:
+                # 批量写入模式：放入队列由后台任务写入；队列满时写入暂存文件，没有暂存文件时在此等待
+                if not (self.write_queue.full() and await self.spool_records([record], self.QUEUE_FULL)):
+                    await self.write_queue.put(record)
+                self.accept_record(record)
+                return
             
             # 插入记录到数据库
-            cursor = self.db_conn.cursor()
-            cursor.execute('''
-            INSERT INTO chat_records (group_id, sender_id, sender_name, message, timestamp, message_id, platform)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                message_obj.group_id,
-                sender.user_id,
-                sender.nickname or sender.user_id,
-                message_obj.message_str,
-                timestamp,
-                message_obj.message_id,
-                "gewechat"
-            ))
-            self.db_conn.commit()
-            logger.debug(f"存储消息到 SQLite 成功，消息ID: {message_obj.message_id}")
+            await self.insert_records([record])
+            self.accept_record(record)
+            logger.debug(f"存储消息到 SQLite 成功，消息ID: {event.message_obj.message_id}")
         except Exception as e:
+            # 只有数据库暂时不可用时才写入暂存文件，其他错误回放时仍会失败
+            if record is not None and storage.is_transient_error(e):
+                if await self.spool_records([record], f"存储消息到 SQLite 失败: {str(e)}"):
+                    self.accept_record(record)
+                    return
+            if record is not None:
+                self.forget_records([record])
+            metrics.registry.inc('sqlchat_messages_total', result='failed')
             logger.error(f"存储消息到 SQLite 失败: {str(e)}")
 
+    def accept_record(self, record):
+        """消息已写入、放入写入队列或写入暂存文件后，通知统计插件计入实时活跃度"""
+        if self.chat_storage is None:
+            return
+        try:
+            self.chat_storage.notify(record)
+        except Exception as e:
+            logger.error(f"通知新消息失败: {str(e)}")
+
+    def build_record(self, event: AstrMessageEvent):
+        """从消息事件构造一条待插入的记录，字段顺序见 storage.RECORD_FIELDS"""
+        # 获取消息基本信息
+        message_obj = event.message_obj
+        sender = message_obj.sender
+        
+        # 准备存储数据：ISO 文本时间便于人工查看，毫秒时间戳用于查询
+        msg_time = datetime.fromtimestamp(
+            message_obj.timestamp / 1000 if message_obj.timestamp > 1000000000000 else message_obj.timestamp
+        )
+        
+        return (
+            message_obj.group_id,
+            sender.user_id,
+            sender.nickname or sender.user_id,
+            message_obj.message_str,
+            msg_time.isoformat(),
+            storage.to_epoch_ms(msg_time),
+            message_obj.message_id,
+            "gewechat"
+        )
+
+    def message_key(self, record):
+        """记录的去重键 (平台, 群 ID, 消息 ID)，没有消息 ID 时返回 None"""
+        group_id, _, _, _, _, _, message_id, platform = record
+        if not message_id:
+            return None
+        return platform, group_id, str(message_id)
+
+    def is_duplicate(self, record):
+        """消息 ID 是否在最近写入的消息中出现过；未出现时登记该 ID"""
+        key = self.message_key(record)
+        if key is None or self.recent_ids is None:
+            return False
+        if self.recent_ids.get(key):
+            return True
+        self.recent_ids.put(key, True)
+        return False
+
+    def forget_records(self, records):
+        """写入失败的消息从最近写入的 ID 中移除，重新投递时可以再次写入"""
+        if self.recent_ids is None:
+            return
+        for record in records:
+            key = self.message_key(record)
+            if key is not None:
+                self.recent_ids.discard(key)
+
+    async def insert_records(self, records, checkpoint=None):
+        """在写线程中以一个事务批量插入记录，并同步更新聚合统计表；checkpoint 见 storage.insert_records"""
+        start = time.perf_counter()
+        inserted, timings = await self.chat_storage.write(storage.insert_records, records, self.fts_enabled, checkpoint)
+        # total 包含在写线程队列中等待的时间
+        metrics.registry.observe('sqlchat_ingest_seconds', time.perf_counter() - start, phase='total')
+        for phase, seconds in timings.items():
+            metrics.registry.observe('sqlchat_ingest_seconds', seconds, phase=phase)
+        metrics.registry.inc('sqlchat_messages_total', inserted, result='stored')
+        if inserted < len(records):
+            # 内存中的 ID 已被淘汰（或插件重启后）的重复消息，由数据库的唯一索引忽略
+            metrics.registry.inc('sqlchat_duplicates_total', len(records) - inserted, stage='database')
+
     @filter.command("sqlchat_status")
     async def status(self, event: AstrMessageEvent):
         """查看 SQLite 聊天存储插件状态"""
         status_info = []
         status_info.append(f"SQLite 存储插件状态: {'启用' if self.enabled else '禁用'}")
         
-        if self.enabled and self.db_conn is not None:
+        if self.enabled and self.chat_storage is not None:
             try:
                 # 检查数据库连接
-                cursor = self.db_conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM chat_records")
-                count = cursor.fetchone()[0]
+                count, sizes = await self.update_storage_metrics()
                 status_info.append(f"数据库连接: 正常")
                 status_info.append(f"数据库路径: {self.db_path}")
-                status_info.append(f"已存储记录数: {count}")
+                status_info.append(f"主数据库记录数: {count}")
+                status_info.append(f"数据库大小: {sizes['main'] / 1024 / 1024:.1f} MB（WAL {sizes['wal'] / 1024 / 1024:.1f} MB）")
+                status_info.append(f"全文索引: {'启用' if self.fts_enabled else '禁用'}")
+                partitions, partition_bytes, oldest = await self.chat_storage.read(storage.partition_summary)
+                if partitions:
+                    status_info.append(f"归档分区: {partitions} 个（最早 {oldest}），共 {partition_bytes / 1024 / 1024:.1f} MB")
+                pending = await self.chat_storage.read(storage.pending_backfills)
+                for name, (pos, upto) in pending.items():
+                    status_info.append(f"后台回填 {name}: {pos}/{upto}")
+                removed = await self.chat_storage.read(storage.removed_duplicates)
+                if removed:
+                    status_info.append(f"已清理的重复记录: {removed} 条")
+                min_bytes, dictionaries = await self.chat_storage.read(storage.compression_settings)
+                if min_bytes:
+                    status_info.append(f"消息压缩: {min_bytes} 字节以上，字典 {dictionaries} 个")
+                if self.write_queue is not None:
+                    status_info.append(f"写入队列: {self.write_queue.qsize()}/{self.write_queue_size}")
+                rss = metrics.process_rss_bytes()
+                if rss is not None:
+                    status_info.append(f"进程内存: {rss / 1024 / 1024:.1f} MB")
             except Exception as e:
                 status_info.append(f"数据库状态检查失败: {str(e)}")
+            # 数据库不可用时也显示暂存文件的积压情况
+            if self.spool is not None:
+                spool_info = f"消息暂存文件: 待回放 {self.spool.pending} 条（{(self.spool.size - self.spool.offset) / 1024:.1f} KB），已回放 {self.spool_replayed} 条"
+                if self.spool_replay_rate:
+                    spool_info += f"，最近回放速度 {self.spool_replay_rate:.0f} 条/秒"
+                status_info.append(spool_info)
         else:
             status_info.append(f"数据库连接: 未初始化")
             
         yield event.plain_result("\n".join(status_info))
 
+    @filter.command("sqlchat_metrics")
+    async def show_metrics(self, event: AstrMessageEvent):
+        """查看写入、查询、图表生成等热点路径的耗时分布"""
+        if self.enabled and self.chat_storage is not None:
+            try:
+                await self.update_storage_metrics()
+            except Exception as e:
+                logger.error(f"更新存储指标失败: {str(e)}")
+        lines = metrics.registry.summary()
+        if not lines:
+            yield event.plain_result("暂无运行指标")
+            return
+        yield event.plain_result("\n".join(lines))
+
     @filter.command("sqlchat_enable")
     async def enable(self, event: AstrMessageEvent):
         """启用 SQLite 聊天存储插件"""
@@ -167,10 +678,8 @@ class SqliteChatStorePlugin(Star):
                     json.dump(config, f, indent=2, ensure_ascii=False)
                 
                 self.enabled = True
-                # 初始化 SQLite 连接
-                self.db_conn = sqlite3.connect(self.db_path)
-                # 创建表（如果不存在）
-                self.create_tables()
+                # 初始化 SQLite 连接并创建表（如果不存在）
+                await self.open_storage()
                 yield event.plain_result("SQLite 聊天存储插件已启用")
             else:
                 yield event.plain_result("配置文件不存在，请先重载插件初始化配置")
@@ -197,10 +706,8 @@ class SqliteChatStorePlugin(Star):
                     json.dump(config, f, indent=2, ensure_ascii=False)
                 
                 self.enabled = False
-                # 关闭数据库连接
-                if self.db_conn is not None:
-                    self.db_conn.close()
-                    self.db_conn = None
+                # 写完队列中的消息后再关闭数据库连接
+                await self.close_storage()
                 yield event.plain_result("SQLite 聊天存储插件已禁用")
             else:
                 yield event.plain_result("配置文件不存在，请先重载插件初始化配置")
@@ -249,99 +756,233 @@ class SqliteChatStorePlugin(Star):
     @filter.command("sqlchat_query")
     async def query(self, event: AstrMessageEvent):
         """查询聊天记录"""
-        if not self.enabled or self.db_conn is None:
+        if not self.enabled or self.chat_storage is None:
             yield event.plain_result("SQLite 聊天存储插件未启用")
             return
             
         message_parts = event.message_str.split()
         if len(message_parts) < 2:
-            yield event.plain_result("使用方法: /sqlchat_query [sender|group|all] [关键词/ID（可选）] [条数限制（默认10）]")
+            yield event.plain_result("使用方法: /sqlchat_query [sender|group|text|all] [关键词/ID（all 不需要）] [条数限制（默认10）] [翻页游标（可选）]")
             return
             
         query_type = message_parts[1]
-        keyword = message_parts[2] if len(message_parts) > 2 else None
-        limit = int(message_parts[3]) if len(message_parts) > 3 and message_parts[3].isdigit() else 10
+        # all 模式没有关键词，其后直接是条数限制和翻页游标
+        args = message_parts[2:] if query_type != "all" else [None] + message_parts[2:]
+        keyword = args[0] if len(args) > 0 else None
+        limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+        cursor = None
+        if len(args) > 2:
+            cursor = storage.parse_cursor(args[2])
+            if cursor is None:
+                yield event.plain_result("翻页游标无效，请复制上一页末尾提示的命令")
+                return
         
         try:
-            cursor = self.db_conn.cursor()
             results = []
+            start = time.perf_counter()
             
             if query_type == "sender" and keyword:
                 # 查询特定发送者的消息
-                cursor.execute('''
-                SELECT timestamp, sender_name, message, group_id FROM chat_records 
-                WHERE sender_id = ? OR sender_name LIKE ? 
-                ORDER BY timestamp DESC LIMIT ?
-                ''', (keyword, f"%{keyword}%", limit))
-                results = cursor.fetchall()
+                results = await self.chat_storage.read(storage.query_by_sender, keyword, limit, cursor)
                 
             elif query_type == "group" and keyword:
                 # 查询特定群组的消息
-                cursor.execute('''
-                SELECT timestamp, sender_name, message, group_id FROM chat_records 
-                WHERE group_id = ? 
-                ORDER BY timestamp DESC LIMIT ?
-                ''', (keyword, limit))
-                results = cursor.fetchall()
+                results = await self.chat_storage.read(storage.query_by_group, keyword, limit, cursor)
+                
+            elif query_type == "text" and keyword:
+                # 全文检索消息内容，按相关度排序并显示命中片段
+                if not self.fts_enabled:
+                    yield event.plain_result("全文索引未启用，请在配置文件中设置 fts_enabled 为 true 后重载插件")
+                    return
+                terms = storage.segment_query(keyword)
+                matches = await self.chat_storage.read(storage.search_messages, keyword, limit)
+                results = [
+                    (ts, sender_name, storage.make_snippet(message, terms), group_id)
+                    for ts, sender_name, message, group_id in matches
+                ]
                 
             elif query_type == "all":
                 # 查询最新消息
-                cursor.execute('''
-                SELECT timestamp, sender_name, message, group_id FROM chat_records 
-                ORDER BY timestamp DESC LIMIT ?
-                ''', (limit,))
-                results = cursor.fetchall()
+                results = await self.chat_storage.read(storage.query_latest, limit, cursor)
                 
             else:
-                yield event.plain_result("未知查询类型，使用方法: /sqlchat_query [sender|group|all] [关键词/ID（可选）] [条数限制（默认10）]")
+                yield event.plain_result("未知查询类型，使用方法: /sqlchat_query [sender|group|text|all] [关键词/ID（all 不需要）] [条数限制（默认10）] [翻页游标（可选）]")
                 return
+            
+            metrics.registry.observe('sqlchat_query_seconds', time.perf_counter() - start, mode=query_type)
                 
             if not results:
                 yield event.plain_result("未找到匹配的聊天记录")
                 return
                 
             formatted_results = []
-            for timestamp, sender_name, message, group_id in results:
+            for ts, sender_name, message, group_id, *_ in results:
                 group_info = f"[群:{group_id}]" if group_id else "[私聊]"
-                formatted_results.append(f"{timestamp} {group_info} {sender_name}: {message}")
+                formatted_results.append(f"{storage.format_ms(ts)} {group_info} {sender_name}: {message}")
+            
+            # 按时间排序的查询结果满一页时提示下一页的命令（全文检索按相关度排序，不分页）
+            if query_type != "text" and len(results) >= limit:
+                command = " ".join(part for part in ("/sqlchat_query", query_type, keyword) if part)
+                formatted_results.append(f"下一页: {command} {limit} {storage.format_cursor(results[-1])}")
                 
             yield event.plain_result("\n\n".join(formatted_results))
             
+        except asyncio.TimeoutError:
+            yield event.plain_result("查询超时，请缩小查询范围后重试")
         except Exception as e:
             yield event.plain_result(f"查询失败: {str(e)}")
     
+    @filter.command("sqlchat_fts_rebuild")
+    async def fts_rebuild(self, event: AstrMessageEvent):
+        """重建消息全文索引"""
+        # 检查管理员权限
+        if not event.is_admin():
+            yield event.plain_result("只有管理员可以执行此操作")
+            return
+        
+        if not self.enabled or self.chat_storage is None:
+            yield event.plain_result("SQLite 聊天存储插件未启用")
+            return
+        
+        if not self.fts_enabled:
+            yield event.plain_result("全文索引未启用，请在配置文件中设置 fts_enabled 为 true 后重载插件")
+            return
+        
+        try:
+            if self.backfill_task is not None:
+                self.backfill_task.cancel()
+                self.backfill_task = None
+            await self.chat_storage.write(storage.rebuild_fts)
+            self.backfill_task = asyncio.create_task(self.run_backfills())
+            yield event.plain_result("已开始在后台重建全文索引，可通过 /sqlchat_status 查看进度")
+        except Exception as e:
+            yield event.plain_result(f"重建全文索引失败: {str(e)}")
+    
     async def terminate(self):
-        """终止插件时关闭数据库连接"""
-        if self.db_conn is not None:
-            try:
-                self.db_conn.close()
-                logger.info("SQLite 数据库连接已关闭")
-            except Exception as e:
-                logger.error(f"关闭 SQLite 数据库连接失败: {str(e)}")
+        """终止插件时写完队列中的消息并关闭数据库连接"""
+        try:
+            await self.close_storage()
+            logger.info("SQLite 数据库连接已关闭")
+        except Exception as e:
+            logger.error(f"关闭 SQLite 数据库连接失败: {str(e)}")
+
+
+def process_pool(max_workers):
+    """创建不使用 fork 的进程池
+
+    插件运行时进程中已有数据库读写线程和事件循环的线程池，fork 多线程进程的子进程可能因复制了被占用的锁而死锁，
+    因此 Linux 上使用 forkserver，其他平台使用 spawn。子进程按模块名重新导入 charts、fast_charts、global_report，
+    这些模块不依赖 AstrBot，只导入标准库和插件内的其他模块。
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+
+
+# 星期 × 小时热力图的行标签
+WEEKDAYS = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+# 每日报告包含的图表
+REPORT_KINDS = ('ranking', 'heatmap', 'wordcloud')
+
+# 词频索引尚未追上时推迟生成的词云报告，每隔 REPORT_RETRY_SECONDS 秒重试，最多 REPORT_RETRIES 次
+REPORT_RETRY_SECONDS = 300
+REPORT_RETRIES = 12
 
 
 @register("astrbot_plugin_chat_stats", "User", "基于SQLite存储的群聊统计分析工具", "1.0.0")
 class ChatStatsPlugin(Star):
     def __init__(self, context: Context):
         super().__init__(context)
-        # 获取 SQLite 数据库路径
+        # 获取 SQLite 数据库路径，与存储插件共享同一个数据库服务
         self.db_path = None
+        self.chat_storage = None
         self.config_file = "chat_stats_config.json"
+        # 图表绘制在独立的进程池中执行，避免阻塞事件循环
+        self.render_workers = 2
+        self.render_concurrency = 2
+        self.render_timeout = 60
+        self.render_pool = None
+        self.render_semaphore = None
+        # 已生成图表的缓存，cache_dir 为空时不写磁盘
+        self.cache_max_mb = 32
+        self.cache_ttl = 600
+        self.cache_dir = ""
+        self.render_cache = None
+        # 词云：中文字体路径（为空时自动查找系统字体）、最多显示的词数、额外的停用词文件
+        self.font_path = ""
+        self.wordcloud_max_words = 100
+        self.stopwords_path = ""
+        self.stopwords = set()
+        # 停用词表的摘要，作为绘图配置的一部分，修改停用词后已保存的词云失效
+        self.stopwords_digest = ""
+        # 排名和热力图的绘图后端："fast" 为复用模板的轻量后端（输出尺寸和格式可配置），"matplotlib" 为每次新建完整图表
+        self.chart_renderer = "fast"
+        self.image_format = "png"
+        self.image_width = 800
+        # 多日统计：时间范围的最大天数、排名显示的人数
+        self.max_range_days = 366
+        self.range_ranking_size = 20
+        # 启动后在后台预先加载 jieba 词典、pandas、matplotlib 和 wordcloud，避免第一张图表等待导入；
+        # 会启动全部绘图进程并各自导入绘图库，空闲内存明显增加，默认关闭，第一次生成图表时才加载
+        self.warm_up = False
+        self.warm_up_task = None
+        # 实时活跃度：内存中按群保存最近 activity_window_minutes 分钟的每分钟消息数，最多 activity_max_groups 个群
+        self.activity_window_minutes = 60
+        self.activity_max_groups = 1000
+        # 消息突增：最近 spike_minutes 分钟的速率达到此前的 spike_ratio 倍且至少 spike_min_messages 条；spike_alert 为 True 时在群里提醒
+        self.spike_minutes = 5
+        self.spike_ratio = 3.0
+        self.spike_min_messages = 30
+        self.spike_alert = False
+        self.activity = None
+        # 群 ID -> 待发送的消息突增提醒，由存储插件通知新消息时登记，在该群的消息事件中发送
+        self.pending_alerts = {}
+        # 每日报告：在 report_times（如 ["00:05"]）为前一天有消息的群预先生成排名、热力图和词云并保存到数据库，为空时不定时生成；
+        # 同时为 report_concurrency 个群生成，报告保留 report_keep_days 天
+        self.report_times = []
+        self.report_concurrency = 1
+        self.report_keep_days = 30
+        self.report_task = None
+        self.report_retry_task = None
+        # 跨群报告（/sqlchat_report）：按群分块在 global_report_workers 个进程中并行统计（0 为全部 CPU 核心），
+        # 显示消息数最多的 global_report_size 个群和发送人；同一时间只生成一份
+        self.global_report_workers = 0
+        self.global_report_size = 20
+        self.global_report_lock = asyncio.Lock()
+        # 不访问数据库、直接回复文本的触发词
+        self.live_triggers = {
+            "最近活跃": self.recent_activity,
+            "群聊热度": self.group_heat
+        }
         self.triggers = {
             "群聊排名": self.generate_chat_ranking,
             "群聊热力图": self.generate_heatmap,
-            "群聊词云": self.generate_wordcloud
+            "群聊词云": self.generate_wordcloud,
+            "群聊趋势": self.generate_trend,
+            "昨日群聊报告": self.generate_daily_report
         }
         
     async def initialize(self):
-        """初始化插件，找到SQLite数据库"""
+        """初始化插件，读取配置并找到SQLite数据库"""
+        start = time.perf_counter()
+        self.load_config()
+        self.activity = activity.ActivityTracker(
+            self.activity_window_minutes, self.activity_max_groups,
+            self.spike_minutes, self.spike_ratio, self.spike_min_messages
+        )
+        self.render_semaphore = asyncio.Semaphore(self.render_concurrency)
+        self.render_cache = RenderCache(self.cache_max_mb * 1024 * 1024, self.cache_ttl, self.cache_dir)
         try:
             # 尝试找到SQLite Chat Store插件的数据库
             sqlite_plugin_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sqlite_chat_store_config.json")
+            # 数据库服务由两个插件共享，只读连接数和查询超时使用存储插件的配置（默认值与存储插件相同）
+            readers, read_timeout = 2, 30
             if os.path.exists(sqlite_plugin_config):
                 with open(sqlite_plugin_config, 'r', encoding='utf-8') as f:
                     config = json.load(f)
                     self.db_path = config.get("db_path", None)
+                    readers = config.get("read_pool_size", readers)
+                    read_timeout = config.get("read_timeout", read_timeout)
                     if self.db_path:
                         logger.info(f"发现SQLite聊天记录数据库: {self.db_path}")
                     else:
@@ -355,52 +996,442 @@ class ChatStatsPlugin(Star):
                 else:
                     logger.error(f"默认数据库路径不存在: {self.db_path}")
                     self.db_path = None
+            if self.db_path:
+                self.chat_storage = storage.acquire(self.db_path, readers=readers, read_timeout=read_timeout)
+                # 实时活跃度由存储插件在消息去重并被接受后通知，存储插件禁用或写入失败的消息不计入
+                self.chat_storage.add_listener(self.record_activity)
         except Exception as e:
             logger.error(f"初始化统计插件失败: {str(e)}")
             self.db_path = None
+        metrics.registry.set('sqlchat_startup_seconds', time.perf_counter() - start, phase='stats_initialize')
+        self.report_memory('initialize')
+        if self.warm_up and self.db_path:
+            self.warm_up_task = asyncio.create_task(self.run_warm_up())
+        if self.report_times and self.db_path:
+            self.report_task = asyncio.create_task(self.report_loop())
     
-    def get_connection(self):
-        """获取数据库连接"""
-        if not self.db_path or not os.path.exists(self.db_path):
+    def report_memory(self, stage):
+        """记录本进程和已启动的绘图进程当前的常驻内存，返回 (本进程 MB, 绘图进程合计 MB)，无法获取的项为 None"""
+        rss = metrics.process_rss_bytes()
+        if rss is not None:
+            metrics.registry.set('sqlchat_process_rss_bytes', rss, stage=stage)
+        workers = self.render_workers_rss()
+        if workers is not None:
+            count, workers_rss = workers
+            metrics.registry.set('sqlchat_render_workers_rss_bytes', workers_rss, stage=stage, workers=count)
+        return (
+            None if rss is None else rss / 1024 / 1024,
+            None if workers is None else workers[1] / 1024 / 1024,
+        )
+    
+    def render_workers_rss(self):
+        """已启动的绘图进程数和常驻内存合计 (进程数, 字节)，进程池尚未创建或无法获取时返回 None"""
+        if self.render_pool is None:
+            return None
+        # ProcessPoolExecutor 没有公开进程列表，_processes 为 {pid: Process}
+        pids = list(getattr(self.render_pool, '_processes', None) or {})
+        sizes = [metrics.process_rss_bytes(pid) for pid in pids]
+        if not pids or None in sizes:
             return None
+        return len(pids), sum(sizes)
+    
+    def preload(self):
+        """在线程中加载 jieba 词典和 pandas；不使用绘图进程时在本进程中预热 matplotlib 和 wordcloud"""
+        storage.load_jieba()
+        import pandas  # noqa: F401
+        if self.render_workers <= 0:
+            charts.warm_up()
+            if self.chart_renderer == 'fast':
+                fast_charts.warm_up(*self.fast_options())
+    
+    async def run_warm_up(self):
+        """后台预热，完成后记录耗时和进程内存"""
+        start = time.perf_counter()
         try:
-            return sqlite3.connect(self.db_path)
+            await asyncio.to_thread(self.preload)
+            if self.render_workers > 0:
+                # 每个绘图进程各自导入；同时提交 render_workers 个任务，使进程池启动全部进程
+                loop = asyncio.get_running_loop()
+                pool = self.get_render_pool()
+                await asyncio.gather(*(loop.run_in_executor(pool, charts.warm_up) for _ in range(self.render_workers)))
+                if self.chart_renderer == 'fast':
+                    await asyncio.gather(*(
+                        loop.run_in_executor(pool, fast_charts.warm_up, *self.fast_options())
+                        for _ in range(self.render_workers)
+                    ))
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"连接数据库失败: {str(e)}")
-            return None
+            logger.error(f"统计插件预热失败: {str(e)}")
+            return
+        elapsed = time.perf_counter() - start
+        metrics.registry.set('sqlchat_startup_seconds', elapsed, phase='warm_up')
+        memory, workers_memory = self.report_memory('warm_up')
+        logger.info(
+            f"统计插件预热完成，耗时 {elapsed:.2f} 秒"
+            + (f"，进程内存 {memory:.1f} MB" if memory else "")
+            + (f"，绘图进程内存合计 {workers_memory:.1f} MB" if workers_memory else "")
+        )
     
-    def get_today_data(self, group_id):
-        """获取当天的群聊数据"""
-        conn = self.get_connection()
-        if not conn:
+    def load_config(self):
+        """读取统计插件配置文件，不存在时创建默认配置"""
+        try:
+            config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.config_file)
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                    self.render_workers = config.get("render_workers", self.render_workers)
+                    self.render_concurrency = config.get("render_concurrency", self.render_concurrency)
+                    self.render_timeout = config.get("render_timeout", self.render_timeout)
+                    self.cache_max_mb = config.get("cache_max_mb", self.cache_max_mb)
+                    self.cache_ttl = config.get("cache_ttl", self.cache_ttl)
+                    self.cache_dir = config.get("cache_dir", self.cache_dir)
+                    self.font_path = config.get("font_path", self.font_path)
+                    self.wordcloud_max_words = config.get("wordcloud_max_words", self.wordcloud_max_words)
+                    self.stopwords_path = config.get("stopwords_path", self.stopwords_path)
+                    self.max_range_days = config.get("max_range_days", self.max_range_days)
+                    self.range_ranking_size = config.get("range_ranking_size", self.range_ranking_size)
+                    self.warm_up = config.get("warm_up", self.warm_up)
+                    self.chart_renderer = config.get("chart_renderer", self.chart_renderer)
+                    self.image_format = config.get("image_format", self.image_format)
+                    self.image_width = config.get("image_width", self.image_width)
+                    self.activity_window_minutes = config.get("activity_window_minutes", self.activity_window_minutes)
+                    self.activity_max_groups = config.get("activity_max_groups", self.activity_max_groups)
+                    self.spike_minutes = config.get("spike_minutes", self.spike_minutes)
+                    self.spike_ratio = config.get("spike_ratio", self.spike_ratio)
+                    self.spike_min_messages = config.get("spike_min_messages", self.spike_min_messages)
+                    self.spike_alert = config.get("spike_alert", self.spike_alert)
+                    self.report_times = config.get("report_times", self.report_times)
+                    self.report_concurrency = config.get("report_concurrency", self.report_concurrency)
+                    self.report_keep_days = config.get("report_keep_days", self.report_keep_days)
+                    self.global_report_workers = config.get("global_report_workers", self.global_report_workers)
+                    self.global_report_size = config.get("global_report_size", self.global_report_size)
+            else:
+                default_config = {
+                    "render_workers": self.render_workers,
+                    "render_concurrency": self.render_concurrency,
+                    "render_timeout": self.render_timeout,
+                    "cache_max_mb": self.cache_max_mb,
+                    "cache_ttl": self.cache_ttl,
+                    "cache_dir": self.cache_dir,
+                    "font_path": self.font_path,
+                    "wordcloud_max_words": self.wordcloud_max_words,
+                    "stopwords_path": self.stopwords_path,
+                    "max_range_days": self.max_range_days,
+                    "range_ranking_size": self.range_ranking_size,
+                    "warm_up": self.warm_up,
+                    "chart_renderer": self.chart_renderer,
+                    "image_format": self.image_format,
+                    "image_width": self.image_width,
+                    "activity_window_minutes": self.activity_window_minutes,
+                    "activity_max_groups": self.activity_max_groups,
+                    "spike_minutes": self.spike_minutes,
+                    "spike_ratio": self.spike_ratio,
+                    "spike_min_messages": self.spike_min_messages,
+                    "spike_alert": self.spike_alert,
+                    "report_times": self.report_times,
+                    "report_concurrency": self.report_concurrency,
+                    "report_keep_days": self.report_keep_days,
+                    "global_report_workers": self.global_report_workers,
+                    "global_report_size": self.global_report_size
+                }
+                with open(config_path, 'w', encoding='utf-8') as f:
+                    json.dump(default_config, f, indent=2, ensure_ascii=False)
+                logger.info(f"已创建默认配置文件: {config_path}")
+            if self.stopwords_path and os.path.exists(self.stopwords_path):
+                with open(self.stopwords_path, 'r', encoding='utf-8') as f:
+                    self.stopwords = {line.strip().lower() for line in f if line.strip()}
+                self.stopwords_digest = hashlib.sha1('\n'.join(sorted(self.stopwords)).encode('utf-8')).hexdigest()[:8]
+        except Exception as e:
+            logger.error(f"读取统计插件配置失败: {str(e)}")
+    
+    def fast_options(self):
+        """轻量绘图后端的 (字体路径, 图片宽度, 图片格式) 参数"""
+        return charts.find_cjk_font(self.font_path), self.image_width, self.image_format
+    
+    def get_render_pool(self):
+        """返回绘图进程池，第一次调用时创建；render_workers 为 0 时返回 None，即使用默认线程池"""
+        # render_workers 为 0 时使用默认线程池，适用于不便创建子进程的环境
+        if self.render_pool is None and self.render_workers > 0:
+            self.render_pool = process_pool(self.render_workers)
+        return self.render_pool
+    
+    async def render(self, func, *args):
+        """在进程池中执行绘图函数，限制并发数并设置超时"""
+        loop = asyncio.get_running_loop()
+        pool = self.get_render_pool()
+        async with self.render_semaphore:
+            try:
+                data, render_seconds, encode_seconds = await asyncio.wait_for(
+                    loop.run_in_executor(pool, charts.timed, func, *args), self.render_timeout
+                )
+            except BrokenProcessPool:
+                # 子进程异常退出后进程池不可再用，下次调用时重建
+                logger.error("绘图进程池异常退出，将重新创建")
+                self.render_pool = None
+                raise
+        chart = func.__name__.replace('render_', '')
+        metrics.registry.observe('sqlchat_chart_seconds', render_seconds, chart=chart, phase='render')
+        metrics.registry.observe('sqlchat_chart_seconds', encode_seconds, chart=chart, phase='encode')
+        # 绘图进程按需启动并在第一次绘图时导入绘图库，每次绘图后更新内存，开销只是读取几个 /proc 文件
+        self.report_memory('render')
+        return data
+    
+    async def cached_render(self, group_id, days, kind, create):
+        """按 (群, 日期范围, 图表类型) 和范围内的消息数返回缓存的图片，没有数据时返回 None
+
+        days 为 (起始日期, 结束日期)，均为 YYYY-MM-DD 文本且包含在范围内。
+        """
+        if self.chat_storage is None:
             return None
-        
+        start_day, end_day = days
         try:
-            # 获取今天的日期范围
-            today = datetime.now().strftime('%Y-%m-%d')
-            tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-            
-            # 查询数据
-            df = pd.read_sql_query("""
-                SELECT sender_id, sender_name, message, timestamp 
-                FROM chat_records 
-                WHERE group_id = ? AND timestamp >= ? AND timestamp < ?
-                ORDER BY timestamp
-            """, conn, params=(group_id, today, tomorrow))
-            
-            conn.close()
-            
-            if df.empty:
-                return None
-                
-            # 添加小时列，用于热力图
-            df['hour'] = pd.to_datetime(df['timestamp']).dt.hour
-            
-            return df
+            # 数据水位：该群在范围内已统计的消息数，有新消息时随之变化
+            watermark = await self.chat_storage.read(storage.range_message_count, group_id, start_day, end_day)
         except Exception as e:
-            logger.error(f"获取数据失败: {str(e)}")
-            conn.close()
+            logger.error(f"获取数据水位失败: {str(e)}")
+            return None
+        if not watermark:
+            return None
+        # 已经结束的日期数据不会再变化，可以持久化到磁盘
+        persist = end_day < datetime.now().strftime('%Y-%m-%d')
+        if kind == 'wordcloud':
+            try:
+                pending = await self.chat_storage.read(storage.terms_pending, group_id, start_day, end_day)
+            except Exception as e:
+                logger.error(f"获取词频索引进度失败: {str(e)}")
+                return None
+            if pending is not None:
+                # 词频索引还没有处理完范围内的消息：水位带上索引进度，索引推进后重新生成；
+                # 此时的词云只包含部分消息，不写入磁盘缓存和报告，以免已结束日期的不完整词云被一直使用
+                watermark = f"{watermark}@{pending}"
+                persist = False
+        key_day = start_day if start_day == end_day else f"{start_day}~{end_day}"
+        created = False
+        from_report = False
+
+        async def counted_create():
+            nonlocal created, from_report
+            created = True
+            if not (persist and start_day == end_day and kind in REPORT_KINDS):
+                return await create()
+            # 已结束的单日排名、热力图和词云先查找预先生成的报告，没有时生成并保存为报告
+            options = self.report_options()
+            try:
+                data = await self.chat_storage.read(storage.load_report, group_id, start_day, kind, watermark, options)
+            except Exception as e:
+                logger.error(f"读取群聊报告失败: {str(e)}")
+                data = None
+            if data is not None:
+                from_report = True
+                return data
+            data = await create()
+            if data is not None:
+                try:
+                    await self.chat_storage.write(storage.save_report, group_id, start_day, kind, watermark, options, data)
+                except Exception as e:
+                    logger.error(f"保存群聊报告失败: {str(e)}")
+            return data
+
+        start = time.perf_counter()
+        data = await self.render_cache.get_or_create(
+            (group_id, key_day, kind), watermark, counted_create, persist=persist,
+            variant=self.report_options(), extension=self.image_extension(kind)
+        )
+        metrics.registry.observe('sqlchat_chart_seconds', time.perf_counter() - start, chart=kind, phase='total')
+        result = 'report' if from_report else 'miss' if created else 'hit'
+        metrics.registry.inc('sqlchat_chart_cache_total', chart=kind, result=result)
+        return data
+    
+    def image_extension(self, kind):
+        """图表的实际图片格式：只有 fast 绘图方式的排名和热力图可以输出 JPEG"""
+        if self.chart_renderer == 'fast' and self.image_format == 'jpeg' and kind in ('ranking', 'heatmap'):
+            return 'jpg'
+        return 'png'
+    
+    def report_options(self):
+        """影响报告图片内容的绘图配置（包括实际使用的字体和停用词表），与保存报告时不同的报告视为失效"""
+        font_path = charts.find_cjk_font(self.font_path) or ''
+        return (
+            f"{self.chart_renderer}/{self.image_format}/{self.image_width}/{self.wordcloud_max_words}"
+            f"/{font_path}/{self.stopwords_digest}"
+        )
+    
+    def next_report_delay(self, now=None):
+        """距离 report_times 中下一个时间点的秒数，没有有效的时间点时返回 None"""
+        now = now or datetime.now()
+        candidates = []
+        for text in self.report_times:
+            try:
+                moment = datetime.strptime(str(text).strip(), '%H:%M')
+            except ValueError:
+                logger.error(f"无效的报告生成时间: {text}，应为 HH:MM")
+                continue
+            candidate = now.replace(hour=moment.hour, minute=moment.minute, second=0, microsecond=0)
+            if candidate <= now:
+                candidate += timedelta(days=1)
+            candidates.append(candidate)
+        if not candidates:
+            return None
+        return (min(candidates) - now).total_seconds()
+    
+    async def report_loop(self):
+        """按 report_times 定时为前一天有消息的群生成每日报告
+
+        下一个时间点从本次计划的时间点算起，生成报告耗时较长时也不会漏掉之后的时间点（错过的时间点立即补上）。
+        推迟的词云报告在单独的任务中重试，不占用定时循环。
+        """
+        slot = datetime.now()
+        while True:
+            delay = self.next_report_delay(slot)
+            if delay is None:
+                return
+            slot += timedelta(seconds=delay)
+            await asyncio.sleep(max(0.0, (slot - datetime.now()).total_seconds()))
+            day = (slot.date() - timedelta(days=1)).strftime('%Y-%m-%d')
+            try:
+                _, _, deferred = await self.generate_reports(day)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"生成群聊报告失败: {str(e)}")
+                continue
+            if deferred:
+                # 同一天只保留一个重试任务
+                if self.report_retry_task is not None:
+                    self.report_retry_task.cancel()
+                self.report_retry_task = asyncio.create_task(self.retry_reports(day))
+    
+    async def retry_reports(self, day):
+        """每隔 REPORT_RETRY_SECONDS 秒重新生成某天推迟的词云报告，最多 REPORT_RETRIES 次"""
+        for _ in range(REPORT_RETRIES):
+            await asyncio.sleep(REPORT_RETRY_SECONDS)
+            try:
+                _, _, deferred = await self.generate_reports(day)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"重新生成群聊报告失败: {str(e)}")
+                return
+            if not deferred:
+                return
+        logger.warning(f"{day} 仍有 {deferred} 个群的词频索引未完成，词云报告改为在触发时生成")
+    
+    async def generate_reports(self, day=None):
+        """为某天（默认昨天）有消息的每个群生成排名、热力图和词云并保存为报告，返回 (生成数, 跳过数, 推迟数)
+
+        已有水位和绘图配置都一致的报告（如之前一次运行已生成、之后没有新消息）时跳过。
+        词频索引尚未处理完该群当天消息时推迟生成词云，避免生成不完整的词云，由 retry_reports 稍后重试。
+        """
+        day = day or (datetime.now().date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        start = time.perf_counter()
+        groups = await self.chat_storage.read(storage.active_groups, day)
+        existing = await self.chat_storage.read(storage.report_watermarks, day, self.report_options())
+        semaphore = asyncio.Semaphore(max(1, self.report_concurrency))
+        generated = skipped = deferred = failed = 0
+
+        async def generate_group(group_id, watermark):
+            nonlocal generated, skipped, deferred, failed
+            async with semaphore:
+                for kind in REPORT_KINDS:
+                    if existing.get((group_id, kind)) == watermark:
+                        skipped += 1
+                        continue
+                    try:
+                        if kind == 'wordcloud' and await self.chat_storage.read(storage.terms_pending, group_id, day, day) is not None:
+                            deferred += 1
+                            continue
+                        # 与触发图表时的流程相同，生成的图片保存为报告并放入图表缓存
+                        await self.cached_render(group_id, (day, day), kind, self.report_creators(group_id, (day, day))[kind])
+                        generated += 1
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"生成群 {group_id} 的{kind}报告失败: {str(e)}")
+
+        await asyncio.gather(*(generate_group(group_id, watermark) for group_id, watermark in groups.items()))
+        keep_from = (datetime.now().date() - timedelta(days=self.report_keep_days)).strftime('%Y-%m-%d')
+        deleted = await self.chat_storage.write(storage.delete_reports_before, keep_from)
+        logger.info(
+            f"已生成 {day} 的群聊报告: {len(groups)} 个群，生成 {generated} 张，未变化跳过 {skipped} 张，"
+            f"词频索引未完成推迟 {deferred} 张，失败 {failed} 张，删除过期报告 {deleted} 张，耗时 {time.perf_counter() - start:.1f} 秒"
+        )
+        return generated, skipped, deferred
+    
+    def report_creators(self, group_id, days):
+        """报告中各图表的生成函数"""
+        return {
+            'ranking': lambda: self.render_ranking(group_id, days),
+            'heatmap': lambda: self.render_heatmap(group_id, days),
+            'wordcloud': lambda: self.render_wordcloud(group_id, days),
+        }
+    
+    def parse_days(self, text):
+        """解析触发词后面的时间范围，返回 (起始日期, 结束日期) 文本，没有指定时返回 None"""
+        parsed = date_range.parse_range(text, max_days=self.max_range_days)
+        if parsed is None:
+            return None
+        return tuple(day.strftime('%Y-%m-%d') for day in parsed)
+    
+    def today_range(self, days=1):
+        """截至今天的最近 days 天"""
+        today = datetime.now().date()
+        return (today - timedelta(days=days - 1)).strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+    
+    def period_label(self, days):
+        """日期范围的显示文本"""
+        start_day, end_day = days
+        return start_day if start_day == end_day else f"{start_day} 至 {end_day}"
+    
+    def chart_title(self, days, name):
+        """图表标题：今天的图表沿用"今日群聊排名"这样的标题，其他日期带上日期范围"""
+        if days == self.today_range():
+            return f"今日{name}"
+        return f"{self.period_label(days)} {name}"
+    
+    # 以下接收 conn 参数的方法在数据库服务的只读线程中执行
+    
+    def get_day_terms(self, conn, group_id, day):
+        """从词频表获取某天词频最高的词，返回 {词: 词频}"""
+        # 多取出停用词数量的词，过滤后仍能凑够词云需要的词数
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='wordcloud', phase='fetch'):
+            rows = storage.top_terms(conn, group_id, day, self.wordcloud_max_words + len(self.stopwords))
+        return self.filter_terms(rows)
+    
+    def get_range_terms(self, conn, group_id, start_day, end_day):
+        """从词频表获取日期范围内累计词频最高的词，返回 {词: 词频}"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='wordcloud', phase='fetch'):
+            rows = storage.range_top_terms(
+                conn, group_id, start_day, end_day, self.wordcloud_max_words + len(self.stopwords)
+            )
+        return self.filter_terms(rows)
+    
+    def filter_terms(self, rows):
+        """去掉停用词，保留词频最高的 wordcloud_max_words 个词"""
+        frequencies = {term: freq for term, freq in rows if term not in self.stopwords}
+        return dict(list(frequencies.items())[:self.wordcloud_max_words]) or None
+    
+    def get_day_stats(self, conn, group_id, day):
+        """从聚合表获取某天按小时、发送人统计的消息数"""
+        import pandas as pd
+        # 行数只与当天活跃的发送人数有关，与消息量无关
+        df = pd.read_sql_query("""
+            SELECT sender_id, sender_name, hour, message_count
+            FROM chat_hourly_stats
+            WHERE group_id = ? AND day = ?
+            ORDER BY hour
+        """, conn, params=(group_id, day))
+        
+        if df.empty:
             return None
+        
+        return df
+    
+    def sender_totals(self, stats):
+        """按发送人汇总消息数，以发送人最新的昵称作为索引，按数量降序排列"""
+        # stats 按小时升序排列，last() 即为当天最后使用的昵称
+        names = stats.groupby('sender_id')['sender_name'].last()
+        totals = stats.groupby('sender_id')['message_count'].sum().sort_values(ascending=False)
+        return totals, names
     
     @filter.event_message_type(filter.EventMessageType.ALL)
     async def on_message(self, event: AstrMessageEvent):
@@ -412,143 +1443,382 @@ class ChatStatsPlugin(Star):
         if not event.message_obj.group_id:
             return
             
+        group_id = event.message_obj.group_id
+        alert = self.pending_alerts.pop(group_id, None)
+        if alert:
+            yield AstrMessageEvent.plain_result(alert)
+            
         # 检查消息内容是否包含触发词
         message = event.message_str.strip()
         
+        for trigger, handler in self.live_triggers.items():
+            if trigger in message and self.activity is not None:
+                try:
+                    # 触发词后面可以跟时间窗口，如 "最近活跃 30分钟"
+                    minutes = activity.parse_minutes(message.split(trigger, 1)[1], self.activity_window_minutes)
+                    yield AstrMessageEvent.plain_result(handler(group_id, minutes))
+                except ValueError as e:
+                    yield AstrMessageEvent.plain_result(str(e))
+                return
+        
         for trigger, handler in self.triggers.items():
             if trigger in message:
-                group_id = event.message_obj.group_id
-                result = await handler(group_id)
+                try:
+                    # 触发词后面可以跟时间范围，如 "群聊排名 7天"、"群聊热力图 2024-05-01~2024-05-31"
+                    days = self.parse_days(message.split(trigger, 1)[1])
+                except ValueError as e:
+                    yield AstrMessageEvent.plain_result(str(e))
+                    break
+                try:
+                    result = await handler(group_id, days)
+                except asyncio.TimeoutError:
+                    result = AstrMessageEvent.plain_result("生成图表超时，请稍后再试")
+                except Exception as e:
+                    logger.error(f"生成图表失败: {str(e)}")
+                    result = AstrMessageEvent.plain_result("生成图表失败，请稍后再试")
                 if result:
                     yield result
                 break
     
-    async def generate_chat_ranking(self, group_id):
-        """生成群聊排名条形图"""
-        df = self.get_today_data(group_id)
-        if df is None or df.empty:
-            return AstrMessageEvent.plain_result("今天还没有聊天记录，无法生成群聊排名")
+    def record_activity(self, record):
+        """存储插件接受的新消息（已去重）计入实时活跃度统计；启用 spike_alert 且该群刚出现消息突增时登记提醒文本"""
+        group_id, sender_id, sender_name, _, _, ts, _, _ = record
+        if not group_id or self.activity is None:
+            return
+        try:
+            self.activity.record(group_id, sender_id, sender_name, ts)
+            if not self.spike_alert:
+                return
+            info = self.activity.check_alert(group_id)
+            if info is None:
+                return
+            logger.info(f"群 {group_id} 消息突增: 最近 {self.spike_minutes} 分钟 {info['recent']} 条")
+            # 两个插件处理同一条消息的先后不确定，提醒在该群的消息事件中发送（最晚为下一条消息）
+            self.pending_alerts[group_id] = f"群聊正在刷屏：最近 {self.spike_minutes} 分钟每分钟 {info['recent_rate']:.1f} 条消息，{self.heat_comparison(info)}"
+        except Exception as e:
+            logger.error(f"更新实时活跃度失败: {str(e)}")
+    
+    def heat_comparison(self, info):
+        """与此前平均速率的比较文本"""
+        if info['ratio'] is None:
+            return f"此前 {info['baseline_minutes']} 分钟没有消息"
+        return f"是此前 {info['baseline_minutes']} 分钟平均速率（每分钟 {info['baseline_rate']:.1f} 条）的 {info['ratio']:.1f} 倍"
+    
+    def recent_activity(self, group_id, minutes=None):
+        """最近若干分钟（默认 10 分钟）的发言排名，直接从内存统计中读取"""
+        minutes = minutes or 10
+        total, senders, ranked = self.activity.top_senders(group_id, minutes)
+        if not total:
+            return f"最近 {minutes} 分钟没有人发言"
+        lines = [f"最近 {minutes} 分钟: {total} 条消息，{senders} 人发言"]
+        lines.extend(f"{rank}. {name}: {count} 条" for rank, (name, count) in enumerate(ranked, 1))
+        return "\n".join(lines)
+    
+    def group_heat(self, group_id, minutes=None):
+        """当前的消息速率以及是否出现消息突增"""
+        info = self.activity.spike(group_id)
+        if info is None:
+            return f"最近 {self.activity_window_minutes} 分钟没有消息"
+        lines = [f"最近 {self.spike_minutes} 分钟: {info['recent']} 条消息，每分钟 {info['recent_rate']:.1f} 条"]
+        if not info['ready']:
+            lines.append(f"插件启动不久，统计满 {self.activity_window_minutes // 2} 分钟后才能判断是否突增")
+        else:
+            lines.append(self.heat_comparison(info))
+            lines.append("状态: 消息突增" if info['spiking'] else "状态: 正常")
+        return "\n".join(lines)
+    
+    def prepare_ranking(self, conn, group_id, day):
+        """查询并汇总某天的排名数据，返回 (发送人列表, 消息数列表)"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='ranking', phase='fetch'):
+            stats = self.get_day_stats(conn, group_id, day)
+        if stats is None or stats.empty:
+            return None
         
         # 按发送人统计消息数量
-        sender_counts = df.groupby('sender_name').size().sort_values(ascending=False)
-        
-        # 生成条形图
-        plt.figure(figsize=(10, 6))
-        sender_counts.plot(kind='bar', color='skyblue')
-        plt.title('今日群聊排名')
-        plt.xlabel('发送人')
-        plt.ylabel('消息数量')
-        plt.tight_layout()
-        
-        # 保存到内存
-        img_buf = io.BytesIO()
-        plt.savefig(img_buf, format='png')
-        img_buf.seek(0)
-        plt.close()
-        
-        # 构建图片消息
-        today = datetime.now().strftime('%Y-%m-%d')
-        image_component = Image(img_buf.getvalue())
-        
-        return AstrMessageEvent.result_builder().add_component(image_component).add_plain(f"{today} 群聊排名统计").build()
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='ranking', phase='aggregate'):
+            totals, names = self.sender_totals(stats)
+            return names.reindex(totals.index).tolist(), totals.tolist()
     
-    async def generate_heatmap(self, group_id):
-        """生成群聊热力图"""
-        df = self.get_today_data(group_id)
-        if df is None or df.empty:
-            return AstrMessageEvent.plain_result("今天还没有聊天记录，无法生成热力图")
-        
-        # 排序发送者按消息总数
-        sender_totals = df.groupby('sender_name').size().sort_values(ascending=False)
-        top_senders = sender_totals.index.tolist()
-        
-        # 限制最多显示10个发送者
-        if len(top_senders) > 10:
-            top_senders = top_senders[:10]
+    def prepare_range_ranking(self, conn, group_id, start_day, end_day):
+        """日期范围内的排名数据，在 SQL 中汇总并只取前 range_ranking_size 名"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='ranking', phase='fetch'):
+            rows = storage.range_sender_totals(conn, group_id, start_day, end_day, self.range_ranking_size)
+        if not rows:
+            return None
+        return [name for name, _ in rows], [count for _, count in rows]
+    
+    def prepare_heatmap(self, conn, group_id, day):
+        """查询并汇总某天的热力图数据，返回 (发送人列表, 发送人 × 24 小时的消息数)"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='heatmap', phase='fetch'):
+            stats = self.get_day_stats(conn, group_id, day)
+        if stats is None or stats.empty:
+            return None
         
-        # 生成热力图数据
-        heatmap_data = []
-        for sender in top_senders:
-            sender_df = df[df['sender_name'] == sender]
-            hourly_counts = sender_df.groupby('hour').size()
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='heatmap', phase='aggregate'):
+            # 排序发送者按消息总数，限制最多显示10个发送者
+            totals, names = self.sender_totals(stats)
+            top_ids = totals.index[:10]
+            top_senders = names.reindex(top_ids).tolist()
             
-            # 确保所有小时都有数据
-            hour_data = [hourly_counts.get(hour, 0) for hour in range(24)]
-            heatmap_data.append(hour_data)
-        
-        # 创建热力图
-        plt.figure(figsize=(12, 8))
-        im = plt.imshow(heatmap_data, cmap='YlOrRd')
-        
-        # 设置标签
-        plt.yticks(np.arange(len(top_senders)), top_senders)
-        plt.xticks(np.arange(0, 24, 1), [f"{h}时" for h in range(24)])
-        plt.xlabel('时间')
-        plt.ylabel('发送人')
-        plt.title('今日群聊热力图')
-        
-        # 添加颜色条
-        plt.colorbar(im, label='消息数量')
-        
-        plt.tight_layout()
-        
-        # 保存到内存
-        img_buf = io.BytesIO()
-        plt.savefig(img_buf, format='png')
-        img_buf.seek(0)
-        plt.close()
+            # 生成热力图数据：发送人 × 24 小时，缺失的小时补 0
+            heatmap_data = stats.pivot_table(
+                index='sender_id', columns='hour', values='message_count', aggfunc='sum', fill_value=0
+            ).reindex(index=top_ids, columns=range(24), fill_value=0).to_numpy()
+        return top_senders, heatmap_data
+    
+    def prepare_range_heatmap(self, conn, group_id, start_day, end_day):
+        """日期范围内 星期 × 24 小时 的消息数，返回 7 × 24 的列表"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='heatmap', phase='fetch'):
+            rows = storage.range_weekday_hours(conn, group_id, start_day, end_day)
+        if not rows:
+            return None
+        heatmap_data = [[0] * 24 for _ in range(7)]
+        for weekday, hour, count in rows:
+            heatmap_data[weekday][hour] = count
+        return heatmap_data
+    
+    def prepare_trend(self, conn, group_id, start_day, end_day):
+        """趋势数据：单日按小时，多日按天，缺少的时间点补 0，返回 (标签, 消息数, 发言人数, 横轴名称)"""
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='trend', phase='fetch'):
+            if start_day == end_day:
+                rows = storage.day_hourly_counts(conn, group_id, start_day)
+            else:
+                rows = storage.range_daily_counts(conn, group_id, start_day, end_day)
+        if not rows:
+            return None
+        points = {key: (count, senders) for key, count, senders in rows}
+        if start_day == end_day:
+            keys, labels, xlabel = range(24), [f"{h}时" for h in range(24)], '时间'
+        else:
+            start = datetime.strptime(start_day, '%Y-%m-%d').date()
+            end = datetime.strptime(end_day, '%Y-%m-%d').date()
+            days = list(date_range.iter_days(start, end))
+            keys = [day.strftime('%Y-%m-%d') for day in days]
+            labels, xlabel = [day.strftime('%m-%d') for day in days], '日期'
+        counts = [points.get(key, (0, 0))[0] for key in keys]
+        senders = [points.get(key, (0, 0))[1] for key in keys]
+        return labels, counts, senders, xlabel
+    
+    async def reply_chart(self, group_id, days, kind, name, create):
+        """生成（或从缓存取出）图表并构建图片消息"""
+        image_bytes = await self.cached_render(group_id, days, kind, create)
+        if image_bytes is None:
+            if days == self.today_range():
+                return AstrMessageEvent.plain_result(f"今天还没有聊天记录，无法生成{name}")
+            return AstrMessageEvent.plain_result(f"{self.period_label(days)} 没有聊天记录，无法生成{name}")
         
         # 构建图片消息
-        today = datetime.now().strftime('%Y-%m-%d')
-        image_component = Image(img_buf.getvalue())
+        image_component = Image(image_bytes)
         
-        return AstrMessageEvent.result_builder().add_component(image_component).add_plain(f"{today} 群聊热力图").build()
+        return AstrMessageEvent.result_builder().add_component(image_component).add_plain(f"{self.period_label(days)} {name}统计").build()
     
-    async def generate_wordcloud(self, group_id):
-        """生成群聊词云"""
-        df = self.get_today_data(group_id)
-        if df is None or df.empty:
-            return AstrMessageEvent.plain_result("今天还没有聊天记录，无法生成词云")
-        
-        # 合并所有消息文本
-        all_text = ' '.join(df['message'].tolist())
+    async def generate_chat_ranking(self, group_id, days=None):
+        """生成群聊排名条形图，默认为今天"""
+        days = days or self.today_range()
+        return await self.reply_chart(group_id, days, 'ranking', '群聊排名', lambda: self.render_ranking(group_id, days))
+    
+    async def generate_heatmap(self, group_id, days=None):
+        """生成群聊热力图：单日为 发送人 × 小时，多日为 星期 × 小时，默认为今天"""
+        days = days or self.today_range()
+        return await self.reply_chart(group_id, days, 'heatmap', '群聊热力图', lambda: self.render_heatmap(group_id, days))
+    
+    async def generate_wordcloud(self, group_id, days=None):
+        """生成群聊词云，默认为今天"""
+        days = days or self.today_range()
+        return await self.reply_chart(group_id, days, 'wordcloud', '群聊词云', lambda: self.render_wordcloud(group_id, days))
+    
+    async def generate_trend(self, group_id, days=None):
+        """生成消息数和发言人数的趋势图，默认为最近 7 天"""
+        days = days or self.today_range(7)
+        return await self.reply_chart(group_id, days, 'trend', '群聊趋势', lambda: self.render_trend(group_id, days))
+    
+    async def generate_daily_report(self, group_id, days=None):
+        """昨天（或指定的某一天）的排名、热力图和词云，已预先生成时直接读取"""
+        day = days[0] if days else (datetime.now().date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        days = (day, day)
+        builder = AstrMessageEvent.result_builder()
+        found = False
+        for kind, create in self.report_creators(group_id, days).items():
+            image_bytes = await self.cached_render(group_id, days, kind, create)
+            if image_bytes is not None:
+                builder.add_component(Image(image_bytes))
+                found = True
+        if not found:
+            return AstrMessageEvent.plain_result(f"{day} 没有聊天记录，无法生成群聊报告")
+        return builder.add_plain(f"{day} 群聊报告").build()
+    
+    @filter.command("sqlchat_report")
+    async def global_report(self, event: AstrMessageEvent):
+        """生成全部群聊的汇总报告（图片和 CSV 文件）"""
+        # 检查管理员权限
+        if not event.is_admin():
+            yield event.plain_result("只有管理员可以执行此操作")
+            return
         
-        # 过滤掉表情符号、URL等
-        all_text = re.sub(r'http\S+', '', all_text)  # 移除URL
-        all_text = re.sub(r'[^\w\s]', '', all_text)  # 移除标点符号
+        if self.chat_storage is None:
+            yield event.plain_result("未找到聊天记录数据库")
+            return
         
-        # 使用jieba进行中文分词
-        words = ' '.join(jieba.cut(all_text))
+        message_parts = event.message_str.split(maxsplit=1)
+        try:
+            # 命令后面可以跟时间范围，默认为最近 7 天
+            days = self.parse_days(message_parts[1] if len(message_parts) > 1 else '') or self.today_range(7)
+        except ValueError as e:
+            yield event.plain_result(str(e))
+            return
         
-        # 生成词云
-        wordcloud = WordCloud(
-            font_path='/System/Library/Fonts/PingFang.ttc',  # macOS中文字体
-            width=800,
-            height=400,
-            background_color='white',
-            max_words=100,
-            contour_width=1,
-            contour_color='steelblue'
-        ).generate(words)
+        if self.global_report_lock.locked():
+            yield event.plain_result("正在生成另一份全局报告，请稍后再试")
+            return
         
-        # 创建图像
-        plt.figure(figsize=(10, 6))
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.axis('off')
-        plt.tight_layout()
+        async with self.global_report_lock:
+            try:
+                result = await self.build_global_report(days)
+            except asyncio.TimeoutError:
+                result = event.plain_result("生成全局报告超时，请缩小时间范围后重试")
+            except Exception as e:
+                logger.error(f"生成全局报告失败: {str(e)}")
+                result = event.plain_result(f"生成全局报告失败: {str(e)}")
+        yield result
+    
+    async def scan_all_groups(self, start_day, end_day):
+        """把全部群分块，在临时的进程池中并行统计并合并为 GlobalReport"""
+        group_ids = await self.chat_storage.read(storage.list_groups)
+        workers = self.global_report_workers or os.cpu_count() or 1
+        # 块数多于进程数，先完成的进程继续处理剩下的块，消息量集中在少数大群时负载也比较均衡
+        chunks = global_report.split_groups(group_ids, workers * 4)
+        if not chunks:
+            return global_report.GlobalReport()
+        loop = asyncio.get_running_loop()
+        # 报告不常生成，用完即关闭进程池，不常驻占用内存
+        pool = process_pool(min(workers, len(chunks)))
+        try:
+            parts = await asyncio.wait_for(asyncio.gather(*(
+                loop.run_in_executor(pool, global_report.scan_groups, self.chat_storage.db_path, chunk, start_day, end_day)
+                for chunk in chunks
+            )), self.render_timeout)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await asyncio.to_thread(global_report.GlobalReport, parts)
+    
+    async def build_global_report(self, days):
+        """统计日期范围内的全部群聊，返回包含汇总图片、CSV 文件和文字摘要的消息"""
+        start_day, end_day = days
+        label = self.period_label(days)
+        start = time.perf_counter()
+        with metrics.registry.timer('sqlchat_chart_seconds', chart='global_report', phase='fetch'):
+            report = await self.scan_all_groups(start_day, end_day)
+        messages = report.messages
+        if not messages:
+            return AstrMessageEvent.plain_result(f"{label} 没有群聊记录，无法生成全局报告")
         
-        # 保存到内存
-        img_buf = io.BytesIO()
-        plt.savefig(img_buf, format='png')
-        img_buf.seek(0)
-        plt.close()
+        top_groups = report.top_groups(self.global_report_size)
+        top_senders = report.top_senders(self.global_report_size)
+        names = await self.chat_storage.read(storage.sender_names, [sender_id for sender_id, _, _ in top_senders])
+        group_labels = [group_id for group_id, _, _ in top_groups]
+        sender_labels = [names.get(sender_id, sender_id) for sender_id, _, _ in top_senders]
+        image_bytes = await self.render(
+            charts.render_global_report,
+            group_labels, [count for _, count, _ in top_groups],
+            sender_labels, [count for _, count, _ in top_senders],
+            report.hour_shares(group_labels), f"{label} 全部群聊报告"
+        )
         
-        # 构建图片消息
-        today = datetime.now().strftime('%Y-%m-%d')
-        image_component = Image(img_buf.getvalue())
+        csv_name = f"global_report_{start_day}_{end_day}.csv"
+        csv_path = os.path.join(tempfile.gettempdir(), "astrbot_chat_stats", csv_name)
+        await asyncio.to_thread(report.write_csv, csv_path)
+        elapsed = time.perf_counter() - start
+        metrics.registry.observe('sqlchat_chart_seconds', elapsed, chart='global_report', phase='total')
         
-        return AstrMessageEvent.result_builder().add_component(image_component).add_plain(f"{today} 群聊词云").build()
+        lines = [
+            f"{label} 全部群聊报告",
+            f"共 {len(report.hours)} 个群、{len(report.senders)} 位发言人、{messages} 条消息，耗时 {elapsed:.1f} 秒",
+            "消息最多的群: " + "，".join(f"{group_id}（{count}）" for group_id, count, _ in top_groups[:5]),
+            "消息最多的发送人: " + "，".join(
+                f"{name}（{count}）" for name, (_, count, _) in zip(sender_labels[:5], top_senders)
+            ),
+            f"各群的消息数、发言人数和每小时消息数见 {csv_name}",
+        ]
+        return (
+            AstrMessageEvent.result_builder()
+            .add_component(Image(image_bytes))
+            .add_component(File(name=csv_name, file=csv_path))
+            .add_plain("\n".join(lines))
+            .build()
+        )
+    
+    async def render_ranking(self, group_id, days):
+        """查询排名数据并绘制条形图，没有数据时返回 None"""
+        start_day, end_day = days
+        if start_day == end_day:
+            data = await self.chat_storage.read(self.prepare_ranking, group_id, start_day)
+        else:
+            data = await self.chat_storage.read(self.prepare_range_ranking, group_id, start_day, end_day)
+        if data is None:
+            return None
+        names, counts = data
+        title = self.chart_title(days, '群聊排名')
+        if self.chart_renderer == 'fast':
+            return await self.render(fast_charts.render_ranking, names, counts, title, *self.fast_options())
+        return await self.render(charts.render_ranking, names, counts, title)
+    
+    async def render_heatmap(self, group_id, days):
+        """查询热力图数据并绘制热力图，没有数据时返回 None"""
+        start_day, end_day = days
+        title = self.chart_title(days, '群聊热力图')
+        if start_day == end_day:
+            data = await self.chat_storage.read(self.prepare_heatmap, group_id, start_day)
+            if data is None:
+                return None
+            rows, heatmap_data = data
+            ylabel = '发送人'
+        else:
+            heatmap_data = await self.chat_storage.read(self.prepare_range_heatmap, group_id, start_day, end_day)
+            if heatmap_data is None:
+                return None
+            rows, ylabel = WEEKDAYS, '星期'
+        if self.chart_renderer == 'fast':
+            return await self.render(fast_charts.render_heatmap, rows, heatmap_data, title, ylabel, *self.fast_options())
+        return await self.render(charts.render_heatmap, rows, heatmap_data, title, ylabel)
+    
+    async def render_wordcloud(self, group_id, days):
+        """查询词频并绘制词云，没有数据时返回 None"""
+        start_day, end_day = days
+        if start_day == end_day:
+            frequencies = await self.chat_storage.read(self.get_day_terms, group_id, start_day)
+        else:
+            frequencies = await self.chat_storage.read(self.get_range_terms, group_id, start_day, end_day)
+        if not frequencies:
+            return None
+        font_path = charts.find_cjk_font(self.font_path)
+        if font_path is None:
+            logger.warning("未找到中文字体，词云中的中文可能无法显示，请在配置文件中设置 font_path")
+        return await self.render(charts.render_wordcloud, frequencies, font_path, self.wordcloud_max_words)
+    
+    async def render_trend(self, group_id, days):
+        """查询趋势数据并绘制折线图，没有数据时返回 None"""
+        data = await self.chat_storage.read(self.prepare_trend, group_id, *days)
+        if data is None:
+            return None
+        labels, counts, senders, xlabel = data
+        return await self.render(charts.render_trend, labels, counts, senders, self.chart_title(days, '群聊趋势'), xlabel)
     
     async def terminate(self):
-        """终止插件"""
+        """终止插件，关闭绘图进程池并释放数据库服务"""
+        for task in (self.warm_up_task, self.report_task, self.report_retry_task):
+            if task is not None:
+                task.cancel()
+        self.warm_up_task = None
+        self.report_task = None
+        self.report_retry_task = None
+        if self.render_pool is not None:
+            self.render_pool.shutdown(wait=False, cancel_futures=True)
+            self.render_pool = None
+        if self.chat_storage is not None:
+            chat_storage, self.chat_storage = self.chat_storage, None
+            chat_storage.remove_listener(self.record_activity)
+            await storage.release(chat_storage)
         logger.info("群聊统计分析插件已终止")
+
+
+metrics.registry.set('sqlchat_startup_seconds', time.perf_counter() - IMPORT_STARTED, phase='import')
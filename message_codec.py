@@ -0,0 +1,124 @@
+"""聊天消息正文的压缩编码
+
+较长的消息（转发的文章、粘贴的日志、gewechat 的 XML 卡片等）用 zlib（raw deflate）压缩后以 BLOB 保存，
+并可以使用从已有消息中训练出的预置字典（zdict）：同类消息共有的标签、URL 前缀等片段放在字典中，
+每条消息只需引用字典即可，短至几百字节的消息也能压缩。
+
+压缩格式：2 字节字典编号（大端，0 表示不使用字典）+ raw deflate 数据。
+短消息和压缩后没有变小的消息保持原样（str），读取时按值的类型区分。
+
+本模块不依赖 AstrBot 和数据库。
+"""
+import re
+import zlib
+
+HEADER_BYTES = 2
+
+# deflate 的窗口为 32KB，字典更长也只有最后 32KB 有效
+MAX_DICTIONARY_BYTES = 32 * 1024
+
+# 字典候选片段：XML 标签、URL 和不含空白的连续片段
+FRAGMENT_PATTERN = re.compile(r'<[^<>]{1,200}>|https?://[^\s<>"\']{1,200}|[^\s<>]{4,64}')
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_BYTES):
+    """从样本消息中训练预置字典，没有可用内容时返回 b''
+
+    先挑选在多条消息中重复出现的片段，按 (出现的消息数 - 1) × 字节数 估算收益，收益越高的片段
+    放在越靠后的位置（deflate 引用距离越近编码越短，字典末尾离待压缩的数据最近）；
+    剩余的空间放入最典型的几条完整样本（所含片段最常见的消息），覆盖片段之间的固定结构。
+    """
+    samples = [text for text in samples if text]
+    fragments = [set(FRAGMENT_PATTERN.findall(text)) for text in samples]
+    counts = {}
+    for found in fragments:
+        for fragment in found:
+            counts[fragment] = counts.get(fragment, 0) + 1
+    scored = sorted(
+        ((count - 1) * len(fragment.encode('utf-8')), fragment)
+        for fragment, count in counts.items() if count >= 2
+    )
+    # 片段最多占一半空间
+    chosen = []
+    total = 0
+    for _, fragment in reversed(scored):
+        data = fragment.encode('utf-8')
+        if total + len(data) > size // 2:
+            continue
+        chosen.append(data)
+        total += len(data)
+
+    # 样本的典型程度：所含片段的平均出现次数
+    typical = sorted(
+        range(len(samples)),
+        key=lambda i: sum(counts[fragment] for fragment in fragments[i]) / (len(fragments[i]) or 1),
+        reverse=True,
+    )
+    examples = []
+    for i in typical:
+        data = samples[i].encode('utf-8')
+        if total + len(data) > size:
+            continue
+        examples.append(data)
+        total += len(data)
+    return b''.join(examples) + b''.join(reversed(chosen))
+
+
+def compress(text, zdict=b'', dict_id=0, level=6):
+    """压缩为 BLOB（字典编号 + raw deflate）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict) if zdict else \
+        zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    return dict_id.to_bytes(HEADER_BYTES, 'big') + data
+
+
+def decompress(blob, zdict=b''):
+    """解压 compress 的结果，zdict 为压缩时使用的字典"""
+    decompressor = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    data = decompressor.decompress(blob[HEADER_BYTES:]) + decompressor.flush()
+    return data.decode('utf-8')
+
+
+def dictionary_id(blob):
+    """BLOB 使用的字典编号"""
+    return int.from_bytes(blob[:HEADER_BYTES], 'big')
+
+
+class MessageCodec:
+    """一个数据库的压缩配置和字典，由该数据库的所有连接（写线程和读线程）共享
+
+    min_bytes 为 0 时不压缩新消息，已压缩的消息仍然可以读取。
+    loader 在遇到未知的字典编号（例如由其他进程训练的字典）时调用，返回 {编号: 字典}。
+    """
+
+    def __init__(self, min_bytes=0, loader=None):
+        self.min_bytes = min_bytes
+        self.dictionaries = {}
+        self.loader = loader
+
+    @property
+    def current(self):
+        """新消息使用的字典编号（最新训练的字典），没有字典时为 0"""
+        return max(self.dictionaries, default=0)
+
+    def pack(self, text):
+        """按配置压缩消息：达到 min_bytes 且压缩后更小时返回 BLOB，否则原样返回"""
+        if not self.min_bytes or not isinstance(text, str) or len(text) * 3 < self.min_bytes:
+            return text
+        size = len(text.encode('utf-8'))
+        if size < self.min_bytes:
+            return text
+        dict_id = self.current
+        blob = compress(text, self.dictionaries.get(dict_id, b''), dict_id)
+        return blob if len(blob) < size else text
+
+    def unpack(self, value):
+        """还原消息正文：BLOB 解压，其他值原样返回（注册为 SQL 函数 unpack_message）"""
+        if not isinstance(value, bytes):
+            return value
+        dict_id = dictionary_id(value)
+        if dict_id and dict_id not in self.dictionaries and self.loader is not None:
+            self.dictionaries.update(self.loader())
+        if dict_id and dict_id not in self.dictionaries:
+            raise ValueError(f"缺少消息压缩字典 {dict_id}")
+        return decompress(value, self.dictionaries.get(dict_id, b''))
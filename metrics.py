@@ -0,0 +1,201 @@
+"""插件运行指标：延迟直方图、计数器和瞬时值
+
+指标名和标签遵循 Prometheus 的约定，可以导出为 Prometheus 文本格式。
+记录一次观测只需一次加锁和一次二分查找，可以在写线程、读线程池中直接调用。
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 延迟直方图的桶上限（秒），覆盖从亚毫秒的单条写入到数秒的图表生成
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+HELP = {
+    'sqlchat_ingest_seconds': "写入一批消息各阶段的耗时（insert: 插入记录, derive: 更新聚合表和全文索引, commit: 提交, total: 含排队的总耗时）",
+    'sqlchat_messages_total': "处理的消息条数（stored: 已写入, spooled: 写入暂存文件等待回放, failed: 写入失败被丢弃）",
+    'sqlchat_duplicates_total': "被丢弃的重复投递消息条数（memory: 命中最近消息 ID 缓存, database: 被唯一索引忽略）",
+    'sqlchat_write_queue_depth': "批量写入队列中等待写入的消息条数",
+    'sqlchat_spool_depth': "暂存文件中等待回放的消息条数",
+    'sqlchat_spool_replayed_total': "从暂存文件回放到数据库的消息条数",
+    'sqlchat_query_seconds': "/sqlchat_query 各查询模式的耗时",
+    'sqlchat_chart_seconds': "图表生成各阶段的耗时（fetch: 查询, aggregate: 汇总, render: 绘制, encode: PNG 编码, total: 总耗时）",
+    'sqlchat_chart_cache_total': "图表缓存命中（hit）、未命中但读取到预先生成的报告（report）和重新生成（miss）的次数",
+    'sqlchat_term_index_seconds': "词频索引各阶段的耗时（segment: 分词统计, save: 累加写入）",
+    'sqlchat_records': "主数据库中的记录数",
+    'sqlchat_db_bytes': "数据库文件大小（main: 主数据库, wal: WAL 文件, archive: 归档分区合计）",
+    'sqlchat_startup_seconds': "插件启动各阶段的耗时（import: 导入插件模块, initialize: 初始化, warm_up: 后台预热）",
+    'sqlchat_process_rss_bytes': "进程常驻内存（stage 标签为测量时所处的阶段）",
+    'sqlchat_render_workers_rss_bytes': "绘图进程的常驻内存合计（stage 标签同上，workers 标签为已启动的进程数）",
+}
+
+
+def process_rss_bytes(pid=None):
+    """进程（默认为当前进程）的常驻内存（字节）：Linux 读取 /proc/<pid>/statm，
+    其他系统只能退而使用当前进程的峰值常驻内存，无法获取时返回 None"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None or pid is not None:
+        return None
+    # ru_maxrss 在 macOS 上以字节为单位，在 Linux 上以 KB 为单位
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Histogram:
+    """累积分布直方图，只保存各桶计数、总和与次数"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """根据桶计数估算分位数（桶内线性插值），没有观测时返回 None"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """标签元组格式化为 {key="value",...}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """指标注册表：名称 + 标签 -> 直方图 / 计数器 / 瞬时值"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        """记录一次观测（延迟以秒为单位）"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """计数器增加 value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """设置瞬时值"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def timer(self, name, **labels):
+        """with 语句块的耗时记录到直方图 name"""
+        return Timer(self, name, labels)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def summary(self):
+        """返回便于阅读的摘要行：计数器、瞬时值和各直方图的次数与 p50/p95/p99（毫秒）"""
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{format_labels(labels)} = {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{format_labels(labels)} = {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                p50, p95, p99 = (histogram.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))
+                lines.append(
+                    f"{name}{format_labels(labels)}: {histogram.count} 次, "
+                    f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms"
+                )
+        return lines
+
+    def format_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges), ('histogram', self.histograms)):
+                names = sorted({name for name, _ in metrics})
+                for name in names:
+                    if name in HELP:
+                        lines.append(f"# HELP {name} {HELP[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric_name, labels), value in sorted(metrics.items()):
+                        if metric_name != name:
+                            continue
+                        if kind != 'histogram':
+                            lines.append(f"{name}{format_labels(labels)} {value}")
+                            continue
+                        cumulative = 0
+                        for bucket, bucket_count in zip(value.buckets + ('+Inf',), value.counts):
+                            cumulative += bucket_count
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', bucket),))} {cumulative}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {value.sum}")
+                        lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """写入 Prometheus 文本文件（供 node_exporter textfile collector 读取），先写临时文件再改名"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.format_prometheus())
+        os.replace(tmp_path, path)
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+# 两个插件共用的注册表
+registry = Metrics()
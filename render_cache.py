@@ -0,0 +1,125 @@
+"""已生成图表的缓存
+
+缓存键为 (group_id, day, kind)，每个条目同时记录生成时的数据水位（如该群当天的消息数）。
+水位变化或超过有效期后条目失效；相同键和水位的并发请求共用同一次生成。
+已经结束的日期数据不会再变化，可以选择同时保存到磁盘，插件重启后仍然有效。
+磁盘上的文件名还包含生成图片的绘图配置（variant）和实际的图片格式，修改配置后旧文件不再命中。
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+
+class RenderCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=600, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir or None
+        # key -> (watermark, 生成时间, 图片字节)，按最近使用顺序排列
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # (key, (watermark, variant, extension)) -> 正在生成的任务
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, watermark):
+        """返回仍然有效的缓存内容，不存在或已失效时返回 None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            cached_watermark, created, data = entry
+            if cached_watermark == watermark and time.monotonic() - created < self.ttl:
+                self.entries.move_to_end(key)
+                return data
+            self.remove(key)
+        return None
+
+    def put(self, key, watermark, data):
+        """写入缓存，总大小超出上限时淘汰最久未使用的条目"""
+        if len(data) > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (watermark, time.monotonic(), data)
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def remove(self, key):
+        """删除内存中的缓存条目"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[2])
+
+    def clear(self):
+        """清空内存中的缓存"""
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def disk_path(self, key, watermark, variant='', extension='png'):
+        """磁盘缓存文件路径，文件名包含水位和绘图配置，两者变化后自然不再命中"""
+        group_id, day, kind = key
+        group_hash = hashlib.sha1(str(group_id).encode('utf-8')).hexdigest()[:16]
+        name = f"{group_hash}_{kind}_{watermark}"
+        if variant:
+            name += "_" + hashlib.sha1(str(variant).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.disk_dir, day, f"{name}.{extension}")
+
+    def load_disk(self, key, watermark, variant='', extension='png'):
+        """从磁盘读取缓存，不存在时返回 None"""
+        if not self.disk_dir:
+            return None
+        path = self.disk_path(key, watermark, variant, extension)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def save_disk(self, key, watermark, data, variant='', extension='png'):
+        """写入磁盘缓存：先写临时文件再改名，避免读到不完整的文件"""
+        if not self.disk_dir:
+            return
+        path = self.disk_path(key, watermark, variant, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def get_or_create(self, key, watermark, create, persist=False, variant='', extension='png'):
+        """返回缓存的图片；未命中时调用 create() 生成，同一键和水位的并发请求只生成一次
+
+        persist 为 True 表示该数据不会再变化，命中失败时先查磁盘，生成后同时写入磁盘。
+        variant 为影响图片内容的绘图配置，extension 为图片格式的扩展名，与水位一起决定缓存是否命中。
+        create 返回 None 表示无法生成，结果不会被缓存。
+        """
+        mark = (watermark, variant, extension)
+        data = self.get(key, mark)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        task = self.inflight.get((key, mark))
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._create(key, watermark, create, persist, variant, extension))
+            self.inflight[(key, mark)] = task
+            task.add_done_callback(lambda _: self.inflight.pop((key, mark), None))
+        else:
+            self.hits += 1
+        # shield 避免某个等待者被取消时连带取消其他请求共用的生成任务
+        return await asyncio.shield(task)
+
+    async def _create(self, key, watermark, create, persist, variant, extension):
+        data = None
+        if persist:
+            data = await asyncio.to_thread(self.load_disk, key, watermark, variant, extension)
+        if data is None:
+            data = await create()
+            if data is not None and persist:
+                await asyncio.to_thread(self.save_disk, key, watermark, data, variant, extension)
+        if data is not None:
+            self.put(key, (watermark, variant, extension), data)
+        return data
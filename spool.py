@@ -0,0 +1,161 @@
+"""数据库暂时不可写时的消息暂存文件（spool）
+
+写入数据库失败（database is locked、磁盘错误、插件重新打开数据库期间等）或批量写入队列已满时，
+消息追加到与数据库同目录的暂存文件中，数据库恢复后由后台任务按批回放。
+
+文件格式：8 字节魔数 + 16 字节代号（generation），之后是追加的条目，
+每个条目为 4 字节长度 + 4 字节 CRC32（均为大端）+ JSON 编码的一批记录（字段顺序见 storage.RECORD_FIELDS）。
+每次追加后 fsync；进程崩溃时写了一半的末尾条目通不过长度或校验检查，打开文件时被截掉。
+
+回放进度以 "代号:偏移" 的形式与回放的记录在同一个事务中写入 chat_meta（见 storage.insert_records 的 checkpoint），
+崩溃后从该位置继续，已写入的记录不会被重复写入。全部回放完成后文件被替换为新代号的空文件，
+旧代号的进度自然失效。
+
+本模块不依赖 AstrBot 和数据库。
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+
+MAGIC = b'CHATSPL1'
+GENERATION_BYTES = 16
+HEADER_BYTES = len(MAGIC) + GENERATION_BYTES
+ENTRY_HEADER = struct.Struct('>II')
+# 单个条目的长度上限，超过时视为损坏（正常的一批 500 条消息远小于该值）
+MAX_ENTRY_BYTES = 64 * 1024 * 1024
+
+# 回放进度在 chat_meta 中的键
+CHECKPOINT_KEY = 'spool_position'
+
+
+def encode_entry(records):
+    payload = json.dumps([list(record) for record in records], ensure_ascii=False).encode('utf-8')
+    return ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def scan_entries(f, offset, max_records=None):
+    """从 offset 开始读取完整且校验通过的条目，返回 ([(记录列表, 条目结束位置)], 最后一个有效条目的结束位置)"""
+    f.seek(offset)
+    entries = []
+    count = 0
+    while max_records is None or count < max_records:
+        header = f.read(ENTRY_HEADER.size)
+        if len(header) < ENTRY_HEADER.size:
+            break
+        length, crc = ENTRY_HEADER.unpack(header)
+        if length > MAX_ENTRY_BYTES:
+            break
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records = [tuple(record) for record in json.loads(payload.decode('utf-8'))]
+        offset += ENTRY_HEADER.size + length
+        entries.append((records, offset))
+        count += len(records)
+    return entries, offset
+
+
+class MessageSpool:
+    """追加写入、按批回放的消息暂存文件，可以在多个线程中使用"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.generation = None
+        # 已回放到的位置、之后待回放的记录数和文件大小
+        self.offset = HEADER_BYTES
+        self.pending = 0
+        self.size = HEADER_BYTES
+        # 打开文件时截掉的损坏字节数
+        self.discarded = 0
+
+    def open(self):
+        """打开（或创建）暂存文件，截掉末尾不完整的条目，返回待回放的记录数"""
+        with self.lock:
+            if os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    header = f.read(HEADER_BYTES)
+                    if len(header) == HEADER_BYTES and header.startswith(MAGIC):
+                        entries, end = scan_entries(f, HEADER_BYTES)
+                        self.generation = header[len(MAGIC):].hex()
+                        self.pending = sum(len(records) for records, _ in entries)
+                        self.size = end
+                        self.discarded = os.path.getsize(self.path) - end
+            if self.generation is None:
+                self._create()
+            elif self.discarded:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self.size)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.file = open(self.path, 'ab')
+            return self.pending
+
+    def _create(self):
+        """原子地替换为新代号的空文件"""
+        generation = os.urandom(GENERATION_BYTES)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.generation = generation.hex()
+        self.offset = self.size = HEADER_BYTES
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def append(self, records):
+        """追加一批记录并 fsync，返回后即使进程崩溃这批记录也不会丢失"""
+        data = encode_entry(records)
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.size += len(data)
+            self.pending += len(records)
+
+    def restore(self, checkpoint):
+        """根据数据库中保存的回放进度（checkpoint_value 的结果）设置回放起点，返回待回放的记录数"""
+        generation, _, offset = (checkpoint or '').partition(':')
+        with self.lock:
+            if generation != self.generation or not offset.isdigit():
+                # 数据库中没有进度，或进度属于已经回放完毕的旧文件
+                return self.pending
+            offset = min(int(offset), self.size)
+            with open(self.path, 'rb') as f:
+                entries, _ = scan_entries(f, HEADER_BYTES)
+            self.offset = offset
+            self.pending = sum(len(records) for records, end in entries if end > offset)
+            return self.pending
+
+    def read_batch(self, max_records):
+        """读取回放起点之后的若干个条目（至少一个，合计约 max_records 条记录），返回 (记录列表, 结束位置)"""
+        with self.lock:
+            if self.pending == 0:
+                return [], self.offset
+            with open(self.path, 'rb') as f:
+                entries, end = scan_entries(f, self.offset, max_records)
+        return [record for records, _ in entries for record in records], end
+
+    def checkpoint_value(self, end):
+        """回放到 end 时写入 chat_meta 的进度"""
+        return f"{self.generation}:{end}"
+
+    def advance(self, end, count):
+        """记录已回放到 end（共 count 条），全部回放完毕时换成新代号的空文件"""
+        with self.lock:
+            self.offset = end
+            self.pending = max(self.pending - count, 0)
+            if self.offset >= self.size and self.file is not None:
+                self.file.close()
+                self._create()
+                self.file = open(self.path, 'ab')
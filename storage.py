@@ -0,0 +1,1711 @@
+"""聊天记录数据库的表结构、版本迁移、公共读写函数、按月归档分区和共享的数据库服务
+
+本模块不依赖 AstrBot，插件之外的工具也可以直接使用。jieba 仅在需要分词时才会导入。
+
+消息正文可以压缩保存（见 message_codec 和 configure_compression），此时 message 列中较长的消息为 BLOB，
+读取正文的 SQL 都通过 unpack_message(message) 还原，该函数在 connect_writer / connect_reader 打开的连接上注册。
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    from . import message_codec
+except ImportError:
+    # 作为独立模块导入（chat_cli.py 等命令行工具）
+    import message_codec
+
+# 当前数据库结构版本，保存在 PRAGMA user_version 中
+#   1（或 0）: timestamp 为 ISO 文本，group_id/sender_id/timestamp 各自单列索引
+#   2: 新增整数毫秒时间戳列 ts，使用 (group_id, ts)、(sender_id, ts) 复合索引
+#   3: 群 ID、发送人 ID 和昵称移入维度表 chat_groups / chat_senders，记录中只保存整数键
+#   4: (平台, 群, message_id) 唯一索引，重复投递的消息不会被重复写入
+SCHEMA_VERSION = 4
+
+# 待插入记录（insert_records 的输入）的字段顺序
+RECORD_FIELDS = ('group_id', 'sender_id', 'sender_name', 'message', 'timestamp', 'ts', 'message_id', 'platform')
+
+# 平台为默认值时 platform 列存 NULL
+DEFAULT_PLATFORM = 'gewechat'
+
+# 与已有记录的 (平台, 群, message_id) 重复时忽略，见 MESSAGE_INDEX
+INSERT_SQL = '''
+INSERT OR IGNORE INTO chat_records (group_key, sender_key, message, timestamp, ts, message_id, platform)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 聊天记录表，主数据库和归档分区结构相同；分区中的整数键同样指向主数据库的维度表
+RECORDS_TABLE = '''
+CREATE TABLE IF NOT EXISTS {schema}.chat_records (
+    id INTEGER PRIMARY KEY{autoincrement},
+    group_key INTEGER,
+    sender_key INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    message_id TEXT,
+    platform TEXT,
+    ts INTEGER
+)
+'''
+
+# chat_records 的二级索引：复合索引覆盖按群/按人查询某个时间范围的主要查询
+RECORD_INDEXES = {
+    'idx_records_group_ts': '(group_key, ts)',
+    'idx_records_sender_ts': '(sender_key, ts)',
+    'idx_records_ts': '(ts)',
+}
+
+# 消息去重的唯一索引：platform 和 group_key 可能为 NULL（默认平台、私聊），
+# 而唯一索引中的 NULL 互不相等，所以对表达式建索引；没有 message_id 的记录不参与去重
+MESSAGE_KEY = "IFNULL(platform, ''), IFNULL(group_key, 0), message_id"
+MESSAGE_INDEX = f'''
+CREATE {{unique}}INDEX IF NOT EXISTS {{name}} ON chat_records ({MESSAGE_KEY}) WHERE message_id != ''
+'''
+
+
+def table_exists(cursor, name):
+    """判断数据表是否存在"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def create_tables(conn, fts=False):
+    """创建数据表（如果不存在），并将旧版本的数据库迁移到当前版本
+
+    fts 为 True 时创建全文索引表，为 False 时删除已有的全文索引表，避免索引与数据不一致。
+    """
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    records_exist = table_exists(cursor, 'chat_records')
+
+    # 创建聊天记录表和群、发送人维度表
+    create_records_table(cursor)
+    create_dimension_tables(cursor)
+
+    # 插件内部状态表（回填进度等）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+
+    # 记录数计数，已有数据库首次升级时统计一次；之后每次建表只检查计数是否存在，不再扫描全表
+    if cursor.execute("SELECT 1 FROM chat_meta WHERE key = 'record_count'").fetchone() is None:
+        cursor.execute(
+            "INSERT INTO chat_meta (key, value) SELECT 'record_count', COUNT(*) FROM chat_records"
+        )
+
+    if not records_exist:
+        cursor.execute(MESSAGE_INDEX.format(unique='UNIQUE ', name='idx_records_message'))
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    else:
+        if version < 2:
+            migrate_v2(cursor)
+        if version < 3:
+            migrate_v3(conn)
+        if version < 4:
+            migrate_v4(cursor)
+
+    create_record_indexes(cursor)
+
+    # 按 群/天/小时/发送人 预聚合的消息数，供排名和热力图使用
+    rollup_exists = table_exists(cursor, 'chat_hourly_stats')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_hourly_stats (
+        group_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        sender_id TEXT NOT NULL,
+        sender_name TEXT,
+        message_count INTEGER NOT NULL,
+        PRIMARY KEY (group_id, day, hour, sender_id)
+    ) WITHOUT ROWID
+    ''')
+    if not rollup_exists:
+        # 新建的聚合表需要回填已有的聊天记录，新消息由写入路径增量维护
+        schedule_backfill(cursor, 'rollup')
+
+    # 按 群/天 统计的词频，供词云使用，由后台任务分词后增量累加
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_terms (
+        group_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        term TEXT NOT NULL,
+        freq INTEGER NOT NULL,
+        PRIMARY KEY (group_id, day, term)
+    ) WITHOUT ROWID
+    ''')
+
+    # 消息压缩字典，见 configure_compression
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_dicts (
+        id INTEGER PRIMARY KEY,
+        dictionary BLOB NOT NULL,
+        samples INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    ''')
+
+    create_reports_table(cursor)
+
+    if fts:
+        create_fts(cursor)
+    elif table_exists(cursor, 'chat_fts'):
+        drop_fts(cursor)
+
+    conn.commit()
+    load_compression(conn)
+
+
+def create_records_table(cursor, schema='main'):
+    """创建聊天记录表（如果不存在）；归档分区的 id 沿用主数据库的记录，不使用 AUTOINCREMENT"""
+    autoincrement = ' AUTOINCREMENT' if schema == 'main' else ''
+    cursor.execute(RECORDS_TABLE.format(schema=schema, autoincrement=autoincrement))
+
+
+def create_dimension_tables(cursor):
+    """创建群和发送人维度表：每个 ID 只保存一次，记录中引用其整数键"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_groups (
+        id INTEGER PRIMARY KEY,
+        group_id TEXT NOT NULL UNIQUE
+    )
+    ''')
+    # sender_name 为最新昵称
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_senders (
+        id INTEGER PRIMARY KEY,
+        sender_id TEXT NOT NULL UNIQUE,
+        sender_name TEXT
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_senders_name ON chat_senders (sender_name)")
+
+
+def create_record_indexes(cursor, schema='main'):
+    """创建 chat_records 的二级索引（如果不存在）"""
+    for name, columns in RECORD_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.{name} ON chat_records {columns}')
+
+
+def drop_record_indexes(cursor, schema='main'):
+    """删除 chat_records 的二级索引，批量导入完成后再用 create_record_indexes 一次性重建"""
+    for name in RECORD_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {schema}.{name}')
+
+
+def create_fts(cursor):
+    """创建消息全文索引表，新建时登记回填"""
+    if table_exists(cursor, 'chat_fts'):
+        return
+    # tokens 列保存 jieba 分词后以空格连接的文本，rowid 与 chat_records.id 一致
+    cursor.execute("CREATE VIRTUAL TABLE chat_fts USING fts5(tokens, tokenize = 'unicode61')")
+    schedule_backfill(cursor, 'fts')
+
+
+def drop_fts(cursor):
+    """删除全文索引表及其回填进度"""
+    cursor.execute("DROP TABLE IF EXISTS chat_fts")
+    cursor.execute("DELETE FROM chat_meta WHERE key IN ('fts_backfill_pos', 'fts_backfill_upto')")
+
+
+def rebuild_fts(conn):
+    """清空全文索引并登记对全部记录的回填"""
+    cursor = conn.cursor()
+    try:
+        drop_fts(cursor)
+        create_fts(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrate_v2(cursor):
+    """版本 1 -> 2：新增 ts 列并登记分块回填，回填完成后再删除旧索引"""
+    cursor.execute("PRAGMA table_info(chat_records)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'ts' not in columns:
+        cursor.execute("ALTER TABLE chat_records ADD COLUMN ts INTEGER")
+        schedule_backfill(cursor, 'ts')
+    if 'ts' not in pending_backfills(cursor.connection):
+        finish_v2(cursor)
+
+
+def finish_v2(cursor):
+    """ts 回填完成：删除被复合索引取代的旧索引，并记录结构版本"""
+    cursor.execute('DROP INDEX IF EXISTS idx_group_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_sender_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+    # 迁移到版本 3 时 ts 可能仍在回填，不能将版本号改回 2
+    if cursor.execute("PRAGMA user_version").fetchone()[0] < 2:
+        cursor.execute("PRAGMA user_version = 2")
+
+
+def table_columns(cursor, schema='main', table='chat_records'):
+    """数据表的列名列表"""
+    return [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def migrate_v3(conn):
+    """版本 2 -> 3：重建聊天记录表，群和发送人换成维度表中的整数键
+
+    先从旧到新迁移各归档分区（每个分区一个事务），最后迁移主数据库，
+    使维度表中的昵称为最新的昵称。每一步都可以在中断后重新执行。
+    """
+    cursor = conn.cursor()
+    # ATTACH 不能在事务中执行
+    conn.commit()
+    for _, path in reversed(list_partitions(database_path(conn))):
+        with attach_partition(conn, path, readonly=False) as schema:
+            try:
+                if 'sender_key' not in table_columns(cursor, schema):
+                    rebuild_records(cursor, schema)
+                    create_record_indexes(cursor, schema)
+                    cursor.execute(f"PRAGMA {schema}.user_version = 0")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    if 'sender_key' not in table_columns(cursor):
+        rebuild_records(cursor, 'main')
+    cursor.execute("PRAGMA user_version = 3")
+    conn.commit()
+
+
+def migrate_v4(cursor):
+    """版本 3 -> 4：先用普通索引分块清理已有的重复记录（回填 dedup），完成后由 finish_dedup 建立唯一索引"""
+    if 'dedup' in pending_backfills(cursor.connection):
+        return
+    cursor.execute(MESSAGE_INDEX.format(unique='', name='idx_records_message_dedup'))
+    if not schedule_backfill(cursor, 'dedup'):
+        finish_dedup(cursor)
+
+
+def dedup_records(cursor, from_id, to_id):
+    """删除 id 在 (from_id, to_id] 范围内、与更早的记录重复的记录，并从聚合统计、词频和全文索引中扣除"""
+    rows = cursor.execute('''
+    SELECT r.id, g.group_id, s.sender_id, substr(r.timestamp, 1, 10), CAST(substr(r.timestamp, 12, 2) AS INTEGER),
+           unpack_message(r.message)
+    FROM chat_records r
+    LEFT JOIN chat_groups g ON g.id = r.group_key
+    JOIN chat_senders s ON s.id = r.sender_key
+    WHERE r.id > ? AND r.id <= ? AND r.message_id != '' AND EXISTS (
+        SELECT 1 FROM chat_records o
+        WHERE o.message_id = r.message_id AND o.message_id != ''
+          AND IFNULL(o.platform, '') = IFNULL(r.platform, '') AND IFNULL(o.group_key, 0) = IFNULL(r.group_key, 0)
+          AND o.id < r.id
+    )
+    ''', (from_id, to_id)).fetchall()
+    if not rows:
+        return 0
+
+    # 只扣除已经计入的部分：聚合表在写入时（或回填到该 id 后）计入，词频在分词进度之前的记录已计入
+    pending = pending_backfills(cursor.connection)
+    rollup_pos, rollup_upto = pending.get('rollup', (0, 0))
+    row = cursor.execute("SELECT value FROM chat_meta WHERE key = 'terms_indexed_id'").fetchone()
+    terms_pos = int(row[0]) if row else 0
+    hourly = {}
+    terms = {}
+    for row_id, group_id, sender_id, day, hour, message in rows:
+        if group_id is None:
+            continue
+        if row_id <= rollup_pos or row_id > rollup_upto:
+            key = (group_id, day, hour, sender_id)
+            hourly[key] = hourly.get(key, 0) + 1
+        if row_id <= terms_pos:
+            for term in extract_terms(message):
+                key = (group_id, day, term)
+                terms[key] = terms.get(key, 0) + 1
+    cursor.executemany('''
+    UPDATE chat_hourly_stats SET message_count = message_count - ?
+    WHERE group_id = ? AND day = ? AND hour = ? AND sender_id = ?
+    ''', [(count, *key) for key, count in hourly.items()])
+    cursor.executemany(
+        "UPDATE chat_terms SET freq = freq - ? WHERE group_id = ? AND day = ? AND term = ?",
+        [(count, *key) for key, count in terms.items()]
+    )
+    cursor.execute("DELETE FROM chat_hourly_stats WHERE message_count <= 0")
+    cursor.execute("DELETE FROM chat_terms WHERE freq <= 0")
+
+    ids = [(row[0],) for row in rows]
+    if table_exists(cursor, 'chat_fts'):
+        cursor.executemany("DELETE FROM chat_fts WHERE rowid = ?", ids)
+    cursor.executemany("DELETE FROM chat_records WHERE id = ?", ids)
+    adjust_record_count(cursor, -len(ids))
+    # 累计清理的重复记录数，供状态查询
+    cursor.execute(
+        "INSERT INTO chat_meta (key, value) VALUES ('dedup_removed', ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+        (len(ids),)
+    )
+    return len(ids)
+
+
+def removed_duplicates(conn):
+    """回填 dedup 累计清理的重复记录数"""
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = 'dedup_removed'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def finish_dedup(cursor):
+    """重复记录清理完成：补查回填期间新写入的记录，然后换成唯一索引并记录结构版本"""
+    max_id = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records").fetchone()[0]
+    row = cursor.execute("SELECT value FROM chat_meta WHERE key = 'dedup_backfill_upto'").fetchone()
+    dedup_records(cursor, int(row[0]) if row else 0, max_id)
+    cursor.execute('DROP INDEX IF EXISTS idx_records_message_dedup')
+    cursor.execute(MESSAGE_INDEX.format(unique='UNIQUE ', name='idx_records_message'))
+    cursor.execute("PRAGMA user_version = 4")
+
+
+def rebuild_records(cursor, schema):
+    """将版本 2 结构的聊天记录表重建为整数键的结构，保留原有的 id"""
+    cursor.execute(f'''
+    INSERT OR IGNORE INTO main.chat_groups (group_id)
+    SELECT DISTINCT group_id FROM {schema}.chat_records WHERE group_id IS NOT NULL AND group_id != ''
+    ''')
+    # 每个发送人取其最后一条记录的昵称（MAX(id) 使 SQLite 取该行的 sender_name）
+    cursor.execute(f'''
+    INSERT INTO main.chat_senders (sender_id, sender_name)
+    SELECT sender_id, sender_name FROM (
+        SELECT sender_id, IFNULL(sender_name, sender_id) AS sender_name, MAX(id)
+        FROM {schema}.chat_records GROUP BY sender_id
+    ) WHERE true
+    ON CONFLICT (sender_id) DO UPDATE SET sender_name = excluded.sender_name
+    ''')
+    cursor.execute(f"ALTER TABLE {schema}.chat_records RENAME TO chat_records_v2")
+    create_records_table(cursor, schema)
+    cursor.execute(f'''
+    INSERT INTO {schema}.chat_records (id, group_key, sender_key, message, timestamp, message_id, platform, ts)
+    SELECT r.id, g.id, s.id, r.message, r.timestamp, r.message_id, NULLIF(r.platform, ?), r.ts
+    FROM {schema}.chat_records_v2 r
+    LEFT JOIN main.chat_groups g ON g.group_id = r.group_id
+    JOIN main.chat_senders s ON s.sender_id = r.sender_id
+    ORDER BY r.id
+    ''', (DEFAULT_PLATFORM,))
+    if schema == 'main':
+        # 沿用旧表的自增序号，已删除或归档的 id 不会被新记录重复使用
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'chat_records'")
+        cursor.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'chat_records', seq FROM sqlite_sequence WHERE name = 'chat_records_v2'"
+        )
+    # 旧表的索引随旧表一起删除，之后以相同的名称在新表上重建
+    cursor.execute(f"DROP TABLE {schema}.chat_records_v2")
+
+
+def to_epoch_ms(dt):
+    """本地时间的 datetime 转换为毫秒时间戳"""
+    return int(round(dt.timestamp() * 1000))
+
+
+def day_range_ms(day):
+    """返回某一天（本地时间，date 或 YYYY-MM-DD）的 [起始, 结束) 毫秒时间戳"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    start = datetime(day.year, day.month, day.day)
+    return to_epoch_ms(start), to_epoch_ms(start + timedelta(days=1))
+
+
+def format_ms(ts):
+    """毫秒时间戳格式化为本地时间字符串"""
+    if ts is None:
+        return ""
+    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class KeyCache:
+    """容量有限的 LRU 字典，超出容量时淘汰最久未使用的条目"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
+
+    def discard(self, key):
+        self.data.pop(key, None)
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+
+class Dimensions:
+    """维度表的内存缓存：群 ID -> 键，发送人 ID -> (键, 最新昵称)，写入时大多不需要查询维度表"""
+
+    def __init__(self, max_size=50000):
+        self.groups = KeyCache(max_size)
+        self.senders = KeyCache(max_size)
+
+
+def intern_dimensions(cursor, records, dimensions):
+    """查找或创建记录中的群和发送人，昵称变化时更新发送人表
+
+    返回 ({群 ID: 键}, {发送人 ID: (键, 昵称)})。结果在事务提交后才能写入缓存。
+    """
+    group_keys = {}
+    for group_id in {record[0] for record in records if record[0]}:
+        key = dimensions.groups.get(group_id)
+        if key is None:
+            row = cursor.execute("SELECT id FROM chat_groups WHERE group_id = ?", (group_id,)).fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO chat_groups (group_id) VALUES (?)", (group_id,))
+                key = cursor.lastrowid
+            else:
+                key = row[0]
+        group_keys[group_id] = key
+
+    # 同一批中同一发送人取最后一条记录的昵称
+    names = {record[1]: record[2] or record[1] for record in records}
+    senders = {}
+    for sender_id, name in names.items():
+        cached = dimensions.senders.get(sender_id)
+        if cached is None:
+            cached = cursor.execute(
+                "SELECT id, sender_name FROM chat_senders WHERE sender_id = ?", (sender_id,)
+            ).fetchone()
+            if cached is None:
+                cursor.execute("INSERT INTO chat_senders (sender_id, sender_name) VALUES (?, ?)", (sender_id, name))
+                cached = (cursor.lastrowid, name)
+        if cached[1] != name:
+            cursor.execute("UPDATE chat_senders SET sender_name = ? WHERE id = ?", (name, cached[0]))
+        senders[sender_id] = (cached[0], name)
+    return group_keys, senders
+
+
+def insert_records(conn, records, fts=False, checkpoint=None):
+    """在一个事务中批量插入记录（字段顺序见 RECORD_FIELDS），并同步更新聚合统计表（以及全文索引）
+
+    与已有记录的 (平台, 群, message_id) 重复的记录被忽略。
+    checkpoint 为 (key, value) 时在同一事务中写入 chat_meta，用于记录批量导入的进度。
+    返回 (实际插入的条数, 各阶段耗时（秒）{'insert': 插入记录, 'derive': 更新聚合表和索引, 'commit': 提交})。
+    """
+    cursor = conn.cursor()
+    # 写连接（WriterConnection）上的缓存跨批次复用，其他连接每次新建
+    dimensions = getattr(conn, 'dimensions', None) or Dimensions()
+    try:
+        start = time.perf_counter()
+        cursor.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records")
+        last_id = cursor.fetchone()[0]
+        group_keys, senders = intern_dimensions(cursor, records, dimensions)
+        # 写连接按压缩配置编码消息正文
+        codec = getattr(conn, 'codec', None)
+        cursor.executemany(INSERT_SQL, [
+            (
+                group_keys.get(group_id), senders[sender_id][0], codec.pack(message) if codec else message,
+                timestamp, ts, message_id,
+                None if platform == DEFAULT_PLATFORM else platform
+            )
+            for group_id, sender_id, _, message, timestamp, ts, message_id, platform in records
+        ])
+        inserted = cursor.rowcount
+        cursor.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records")
+        new_last_id = cursor.fetchone()[0]
+        derive_start = time.perf_counter()
+        update_rollups(cursor, last_id, new_last_id)
+        if fts:
+            update_fts(cursor, last_id, new_last_id)
+        adjust_record_count(cursor, inserted)
+        if checkpoint is not None:
+            cursor.execute("INSERT OR REPLACE INTO chat_meta (key, value) VALUES (?, ?)", checkpoint)
+        commit_start = time.perf_counter()
+        conn.commit()
+        end = time.perf_counter()
+    except Exception:
+        conn.rollback()
+        raise
+    for group_id, key in group_keys.items():
+        dimensions.groups.put(group_id, key)
+    for sender_id, value in senders.items():
+        dimensions.senders.put(sender_id, value)
+    return inserted, {'insert': derive_start - start, 'derive': commit_start - derive_start, 'commit': end - commit_start}
+
+
+def adjust_record_count(cursor, delta):
+    """维护 chat_meta 中的记录数，避免每次查看状态时 COUNT(*) 扫描全表"""
+    if delta:
+        cursor.execute(
+            "UPDATE chat_meta SET value = CAST(value AS INTEGER) + ? WHERE key = 'record_count'", (delta,)
+        )
+
+
+# 数据库暂时不可用（繁忙、被锁定、磁盘 I/O 错误、空间不足等）的错误码，这类写入失败稍后重试可能成功
+TRANSIENT_ERRORS = ('SQLITE_BUSY', 'SQLITE_LOCKED', 'SQLITE_IOERR', 'SQLITE_FULL', 'SQLITE_CANTOPEN', 'SQLITE_PROTOCOL')
+# Python 3.11 之前的异常没有错误码，按错误信息判断
+TRANSIENT_MESSAGES = ('locked', 'busy', 'disk i/o error', 'database or disk is full', 'unable to open')
+
+
+def is_transient_error(e):
+    """写入失败是否由数据库暂时不可用引起；其他错误（如数据不符合约束）重试也不会成功"""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    name = getattr(e, 'sqlite_errorname', None)
+    if name is not None:
+        return name.startswith(TRANSIENT_ERRORS)
+    message = str(e).lower()
+    return any(text in message for text in TRANSIENT_MESSAGES)
+
+
+def meta_value(conn, key):
+    """chat_meta 中 key 对应的值，不存在时返回 None"""
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def update_rollups(cursor, from_id, to_id):
+    """将 id 在 (from_id, to_id] 范围内的群聊记录累加到 chat_hourly_stats"""
+    # 天和小时取自本地时间的 timestamp 文本列，不依赖 ts 是否已回填；昵称取发送人表中的最新昵称
+    cursor.execute('''
+    INSERT INTO chat_hourly_stats (group_id, day, hour, sender_id, sender_name, message_count)
+    SELECT g.group_id, r.day, r.hour, s.sender_id, s.sender_name, r.message_count FROM (
+        SELECT group_key,
+               substr(timestamp, 1, 10) AS day,
+               CAST(substr(timestamp, 12, 2) AS INTEGER) AS hour,
+               sender_key, COUNT(*) AS message_count
+        FROM chat_records
+        WHERE id > ? AND id <= ? AND group_key IS NOT NULL
+        GROUP BY group_key, day, hour, sender_key
+    ) r
+    JOIN chat_groups g ON g.id = r.group_key
+    JOIN chat_senders s ON s.id = r.sender_key
+    WHERE true
+    ON CONFLICT (group_id, day, hour, sender_id) DO UPDATE SET
+        message_count = message_count + excluded.message_count,
+        sender_name = excluded.sender_name
+    ''', (from_id, to_id))
+
+
+def fill_timestamps(cursor, from_id, to_id):
+    """根据 timestamp 文本列（本地时间）计算 id 在 (from_id, to_id] 范围内记录的 ts"""
+    # julianday(..., 'utc') 将本地时间换算为 UTC，2440587.5 为 1970-01-01 的儒略日
+    cursor.execute('''
+    UPDATE chat_records
+    SET ts = CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000.0) AS INTEGER)
+    WHERE id > ? AND id <= ? AND ts IS NULL
+    ''', (from_id, to_id))
+
+
+def load_jieba():
+    """导入 jieba 并加载词典（jieba 会把解析好的词典缓存到临时目录，之后从缓存加载），返回耗时（秒）"""
+    start = time.perf_counter()
+    import jieba
+    jieba.initialize()
+    return time.perf_counter() - start
+
+
+def segment_for_index(text):
+    """搜索引擎模式分词（同时产生长词和其中的短词），返回以空格连接的词串"""
+    import jieba
+    return ' '.join(word for word in jieba.cut_for_search(text or '') if word.strip())
+
+
+def segment_query(text):
+    """精确模式分词，返回去除空白后的词列表"""
+    import jieba
+    return [word for word in jieba.cut(text or '') if word.strip()]
+
+
+def update_fts(cursor, from_id, to_id):
+    """为 id 在 (from_id, to_id] 范围内的记录建立全文索引"""
+    cursor.execute("SELECT id, unpack_message(message) FROM chat_records WHERE id > ? AND id <= ?", (from_id, to_id))
+    rows = [(row_id, segment_for_index(message)) for row_id, message in cursor.fetchall()]
+    cursor.executemany("INSERT INTO chat_fts (rowid, tokens) VALUES (?, ?)", rows)
+
+
+def build_match_query(keyword):
+    """将关键词分词后拼成 FTS5 MATCH 表达式，各词之间为 AND 关系"""
+    terms = segment_query(keyword)
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms), terms
+
+
+def search_messages(conn, keyword, limit):
+    """全文检索消息，按相关度（bm25）排序，返回 [(ts, sender_name, message, group_id)]"""
+    match, _ = build_match_query(keyword)
+    if not match:
+        return []
+    return conn.execute('''
+    SELECT r.ts, s.sender_name, unpack_message(r.message), g.group_id
+    FROM chat_fts JOIN chat_records r ON r.id = chat_fts.rowid
+    JOIN chat_senders s ON s.id = r.sender_key
+    LEFT JOIN chat_groups g ON g.id = r.group_key
+    WHERE chat_fts MATCH ?
+    ORDER BY chat_fts.rank
+    LIMIT ?
+    ''', (match, limit)).fetchall()
+
+
+def make_snippet(message, terms, width=60):
+    """截取消息中第一个命中词附近的片段，命中词用【】标出"""
+    terms = [term for term in terms if term.strip()]
+    if not terms:
+        return message[:width]
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(message)
+    start = max(0, match.start() - width // 3) if match else 0
+    end = min(len(message), start + width)
+    snippet = pattern.sub(lambda m: f"【{m.group(0)}】", message[start:end])
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(message) else '')
+
+
+# 词云的停用词：常见虚词、代词和口头语，以及 gewechat 的占位文本
+STOPWORDS = frozenset("""
+我们 你们 他们 她们 它们 咱们 大家 自己 这个 那个 这些 那些 这样 那样 这么 那么 这里 那里
+什么 怎么 怎么样 为什么 哪里 哪个 多少 是不是 有没有 就是 还是 只是 不是 没有 可以 可能
+应该 已经 还有 然后 但是 因为 所以 如果 虽然 而且 或者 不过 其实 一个 一下 一些 一点 一起
+时候 现在 今天 明天 昨天 知道 觉得 感觉 出来 起来 的话 之后 之前 以后 以前 一样 这种 那种
+哈哈 哈哈哈 哈哈哈哈 嘿嘿 呵呵 嗯嗯 好的 好吧 是的 对的 收到 谢谢 图片 表情 语音 视频 链接
+the and for you that this with are was have not but what all can your from they will
+""".split())
+
+URL_PATTERN = re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE)
+TERM_PATTERN = re.compile(r'^\w{2,}$')
+
+
+def extract_terms(message):
+    """对一条消息分词，去掉 URL、标点、纯数字、单字和停用词"""
+    import jieba
+    text = URL_PATTERN.sub(' ', message or '')
+    terms = []
+    for word in jieba.cut(text):
+        word = word.strip().lower()
+        if TERM_PATTERN.match(word) and not word.isdigit() and word not in STOPWORDS:
+            terms.append(word)
+    return terms
+
+
+def collect_terms(conn, chunk_size=2000):
+    """读取下一块尚未分词的群聊记录并统计词频（只读，可在读连接上执行）
+
+    进度保存在 chat_meta 的 terms_indexed_id 中。
+    返回 (起始 id, 结束 id, 当前最大 id, {(group_id, day, term): 词频})。
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM chat_meta WHERE key = 'terms_indexed_id'")
+    row = cursor.fetchone()
+    pos = int(row[0]) if row else 0
+    cursor.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records")
+    max_id = cursor.fetchone()[0]
+    end = min(pos + chunk_size, max_id)
+
+    counts = {}
+    if end > pos:
+        cursor.execute('''
+        SELECT g.group_id, substr(r.timestamp, 1, 10), unpack_message(r.message)
+        FROM chat_records r JOIN chat_groups g ON g.id = r.group_key
+        WHERE r.id > ? AND r.id <= ?
+        ''', (pos, end))
+        for group_id, day, message in cursor.fetchall():
+            for term in extract_terms(message):
+                key = (group_id, day, term)
+                counts[key] = counts.get(key, 0) + 1
+    return pos, max(pos, end), max_id, counts
+
+
+def save_terms(conn, pos, end, counts):
+    """将 collect_terms 的结果累加到 chat_terms 并推进进度
+
+    如果进度已不是 pos（例如被其他任务处理过），放弃本次结果以免重复计数，返回 False。
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT value FROM chat_meta WHERE key = 'terms_indexed_id'")
+        row = cursor.fetchone()
+        if (int(row[0]) if row else 0) != pos:
+            conn.rollback()
+            return False
+        cursor.executemany('''
+        INSERT INTO chat_terms (group_id, day, term, freq) VALUES (?, ?, ?, ?)
+        ON CONFLICT (group_id, day, term) DO UPDATE SET freq = freq + excluded.freq
+        ''', [(group_id, day, term, freq) for (group_id, day, term), freq in counts.items()])
+        cursor.execute("INSERT OR REPLACE INTO chat_meta (key, value) VALUES ('terms_indexed_id', ?)", (str(end),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+
+def index_terms(conn, chunk_size=2000):
+    """在同一个连接上完成一块分词和词频累加，返回 (已处理到的 id, 当前最大 id)"""
+    pos, end, max_id, counts = collect_terms(conn, chunk_size)
+    if end > pos:
+        save_terms(conn, pos, end, counts)
+    return end, max_id
+
+
+def top_terms(conn, group_id, day, limit):
+    """返回某群某天词频最高的词 [(term, freq)]"""
+    return conn.execute('''
+    SELECT term, freq FROM chat_terms
+    WHERE group_id = ? AND day = ?
+    ORDER BY freq DESC LIMIT ?
+    ''', (group_id, day, limit)).fetchall()
+
+
+def count_records(conn):
+    """主数据库中的聊天记录数，读取维护的计数，没有计数时才扫描全表"""
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = 'record_count'").fetchone()
+    if row is not None:
+        return int(row[0])
+    return conn.execute("SELECT COUNT(*) FROM chat_records").fetchone()[0]
+
+
+def day_message_count(conn, group_id, day):
+    """某群某天已统计的消息数，用作图表缓存的数据水位"""
+    return range_message_count(conn, group_id, day, day)
+
+
+# 以下按日期范围统计的函数都在 SQL 中完成聚合，只读取聚合表，
+# 返回的行数只与发送人数、天数或词数上限有关，与消息量和范围内的明细行数无关
+
+def range_message_count(conn, group_id, start_day, end_day):
+    """某群在 [start_day, end_day] 内已统计的消息数"""
+    return conn.execute(
+        "SELECT IFNULL(SUM(message_count), 0) FROM chat_hourly_stats WHERE group_id = ? AND day BETWEEN ? AND ?",
+        (group_id, start_day, end_day)
+    ).fetchone()[0]
+
+
+def terms_pending(conn, group_id, start_day, end_day):
+    """词频索引尚未覆盖某群在 [start_day, end_day] 内的全部记录时返回已索引到的 id，已覆盖时返回 None
+
+    聚合表在写入时更新，词频表由后台任务分词后才累加（见 collect_terms），两者之间有延迟。
+    索引已追上最新记录时只读取两个值；落后时在 (group_key, ts) 索引上查找范围内是否有未分词的记录。
+    已归档的记录都已分词（见 archive_chunk），只需检查主数据库。
+    """
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = 'terms_indexed_id'").fetchone()
+    indexed_id = int(row[0]) if row else 0
+    max_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records").fetchone()[0]
+    if indexed_id >= max_id:
+        return None
+    key = group_key(conn, group_id)
+    if key is None:
+        return None
+    start_ms, end_ms = day_range_ms(start_day)[0], day_range_ms(end_day)[1]
+    row = conn.execute(
+        "SELECT 1 FROM chat_records WHERE group_key = ? AND ts >= ? AND ts < ? AND id > ? LIMIT 1",
+        (key, start_ms, end_ms, indexed_id)
+    ).fetchone()
+    return indexed_id if row else None
+
+
+def range_sender_totals(conn, group_id, start_day, end_day, limit):
+    """日期范围内消息数最多的 limit 个发送人，返回 [(最新昵称, 消息数)]，按消息数降序"""
+    return conn.execute('''
+    SELECT IFNULL(s.sender_name, t.sender_id), t.total FROM (
+        SELECT sender_id, SUM(message_count) AS total FROM chat_hourly_stats
+        WHERE group_id = ? AND day BETWEEN ? AND ?
+        GROUP BY sender_id ORDER BY total DESC LIMIT ?
+    ) t LEFT JOIN chat_senders s ON s.sender_id = t.sender_id
+    ORDER BY t.total DESC
+    ''', (group_id, start_day, end_day, limit)).fetchall()
+
+
+def range_weekday_hours(conn, group_id, start_day, end_day):
+    """日期范围内按 星期 × 小时 汇总的消息数，返回 [(星期, 小时, 消息数)]，星期一为 0"""
+    # strftime('%w') 中星期日为 0，换算为星期一为 0
+    return conn.execute('''
+    SELECT (CAST(strftime('%w', day) AS INTEGER) + 6) % 7 AS weekday, hour, SUM(message_count)
+    FROM chat_hourly_stats
+    WHERE group_id = ? AND day BETWEEN ? AND ?
+    GROUP BY weekday, hour
+    ''', (group_id, start_day, end_day)).fetchall()
+
+
+def range_daily_counts(conn, group_id, start_day, end_day):
+    """日期范围内每天的消息数和发言人数，返回 [(日期, 消息数, 发言人数)]，没有消息的日期不返回"""
+    return conn.execute('''
+    SELECT day, SUM(message_count), COUNT(DISTINCT sender_id)
+    FROM chat_hourly_stats
+    WHERE group_id = ? AND day BETWEEN ? AND ?
+    GROUP BY day ORDER BY day
+    ''', (group_id, start_day, end_day)).fetchall()
+
+
+def day_hourly_counts(conn, group_id, day):
+    """某天每小时的消息数和发言人数，返回 [(小时, 消息数, 发言人数)]"""
+    return conn.execute('''
+    SELECT hour, SUM(message_count), COUNT(DISTINCT sender_id)
+    FROM chat_hourly_stats
+    WHERE group_id = ? AND day = ?
+    GROUP BY hour ORDER BY hour
+    ''', (group_id, day)).fetchall()
+
+
+def range_top_terms(conn, group_id, start_day, end_day, limit):
+    """日期范围内累计词频最高的词 [(term, freq)]"""
+    return conn.execute('''
+    SELECT term, SUM(freq) AS total FROM chat_terms
+    WHERE group_id = ? AND day BETWEEN ? AND ?
+    GROUP BY term ORDER BY total DESC LIMIT ?
+    ''', (group_id, start_day, end_day, limit)).fetchall()
+
+
+# 跨群统计（见 global_report）：每个群单独查询，WHERE group_id = ? 使用聚合表主键的前缀，
+# 分组只涉及一个群的 24 个小时或几十个发送人，比多个群一起分组快一倍以上；各进程各自打开只读连接并行执行
+
+def list_groups(conn):
+    """全部群 ID（不含私聊），按首次出现的顺序"""
+    return [row[0] for row in conn.execute("SELECT group_id FROM chat_groups WHERE group_id != '' ORDER BY id")]
+
+
+def group_hourly_totals(conn, group_id, start_day, end_day):
+    """某群在日期范围内按小时汇总的消息数，返回 [(小时, 消息数)]"""
+    return conn.execute('''
+    SELECT hour, SUM(message_count) FROM chat_hourly_stats
+    WHERE group_id = ? AND day BETWEEN ? AND ?
+    GROUP BY hour
+    ''', (group_id, start_day, end_day)).fetchall()
+
+
+def group_sender_totals(conn, group_id, start_day, end_day):
+    """某群在日期范围内各发送人的消息数，返回 [(发送人 ID, 消息数)]"""
+    return conn.execute('''
+    SELECT sender_id, SUM(message_count) FROM chat_hourly_stats
+    WHERE group_id = ? AND day BETWEEN ? AND ?
+    GROUP BY sender_id
+    ''', (group_id, start_day, end_day)).fetchall()
+
+
+def sender_names(conn, sender_ids):
+    """发送人 ID 对应的最新昵称 {发送人 ID: 昵称}，没有昵称的不返回"""
+    if not sender_ids:
+        return {}
+    return dict(conn.execute(
+        f"SELECT sender_id, sender_name FROM chat_senders "
+        f"WHERE sender_id IN ({', '.join('?' * len(sender_ids))}) AND sender_name IS NOT NULL",
+        list(sender_ids)
+    ).fetchall())
+
+
+def find_senders(conn, keyword, limit=50):
+    """按 ID 或昵称查找发送人的整数键：ID 或昵称完全相同时走索引，否则在发送人表中模糊匹配昵称"""
+    rows = conn.execute('''
+    SELECT id FROM chat_senders WHERE sender_id = ?
+    UNION SELECT id FROM chat_senders WHERE sender_name = ?
+    ''', (keyword, keyword)).fetchall()
+    if not rows:
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', keyword) + '%'
+        rows = conn.execute(
+            "SELECT id FROM chat_senders WHERE sender_name LIKE ? ESCAPE '\\' LIMIT ?", (pattern, limit)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def group_key(conn, group_id):
+    """群 ID 对应的整数键，不存在时返回 None"""
+    row = conn.execute("SELECT id FROM chat_groups WHERE group_id = ?", (group_id,)).fetchone()
+    return row[0] if row else None
+
+
+def query_by_sender(conn, keyword, limit, cursor=None):
+    """查询特定发送者（ID 或昵称包含关键词）的消息"""
+    keys = find_senders(conn, keyword)
+    if not keys:
+        return []
+    return query_recent(conn, [f"r.sender_key IN ({', '.join('?' * len(keys))})"], keys, limit, cursor)
+
+
+def query_by_group(conn, group_id, limit, cursor=None):
+    """查询特定群组的消息"""
+    key = group_key(conn, group_id)
+    if key is None:
+        return []
+    return query_recent(conn, ['r.group_key = ?'], [key], limit, cursor)
+
+
+def query_latest(conn, limit, cursor=None):
+    """查询最新消息"""
+    return query_recent(conn, [], [], limit, cursor)
+
+
+def format_cursor(row):
+    """由一页的最后一行 (ts, ..., id) 生成翻页游标"""
+    return f"{row[0]}_{row[-1]}"
+
+
+def parse_cursor(text):
+    """解析翻页游标，返回 (ts, id)，格式不正确时返回 None"""
+    try:
+        ts, row_id = text.split('_')
+        return int(ts), int(row_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+# 预先生成的每日报告：按 群/天/图表类型 保存的图片，watermark 为生成时该群当天已统计的消息数，
+# options 为影响图片内容的绘图配置；两者都与当前一致时报告才有效
+REPORTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS chat_reports (
+    group_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    watermark INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (group_id, day, kind)
+)
+'''
+
+
+def create_reports_table(cursor):
+    """创建每日报告表（如果不存在）；统计插件也会调用，不依赖存储插件先完成建表"""
+    cursor.execute(REPORTS_TABLE)
+
+
+def active_groups(conn, day):
+    """某天有消息的群及其消息数 {群 ID: 消息数}，不含私聊"""
+    return dict(conn.execute(
+        "SELECT group_id, SUM(message_count) FROM chat_hourly_stats WHERE day = ? AND group_id != '' GROUP BY group_id",
+        (day,)
+    ).fetchall())
+
+
+def report_watermarks(conn, day, options):
+    """某天已保存且绘图配置一致的报告 {(群 ID, 图表类型): 水位}"""
+    if not table_exists(conn.cursor(), 'chat_reports'):
+        return {}
+    rows = conn.execute(
+        "SELECT group_id, kind, watermark FROM chat_reports WHERE day = ? AND options = ?", (day, options)
+    ).fetchall()
+    return {(group_id, kind): watermark for group_id, kind, watermark in rows}
+
+
+def load_report(conn, group_id, day, kind, watermark, options):
+    """水位和绘图配置都一致的报告图片，没有时返回 None"""
+    if not table_exists(conn.cursor(), 'chat_reports'):
+        return None
+    row = conn.execute(
+        "SELECT data FROM chat_reports WHERE group_id = ? AND day = ? AND kind = ? AND watermark = ? AND options = ?",
+        (group_id, day, kind, watermark, options)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_report(conn, group_id, day, kind, watermark, options, data):
+    """保存（或替换）一份报告图片"""
+    create_reports_table(conn.cursor())
+    conn.execute(
+        "INSERT OR REPLACE INTO chat_reports (group_id, day, kind, watermark, options, data, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (group_id, day, kind, watermark, options, data, int(time.time()))
+    )
+    conn.commit()
+
+
+def delete_reports_before(conn, day):
+    """删除早于 day（YYYY-MM-DD）的报告，返回删除的条数"""
+    if not table_exists(conn.cursor(), 'chat_reports'):
+        return 0
+    count = conn.execute("DELETE FROM chat_reports WHERE day < ?", (day,)).rowcount
+    conn.commit()
+    return count
+
+
+# 消息压缩：达到 compress_min_bytes 字节的消息压缩后以 BLOB 保存，新消息在写入时压缩，已有的消息由回填 compress 压缩
+# 字典从最近的长消息中训练，保存在 chat_dicts 中；新字典只用于之后压缩的消息，旧字典一直保留以便解压
+DICTIONARY_SAMPLES = 2000
+MIN_DICTIONARY_SAMPLES = 100
+
+
+def load_dictionaries(conn):
+    """读取全部压缩字典 {编号: 字典}"""
+    if not table_exists(conn.cursor(), 'chat_dicts'):
+        return {}
+    return dict(conn.execute("SELECT id, dictionary FROM chat_dicts").fetchall())
+
+
+def dictionary_loader(db_path):
+    """返回从数据库文件读取压缩字典的函数，内存数据库返回 None"""
+    if not db_path or db_path == ':memory:':
+        return None
+
+    def load():
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            return load_dictionaries(conn)
+        finally:
+            conn.close()
+    return load
+
+
+def register_codec(conn, db_path):
+    """为连接创建消息编码器并注册 SQL 函数 unpack_message；遇到未知的字典（其他连接新训练的）时从数据库加载"""
+    codec = message_codec.MessageCodec(loader=dictionary_loader(db_path))
+    conn.create_function('unpack_message', 1, codec.unpack, deterministic=True)
+    return codec
+
+
+def load_compression(conn):
+    """将 chat_meta 中的压缩阈值和已有的字典载入写连接的编码器"""
+    codec = getattr(conn, 'codec', None)
+    if codec is None:
+        return
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = 'compress_min_bytes'").fetchone()
+    codec.min_bytes = int(row[0]) if row else 0
+    codec.dictionaries.update(load_dictionaries(conn))
+
+
+def compression_settings(conn):
+    """当前的压缩阈值（字节，0 表示不压缩新消息）和字典数"""
+    row = conn.execute("SELECT value FROM chat_meta WHERE key = 'compress_min_bytes'").fetchone()
+    return int(row[0]) if row else 0, len(load_dictionaries(conn))
+
+
+def train_dictionary(conn, force=False):
+    """用最近的长消息训练压缩字典，返回新字典的编号
+
+    已有字典（force 为 False 时）、未启用压缩或长消息少于 MIN_DICTIONARY_SAMPLES 条时不训练，返回 None。
+    """
+    codec = conn.codec
+    if not codec.min_bytes or (codec.dictionaries and not force):
+        return None
+    rows = conn.execute('''
+    SELECT unpack_message(message) FROM chat_records
+    WHERE typeof(message) = 'blob' OR length(CAST(message AS BLOB)) >= ?
+    ORDER BY id DESC LIMIT ?
+    ''', (codec.min_bytes, DICTIONARY_SAMPLES)).fetchall()
+    if len(rows) < MIN_DICTIONARY_SAMPLES:
+        return None
+    dictionary = message_codec.train_dictionary([row[0] for row in rows])
+    if not dictionary:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO chat_dicts (dictionary, samples, created_at) VALUES (?, ?, ?)",
+            (dictionary, len(rows), int(time.time()))
+        )
+        dict_id = cursor.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    codec.dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def configure_compression(conn, min_bytes):
+    """设置消息压缩阈值（字节，0 表示不再压缩新消息，已压缩的消息仍可正常读取），只能在写连接上调用
+
+    启用或调低阈值时训练字典（还没有字典时）并登记回填 compress 压缩已有的记录，返回是否登记了回填。
+    """
+    min_bytes = max(0, int(min_bytes or 0))
+    cursor = conn.cursor()
+    previous = compression_settings(conn)[0]
+    try:
+        cursor.execute("INSERT OR REPLACE INTO chat_meta (key, value) VALUES ('compress_min_bytes', ?)", (str(min_bytes),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.codec.min_bytes = min_bytes
+    if not min_bytes or (previous and min_bytes >= previous):
+        return False
+    train_dictionary(conn)
+    if 'compress' in pending_backfills(conn):
+        return False
+    try:
+        scheduled = schedule_backfill(cursor, 'compress')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return scheduled
+
+
+def compress_records(cursor, from_id, to_id, codec=None):
+    """压缩 id 在 (from_id, to_id] 范围内尚未压缩、达到阈值的消息，返回压缩的条数
+
+    codec 默认为写连接的编码器；压缩归档分区时由调用方传入。
+    """
+    codec = codec or getattr(cursor.connection, 'codec', None)
+    if codec is None or not codec.min_bytes:
+        return 0
+    rows = cursor.execute('''
+    SELECT id, message FROM chat_records
+    WHERE id > ? AND id <= ? AND typeof(message) = 'text' AND length(CAST(message AS BLOB)) >= ?
+    ''', (from_id, to_id, codec.min_bytes)).fetchall()
+    updates = []
+    for row_id, message in rows:
+        packed = codec.pack(message)
+        if isinstance(packed, bytes):
+            updates.append((packed, row_id))
+    cursor.executemany("UPDATE chat_records SET message = ? WHERE id = ?", updates)
+    return len(updates)
+
+
+# 分块回填任务：名称 -> (处理 (from_id, to_id] 的函数, 全部完成后调用的函数)
+# 按字典顺序依次执行，ts 排在前面，使时间范围查询尽快覆盖旧数据
+BACKFILLS = {
+    'ts': (fill_timestamps, finish_v2),
+    'dedup': (dedup_records, finish_dedup),
+    'rollup': (update_rollups, None),
+    'fts': (update_fts, None),
+    'compress': (compress_records, None),
+}
+
+
+def schedule_backfill(cursor, name):
+    """登记回填任务，覆盖当前已有的全部记录；表为空时无需回填，返回 False"""
+    cursor.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records")
+    max_id = cursor.fetchone()[0]
+    if max_id <= 0:
+        return False
+    cursor.execute("INSERT OR REPLACE INTO chat_meta (key, value) VALUES (?, '0')", (f"{name}_backfill_pos",))
+    cursor.execute("INSERT OR REPLACE INTO chat_meta (key, value) VALUES (?, ?)", (f"{name}_backfill_upto", str(max_id)))
+    return True
+
+
+def pending_backfills(conn):
+    """返回尚未完成的回填任务 {名称: (当前进度, 目标 id)}"""
+    rows = dict(conn.execute("SELECT key, value FROM chat_meta").fetchall())
+    pending = {}
+    for name in BACKFILLS:
+        if f"{name}_backfill_upto" in rows:
+            pending[name] = (int(rows.get(f"{name}_backfill_pos", 0)), int(rows[f"{name}_backfill_upto"]))
+    return pending
+
+
+def run_backfill_chunk(conn, name, chunk_size=20000):
+    """在一个事务中执行一块回填，返回 (当前进度, 目标 id)；全部完成时清除进度记录"""
+    pending = pending_backfills(conn)
+    if name not in pending:
+        return 0, 0
+    pos, upto = pending[name]
+    func, on_done = BACKFILLS[name]
+    end = min(pos + chunk_size, upto)
+    cursor = conn.cursor()
+    try:
+        func(cursor, pos, end)
+        if end >= upto:
+            # on_done 在清除进度之前执行，可以读取回填的目标 id
+            if on_done is not None:
+                on_done(cursor)
+            cursor.execute("DELETE FROM chat_meta WHERE key IN (?, ?)", (f"{name}_backfill_pos", f"{name}_backfill_upto"))
+        else:
+            cursor.execute("UPDATE chat_meta SET value = ? WHERE key = ?", (str(end), f"{name}_backfill_pos"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return end, upto
+
+
+# 分区：主数据库只保存最近 hot_days 天的热数据，更早的记录按月份移入归档分区文件
+# 归档文件位于 <数据库名>_archive/chat_records_YYYY-MM.db，查询时按需 ATTACH
+PARTITION_PATTERN = re.compile(r'^chat_records_(\d{4}-\d{2})\.db$')
+
+# 聊天记录表自身的列，归档时原样复制
+TABLE_COLUMNS = 'id, group_key, sender_key, message, timestamp, message_id, platform, ts'
+
+# 完整记录（导出等）的列名，以及从聊天记录表和维度表中取出这些列的表达式
+RECORD_COLUMNS = 'id, group_id, sender_id, sender_name, message, timestamp, message_id, platform, ts'
+RECORD_SELECT = f'''
+SELECT r.id, g.group_id, s.sender_id, s.sender_name, unpack_message(r.message), r.timestamp, r.message_id,
+       IFNULL(r.platform, '{DEFAULT_PLATFORM}'), r.ts
+FROM {{table}} r
+LEFT JOIN main.chat_senders s ON s.id = r.sender_key
+LEFT JOIN main.chat_groups g ON g.id = r.group_key
+'''
+
+
+def database_path(conn):
+    """返回连接的主数据库文件路径，内存数据库返回空字符串"""
+    for _, name, path in conn.execute("PRAGMA database_list").fetchall():
+        if name == 'main':
+            return path or ''
+    return ''
+
+
+def partition_dir(db_path):
+    """归档分区所在目录"""
+    return os.path.splitext(db_path)[0] + '_archive'
+
+
+def partition_path(db_path, month):
+    """某个月（YYYY-MM）的归档分区文件路径"""
+    return os.path.join(partition_dir(db_path), f"chat_records_{month}.db")
+
+
+def list_partitions(db_path):
+    """返回已有的归档分区 [(月份, 文件路径)]，按月份从新到旧排列"""
+    directory = partition_dir(db_path) if db_path else ''
+    if not directory or not os.path.isdir(directory):
+        return []
+    partitions = []
+    for filename in os.listdir(directory):
+        match = PARTITION_PATTERN.match(filename)
+        if match:
+            partitions.append((match.group(1), os.path.join(directory, filename)))
+    return sorted(partitions, reverse=True)
+
+
+def month_of(ts):
+    """毫秒时间戳所在的月份（本地时间，YYYY-MM）"""
+    return datetime.fromtimestamp(ts / 1000).strftime('%Y-%m')
+
+
+def month_range_ms(month):
+    """返回某个月（YYYY-MM）的 [起始, 结束) 毫秒时间戳"""
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return to_epoch_ms(start), to_epoch_ms(end)
+
+
+def days_ago_ms(days):
+    """days 天前（本地时间）零点的毫秒时间戳"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return to_epoch_ms(today - timedelta(days=days))
+
+
+class attach_partition:
+    """在 with 语句内将归档分区挂载为 part，退出时卸载；readonly 时以只读方式挂载"""
+
+    def __init__(self, conn, path, readonly=True):
+        self.conn = conn
+        self.path = path
+        self.readonly = readonly
+
+    def __enter__(self):
+        # 只读连接以 URI 方式打开，挂载时同样使用 URI 指定只读模式
+        target = f"file:{self.path}?mode=ro" if self.readonly else self.path
+        self.conn.execute("ATTACH DATABASE ? AS part", (target,))
+        return 'part'
+
+    def __exit__(self, *exc):
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        self.conn.execute("DETACH DATABASE part")
+
+
+def query_recent(conn, conditions, params, limit, cursor=None):
+    """按时间倒序查询消息，返回 [(ts, sender_name, message, group_id, id)]
+
+    先查主数据库，不足 limit 条时再从新到旧依次查询归档分区。cursor 为上一页最后一行的 (ts, id)，
+    只返回排在其后的记录（键集分页），每页的开销与翻到第几页无关。
+    """
+    conditions, params = list(conditions), list(params)
+    if cursor is not None:
+        # ts <= ? 可以使用索引范围扫描，同一毫秒内的记录再按 id 排除
+        conditions.append('r.ts <= ? AND (r.ts < ? OR r.id < ?)')
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = f'''
+    SELECT r.ts, s.sender_name, unpack_message(r.message), g.group_id, r.id
+    FROM {{table}} r
+    LEFT JOIN main.chat_senders s ON s.id = r.sender_key
+    LEFT JOIN main.chat_groups g ON g.id = r.group_key
+    {where}
+    ORDER BY r.ts DESC, r.id DESC LIMIT ?
+    '''
+    rows = conn.execute(sql.format(table='main.chat_records'), (*params, limit)).fetchall()
+    for month, path in list_partitions(database_path(conn)):
+        if len(rows) >= limit:
+            break
+        if cursor is not None and month_range_ms(month)[0] > cursor[0]:
+            continue
+        with attach_partition(conn, path) as schema:
+            rows += conn.execute(sql.format(table=f'{schema}.chat_records'), (*params, limit - len(rows))).fetchall()
+    return rows
+
+
+def partition_summary(conn):
+    """归档分区概况，返回 (分区数, 总字节数, 最早的月份)"""
+    partitions = list_partitions(database_path(conn))
+    total = sum(os.path.getsize(path) for _, path in partitions if os.path.exists(path))
+    return len(partitions), total, partitions[-1][0] if partitions else None
+
+
+def database_bytes(conn):
+    """数据库文件大小，返回 {'main': 主数据库, 'wal': WAL 文件, 'archive': 归档分区合计}"""
+    path = database_path(conn)
+    sizes = {}
+    for name, file_path in (('main', path), ('wal', f"{path}-wal")):
+        sizes[name] = os.path.getsize(file_path) if path and os.path.exists(file_path) else 0
+    sizes['archive'] = partition_summary(conn)[1] if path else 0
+    return sizes
+
+
+def iter_records(conn, group_id=None, since_ms=None, until_ms=None, batch_size=5000):
+    """按条件逐批读取完整记录（字段顺序见 RECORD_COLUMNS），每次产出最多 batch_size 行
+
+    先按月份从旧到新读取与时间范围重叠的归档分区，最后读取主数据库，各部分内按时间排序。
+    内存占用只与 batch_size 有关，与记录总数无关。
+    """
+    conditions, params = [], []
+    if group_id:
+        key = group_key(conn, group_id)
+        if key is None:
+            return
+        conditions.append('r.group_key = ?')
+        params.append(key)
+    if since_ms is not None:
+        conditions.append('r.ts >= ?')
+        params.append(since_ms)
+    if until_ms is not None:
+        conditions.append('r.ts < ?')
+        params.append(until_ms)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    sql = f'{RECORD_SELECT} {where} ORDER BY r.ts'
+
+    def fetch(table):
+        cursor = conn.execute(sql.format(table=table), params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    for month, path in reversed(list_partitions(database_path(conn))):
+        month_start, month_end = month_range_ms(month)
+        if (until_ms is not None and month_start >= until_ms) or (since_ms is not None and month_end <= since_ms):
+            continue
+        with attach_partition(conn, path) as schema:
+            yield from fetch(f'{schema}.chat_records')
+    yield from fetch('main.chat_records')
+
+
+def move_records(cursor, where, params, chunk_size, target=None):
+    """删除主数据库中满足条件的一块记录（按 ts 从旧到新），target 不为空时先复制到该库，返回处理的条数"""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS moving_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.moving_ids")
+    cursor.execute(
+        f"INSERT INTO temp.moving_ids SELECT id FROM main.chat_records WHERE {where} ORDER BY ts LIMIT ?",
+        (*params, chunk_size)
+    )
+    count = cursor.rowcount
+    if count <= 0:
+        return 0
+    if target is not None:
+        # 先复制再删除；主库为 WAL 模式时跨库提交不保证原子性，中断后重复执行时已复制的记录会被忽略
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO {target}.chat_records ({TABLE_COLUMNS})
+        SELECT {TABLE_COLUMNS} FROM main.chat_records WHERE id IN (SELECT id FROM temp.moving_ids)
+        ''')
+    if table_exists(cursor, 'chat_fts'):
+        cursor.execute("DELETE FROM chat_fts WHERE rowid IN (SELECT id FROM temp.moving_ids)")
+    cursor.execute("DELETE FROM main.chat_records WHERE id IN (SELECT id FROM temp.moving_ids)")
+    adjust_record_count(cursor, -count)
+    return count
+
+
+def archive_chunk(conn, hot_days, chunk_size=20000):
+    """将一块超过 hot_days 天的记录移入对应月份的归档分区，返回移动的条数，0 表示已全部归档
+
+    回填或分词尚未覆盖的记录暂不归档，以免聚合表和词频表缺少这部分数据。
+    """
+    db_path = database_path(conn)
+    if not db_path or pending_backfills(conn):
+        return 0
+    cursor = conn.cursor()
+    cutoff = days_ago_ms(hot_days)
+    row = cursor.execute("SELECT value FROM chat_meta WHERE key = 'terms_indexed_id'").fetchone()
+    indexed_id = int(row[0]) if row else 0
+    row = cursor.execute(
+        "SELECT ts FROM chat_records WHERE ts < ? AND id <= ? ORDER BY ts LIMIT 1", (cutoff, indexed_id)
+    ).fetchone()
+    if row is None:
+        return 0
+
+    month = month_of(row[0])
+    month_start, month_end = month_range_ms(month)
+    os.makedirs(partition_dir(db_path), exist_ok=True)
+    # ATTACH 不能在事务中执行
+    conn.commit()
+    with attach_partition(conn, partition_path(db_path, month), readonly=False) as schema:
+        try:
+            create_records_table(cursor, schema)
+            create_record_indexes(cursor, schema)
+            count = move_records(
+                cursor, "ts >= ? AND ts < ? AND id <= ?",
+                (month_start, min(month_end, cutoff), indexed_id), chunk_size, target=schema
+            )
+            # 分区写入了新数据，标记为需要重新压缩
+            cursor.execute(f"PRAGMA {schema}.user_version = 0")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return count
+
+
+def compact_partitions(conn, hot_days, chunk_size=20000):
+    """压缩已归档完毕（整月都早于热数据范围）且尚未压缩的分区，返回压缩的月份列表
+
+    启用了消息压缩时，先压缩分区中的消息正文再 VACUUM。
+    """
+    cutoff = days_ago_ms(hot_days)
+    codec = getattr(conn, 'codec', None)
+    # user_version 为 1 表示分区已压缩且之后没有新数据写入，为 2 表示消息正文也已压缩
+    done = 2 if codec is not None and codec.min_bytes else 1
+    compacted = []
+    for month, path in list_partitions(database_path(conn)):
+        if month_range_ms(month)[1] > cutoff:
+            continue
+        part = sqlite3.connect(path)
+        try:
+            # user_version 为 1 表示分区已压缩且之后没有新数据写入
+            if part.execute("PRAGMA user_version").fetchone()[0] >= done:
+                continue
+            if done == 2:
+                max_id = part.execute("SELECT IFNULL(MAX(id), 0) FROM chat_records").fetchone()[0]
+                for pos in range(0, max_id, chunk_size):
+                    compress_records(part.cursor(), pos, pos + chunk_size, codec)
+                    part.commit()
+            part.execute("VACUUM")
+            part.execute(f"PRAGMA user_version = {done}")
+            compacted.append(month)
+        finally:
+            part.close()
+    return compacted
+
+
+def delete_expired_chunk(conn, retention_days, chunk_size=20000):
+    """从主数据库删除一块超过保留期限的记录，返回删除的条数"""
+    cursor = conn.cursor()
+    try:
+        count = move_records(cursor, "ts < ?", (days_ago_ms(retention_days),), chunk_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+
+def drop_expired_partitions(conn, retention_days):
+    """删除整月都超过保留期限的归档分区，以及过期的聚合统计和词频，返回删除的月份列表"""
+    cutoff = days_ago_ms(retention_days)
+    cutoff_day = format_ms(cutoff)[:10]
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM chat_hourly_stats WHERE day < ?", (cutoff_day,))
+        cursor.execute("DELETE FROM chat_terms WHERE day < ?", (cutoff_day,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    dropped = []
+    for month, path in list_partitions(database_path(conn)):
+        if month_range_ms(month)[1] <= cutoff:
+            try:
+                os.remove(path)
+                dropped.append(month)
+            except OSError:
+                # 文件仍被其他连接占用（Windows）时留到下次维护再删除
+                pass
+    return dropped
+
+
+def vacuum_main(conn, max_pages=5000):
+    """回收主数据库的空闲页，返回回收前的空闲页数
+
+    auto_vacuum 为 INCREMENTAL 时每次最多回收 max_pages 页；旧数据库不是该模式时，
+    在空闲页超过一半（通常是刚归档完大量旧数据）时执行一次 VACUUM 切换模式，
+    此时耗时只与剩余的热数据量有关。
+    """
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if freelist <= 0:
+        return 0
+    conn.commit()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+    elif freelist * 2 > conn.execute("PRAGMA page_count").fetchone()[0]:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.commit()
+    return freelist
+
+
+class WriterConnection(sqlite3.Connection):
+    """写连接，附带维度表的键缓存和消息编码器（压缩配置由 create_tables 载入）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dimensions = Dimensions()
+        self.codec = None
+
+
+def connect_writer(db_path):
+    """打开写连接：WAL 模式下读写互不阻塞，synchronous=NORMAL 时每次提交不再强制 fsync"""
+    conn = sqlite3.connect(db_path, check_same_thread=False, factory=WriterConnection)
+    conn.codec = register_codec(conn, db_path)
+    # 只对尚未建表的新数据库生效，必须在切换 WAL 之前设置；删除或归档旧数据后可以逐步回收空间
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def connect_reader(db_path, mmap_size=256 * 1024 * 1024, cache_size_kb=64 * 1024):
+    """打开只读连接，开启内存映射和较大的页缓存，query_only 防止误写"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    register_codec(conn, db_path)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class ChatStorage:
+    """两个插件共享的数据库服务：一个写连接和一组只读连接，都在专用线程中使用
+
+    write()/read() 接收形如 func(conn, *args) 的同步函数，在对应线程中执行并返回结果，
+    不会阻塞事件循环。写操作在唯一的写线程中串行执行；读操作分配给只读连接池，
+    超时或被取消时通过 progress handler 中断正在执行的 SQL。
+    连接在第一次使用时才打开，只读取数据时不会创建数据库文件。
+    """
+
+    def __init__(self, db_path, readers=2, read_timeout=30):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.read_timeout = read_timeout
+        self.refs = 0
+        self.writer_conn = None
+        self.reader_conns = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-db-writer')
+        self.read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='chat-db-reader')
+        # 存储插件接受新消息时调用的 func(record)，统计插件借此更新实时活跃度
+        self.listeners = []
+
+    def configure(self, readers, read_timeout):
+        """修改只读连接数和默认查询超时
+
+        连接数变化时换用新的线程池，旧线程池执行完已提交的查询后退出，其连接在 close() 时关闭。
+        """
+        self.read_timeout = read_timeout
+        readers = max(1, readers)
+        if readers != self.readers:
+            old = self.read_executor
+            self.readers = readers
+            self.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='chat-db-reader')
+            old.shutdown(wait=False)
+
+    def add_listener(self, func):
+        """登记新消息的监听函数 func(record)，record 的字段顺序见 RECORD_FIELDS"""
+        if func not in self.listeners:
+            self.listeners.append(func)
+
+    def remove_listener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+
+    def notify(self, record):
+        """通知各监听函数收到一条新消息（已去重，并已写入、放入写入队列或写入暂存文件），在事件循环中同步调用"""
+        for func in list(self.listeners):
+            func(record)
+
+    def _writer(self):
+        if self.writer_conn is None:
+            self.writer_conn = connect_writer(self.db_path)
+        return self.writer_conn
+
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = connect_reader(self.db_path)
+            self.local.conn = conn
+            with self.lock:
+                self.reader_conns.append(conn)
+        return conn
+
+    async def write(self, func, *args):
+        """在写线程中执行 func(写连接, *args)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.write_executor, lambda: func(self._writer(), *args))
+
+    def _run_read(self, func, args, cancelled, deadline):
+        conn = self._reader()
+
+        def progress():
+            # 返回非 0 时 SQLite 中断当前语句，抛出 OperationalError: interrupted
+            return 1 if cancelled.is_set() or (deadline is not None and time.monotonic() > deadline) else 0
+
+        conn.set_progress_handler(progress, 10000)
+        try:
+            return func(conn, *args)
+        except sqlite3.OperationalError:
+            if deadline is not None and time.monotonic() > deadline:
+                raise asyncio.TimeoutError("数据库查询超时")
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+            if conn.in_transaction:
+                conn.rollback()
+
+    async def read(self, func, *args, timeout=None):
+        """在只读连接池中执行 func(只读连接, *args)，超过 timeout 秒（默认 read_timeout）时中断"""
+        timeout = self.read_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        cancelled = threading.Event()
+        future = self.read_executor.submit(self._run_read, func, args, cancelled, deadline)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            future.cancel()
+            raise
+
+    async def close(self):
+        """等待已提交的操作完成后关闭所有连接"""
+        await asyncio.to_thread(self.write_executor.shutdown, True)
+        await asyncio.to_thread(self.read_executor.shutdown, True)
+        if self.writer_conn is not None:
+            self.writer_conn.close()
+            self.writer_conn = None
+        with self.lock:
+            for conn in self.reader_conns:
+                conn.close()
+            self.reader_conns = []
+
+
+# 按数据库路径共享的服务实例，两个插件打开同一数据库时使用同一个实例
+_instances = {}
+
+
+def acquire(db_path, readers=2, read_timeout=30):
+    """获取数据库服务（不存在时创建），使用完毕后调用 release()
+
+    实例已存在时按本次的 readers 和 read_timeout 重新配置，两个插件以最后获取时的配置为准。
+    """
+    key = os.path.abspath(db_path)
+    instance = _instances.get(key)
+    if instance is None:
+        instance = ChatStorage(key, readers=readers, read_timeout=read_timeout)
+        _instances[key] = instance
+    else:
+        instance.configure(readers, read_timeout)
+    instance.refs += 1
+    return instance
+
+
+async def release(instance):
+    """释放数据库服务，最后一个使用者释放时关闭连接"""
+    instance.refs -= 1
+    if instance.refs <= 0:
+        _instances.pop(instance.db_path, None)
+        await instance.close()